@@ -1,11 +1,22 @@
 import os
 import json
-import concurrent.futures
+import asyncio
 from typing import Any, Dict, List, Mapping, Optional, Tuple
 from dotenv import load_dotenv
-from openai import Client, OpenAI
+from openai import AsyncOpenAI, Client, OpenAI
 import argparse
 
+from RedditReportGenerator.common.batch import (
+    BATCH_CONCURRENCY,
+    BATCH_ORDER,
+    BATCH_ORDERS,
+    BATCH_TOKEN_BUDGET,
+    CostModel,
+    run_batch,
+    run_batch_async,
+)
+from RedditReportGenerator.common.rate_limit import limited_client, llm_limiter
+from RedditReportGenerator.common.steps import Blocking, ModelInfo, Parallel, Steps, run_steps, run_steps_async
 from RedditReportGenerator.common.utils import get_logger
 from RedditReportGenerator.roles.domain_expert import DomainExpertAnalyst
 from RedditReportGenerator.roles.meta_controller import MetaController
@@ -14,7 +25,9 @@ from RedditReportGenerator.roles.question_solver import QuestionSolverAnalyst
 from RedditReportGenerator.roles.stateless_scorer import StatelessScorer
 
 from RedditReportGenerator.tools.annotated import *
+from RedditReportGenerator.tools.reddit_tools import get_user_profile
 from RedditReportGenerator.tools import annotated as tool_module
+from RedditReportGenerator.tools.tool_cache import disk_tool_cache, tool_cache
 
 # Load environment variables
 load_dotenv()
@@ -25,74 +38,76 @@ SUMMARIZING_MODEL_NAME = os.getenv("SUMMARIZING_MODEL", DEFAULT_MODEL_NAME)
 THINKING_MODEL_NAME = os.getenv("THINKING_MODEL", DEFAULT_MODEL_NAME)
 TOKEN_LIMIT = 128000
 
+# Perspectives analyzed at once in a workflow; LLM requests are limited separately
+EXPERT_CONCURRENCY = int(os.getenv("EXPERT_CONCURRENCY", "4"))
+
+# Seconds between checks for records appended to the dataset while serving
+DATA_REFRESH_SECONDS = float(os.getenv("DATA_REFRESH_SECONDS", "60"))
+
 # Initialize OpenAI client only when needed
 client = None
 
 # Model name can be set via command line
 command_line_model = None
 
+# Tools offered to the analysts
+ANALYSIS_TOOLS = [
+    get_user_post_activity,
+    get_user_comment_activity,
+    get_user_total_activity_count,
+    get_user_total_karma,
+    get_user_top_posts,
+    get_user_top_comments,
+    get_user_activity_keywords,
+    get_user_activity_sentiment,
+    get_user_post_comment_ratio,
+    get_community_overall_stats,
+    get_community_overall_sentiment,
+    get_community_top_authors,
+    get_community_post_frequency,
+    get_user_activity_timeline,
+    get_community_activity_timeline,
+    get_user_top_interlocutors,
+    get_user_reply_network,
+    get_user_influence_score,
+    get_community_top_influencers,
+    get_comment_thread_context,
+    get_user_comment_threads,
+    get_post_thread_engagement,
+    search_user_content,
+    search_community_content,
+    query_dataset_sql
+]
+
 
 def collect_fact(user_or_community_id: str, posts: List[Dict], comments: List[Dict]):
     """Collect initial facts about the user or community"""
-    user_posts = get_user_posts(user_or_community_id, posts)
-    user_comments = get_user_comments(user_or_community_id, comments)
-
-    # Calculate summary statistics instead of including full samples
-    post_scores = [p.get("score", 0) for p in user_posts]
-    comment_scores = [c.get("score", 0) for c in user_comments]
+    profile = get_user_profile(user_or_community_id, posts, comments)
+    user_posts, user_comments = profile.posts, profile.comments
 
+    # Summary statistics come from the precomputed profile instead of full samples
     fact = {
         "user_id": user_or_community_id,
-        "total_posts": len(user_posts),
-        "total_comments": len(user_comments),
-        "total_activity": len(user_posts) + len(user_comments),
-        "top_posts_count": min(5, len(user_posts)),
-        "top_comments_count": min(5, len(user_comments)),
-        "avg_post_score": sum(post_scores) / len(post_scores) if post_scores else 0,
-        "avg_comment_score": sum(comment_scores) / len(comment_scores) if comment_scores else 0,
-        "total_post_karma": sum(post_scores),
-        "total_comment_karma": sum(comment_scores),
+        "total_posts": user_posts.count,
+        "total_comments": user_comments.count,
+        "total_activity": user_posts.count + user_comments.count,
+        "top_posts_count": min(5, user_posts.count),
+        "top_comments_count": min(5, user_comments.count),
+        "avg_post_score": user_posts.avg_score,
+        "avg_comment_score": user_comments.avg_score,
+        "total_post_karma": user_posts.karma,
+        "total_comment_karma": user_comments.karma,
         # Only include minimal sample info, not full text
-        "posts_count": len(user_posts),
-        "comments_count": len(user_comments)
+        "posts_count": user_posts.count,
+        "comments_count": user_comments.count
     }
 
     return fact
 
 
-def workflow(user_or_community_id: str, analysis_categories: Mapping, posts: List[Dict], comments: List[Dict]):
-    """Main workflow for analyzing a Reddit user or community"""
-    logger = get_logger("Workflow", user_or_community_id)
-    logger.warning(f"Analyzing user/community: {user_or_community_id}")
-
-    # Set global data for tools to access
-    tool_module.set_global_data(posts, comments)
-    logger.info(f"Global data set: {len(posts)} posts, {len(comments)} comments")
-
-    global client
-    if client is None:
-        from openai import OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    all_available_tools = [
-        get_user_post_activity,
-        get_user_comment_activity,
-        get_user_total_activity_count,
-        get_user_total_karma,
-        get_user_top_posts,
-        get_user_top_comments,
-        get_user_activity_keywords,
-        get_user_activity_sentiment,
-        get_user_post_comment_ratio,
-        get_community_overall_stats,
-        get_community_top_authors,
-        get_community_post_frequency
-    ]
-
-    meta_controller = MetaController(DEFAULT_MODEL_NAME, client, user_or_community_id)
-    meta_plan = meta_controller.build_meta_plan(all_available_tools)
-
-    domain_experts = [
+def build_domain_experts(meta_plan, client, user_or_community_id: str) -> List[DomainExpertAnalyst]:
+    """Create an analyst for each perspective of the meta plan"""
+    return [
         DomainExpertAnalyst(
             DEFAULT_MODEL_NAME,
             client,
@@ -107,14 +122,34 @@ def workflow(user_or_community_id: str, analysis_categories: Mapping, posts: Lis
         for perspective in meta_plan.perspectives
     ]
 
-    transaction_fact = collect_fact(user_or_community_id, posts, comments)
 
-    transaction_fact = collect_fact(user_or_community_id, posts, comments)
+def analysis_steps(
+    user_or_community_id: str,
+    analysis_categories: Mapping,
+    posts: List[Dict],
+    comments: List[Dict],
+    client,
+    expert_concurrency: Optional[int] = None,
+) -> Steps:
+    """Steps of the analysis of a Reddit user or community (see common.steps)"""
+    logger = get_logger("Workflow", user_or_community_id)
+    logger.warning(f"Analyzing user/community: {user_or_community_id}")
 
-    main_analyst_reports = {}
+    # Set global data for tools to access (loading it on first use blocks)
+    tool_module.set_global_data(posts, comments)
+    posts, comments = yield Blocking(tool_module.get_global_data)
+    logger.info(f"Global data set: {len(posts)} posts, {len(comments)} comments")
+
+    meta_controller = MetaController(DEFAULT_MODEL_NAME, client, user_or_community_id)
+    meta_plan = yield from meta_controller.meta_plan_steps(ANALYSIS_TOOLS)
 
-    def run_expert(expert: DomainExpertAnalyst) -> Tuple[str, str]:
-        plan = expert.breakdown(user_or_community_id)
+    domain_experts = build_domain_experts(meta_plan, client, user_or_community_id)
+
+    transaction_fact = collect_fact(user_or_community_id, posts, comments)
+    model_info = yield ModelInfo(DEFAULT_MODEL_NAME)
+
+    def expert_steps(expert: DomainExpertAnalyst) -> Steps:
+        plan = yield from expert.breakdown_steps(user_or_community_id)
 
         chat_histories = []
         for todo in plan.items:
@@ -125,34 +160,41 @@ def workflow(user_or_community_id: str, analysis_categories: Mapping, posts: Lis
                 user_or_community_id=user_or_community_id,
                 known_facts=transaction_fact,
                 main_perspective=expert.perspective,
-                tools=all_available_tools,
+                tools=ANALYSIS_TOOLS,
+                model_info=model_info,
             )
 
-            chat_histories = sub_analyst.analyze(
+            chat_histories = yield from sub_analyst.analysis_steps(
                 chat_histories, breakdown_question, prompt=item_prompt
             )
 
-        analyzed_intent = expert.analyze(analysis_categories, chat_histories)
+        analyzed_intent = yield from expert.analysis_steps(analysis_categories, chat_histories)
         return expert.perspective, analyzed_intent
 
-    # Execute analyzers sequentially to avoid API rate limiting
-    for expert in domain_experts:
-        perspective, analyzed_intent = run_expert(expert)
-        main_analyst_reports[perspective] = analyzed_intent
+    # Perspectives are independent until the checker, so they run side by side
+    results = yield Parallel(
+        [expert_steps(expert) for expert in domain_experts],
+        limit=expert_concurrency or EXPERT_CONCURRENCY,
+    )
+    main_analyst_reports = dict(results)
 
     checker = StatelessChecker(DEFAULT_MODEL_NAME, client, user_or_community_id)
-    check_report = checker.check(
+    check_report = yield from checker.check_steps(
         user_or_community_id, analysis_categories, main_analyst_reports
     )
 
     logger.info("check_report {}".format(check_report))
 
     scorer = StatelessScorer(DEFAULT_MODEL_NAME, client, user_or_community_id)
-    final_report = scorer.score(
+    final_report = yield from scorer.score_steps(
         user_or_community_id, main_analyst_reports, check_report, analysis_categories
     )
 
     logger.warning("Final report: {}".format(final_report))
+    logger.info("LLM requests: {}".format(llm_limiter.stats()))
+    logger.info("Tool cache: {}".format(tool_cache.stats()))
+    if disk_tool_cache is not None:
+        logger.info("Persistent tool cache: {}".format(disk_tool_cache.stats()))
 
     return {
         "perspective_reports": main_analyst_reports,
@@ -161,6 +203,50 @@ def workflow(user_or_community_id: str, analysis_categories: Mapping, posts: Lis
     }
 
 
+def workflow(
+    user_or_community_id: str,
+    analysis_categories: Mapping,
+    posts: List[Dict],
+    comments: List[Dict],
+    expert_concurrency: Optional[int] = None,
+):
+    """Main workflow for analyzing a Reddit user or community
+
+    Perspectives are analyzed concurrently on threads, expert_concurrency at
+    a time (default: EXPERT_CONCURRENCY); every LLM request goes through the
+    shared limiter.
+    """
+    # Workflows of a batch run on several threads at once, so the module's
+    # client is only read here and the limited one is passed to the roles
+    limited = limited_client(client or OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
+    return run_steps(
+        analysis_steps(user_or_community_id, analysis_categories, posts, comments, limited, expert_concurrency),
+        limited,
+    )
+
+
+async def async_workflow(
+    user_or_community_id: str,
+    analysis_categories: Mapping,
+    posts: List[Dict],
+    comments: List[Dict],
+    expert_concurrency: Optional[int] = None,
+    async_client: Optional[AsyncOpenAI] = None,
+):
+    """Asyncio version of workflow() on an AsyncOpenAI client
+
+    Perspectives run as tasks of one event loop (expert_concurrency at a
+    time) and tools on worker threads, so a single process can drive many
+    analyses without a thread per request. If a perspective fails, or the
+    caller is cancelled, the perspectives still running are cancelled.
+    """
+    limited = limited_client(async_client or AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")))
+    return await run_steps_async(
+        analysis_steps(user_or_community_id, analysis_categories, posts, comments, limited, expert_concurrency),
+        limited,
+    )
+
+
 def start():
     """Start the analysis from config file"""
     parser = argparse.ArgumentParser(description="Reddit Report Generator")
@@ -168,8 +254,13 @@ def start():
     parser.add_argument("--config", type=str, default="config.json")
     parser.add_argument("--openai-api-key", type=str)
     parser.add_argument("--openai-base-url", type=str)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--token-budget", type=int, default=BATCH_TOKEN_BUDGET)
+    parser.add_argument("--order", type=str, choices=BATCH_ORDERS, default=BATCH_ORDER)
+    parser.add_argument("--async", dest="use_async", action="store_true")
 
-    args = parser.parse_args()
+    import sys
+    args = parser.parse_args(sys.argv[2:])
 
     config = json.load(open(args.config))
 
@@ -195,11 +286,40 @@ def start():
     posts = load_reddit_posts()
     comments = load_reddit_comments()
 
-    for user_or_community_id in users:
-        if os.path.exists(os.path.join("score_reports", f"{user_or_community_id}.output.md")):
-            print(f"User/community {user_or_community_id} already analyzed.")
-            continue
-        workflow(user_or_community_id, analysis_categories, posts, comments)
+    # Load the data once, before the analyses share it
+    tool_module.set_global_data(posts, comments)
+    posts, comments = tool_module.get_global_data()
+
+    def analyze(user_or_community_id: str):
+        return workflow(user_or_community_id, analysis_categories, posts, comments)
+
+    async def analyze_batch_async() -> Dict:
+        # Every analysis of the batch runs on this loop, with one client
+        async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+        def analyze_async(user_or_community_id: str):
+            return async_workflow(user_or_community_id, analysis_categories, posts, comments, async_client=async_client)
+
+        return await run_batch_async(users, analyze_async, **batch_options)
+
+    # Analyses are predicted to cost more the more a user has posted and commented
+    def activity(user_or_community_id: str) -> int:
+        return get_user_total_activity_count(user_or_community_id)["total_activity"]
+
+    batch_options = dict(
+        concurrency=args.concurrency,
+        token_budget=args.token_budget,
+        costs=CostModel(activity),
+        order=args.order,
+    )
+    if args.use_async:
+        summary = asyncio.run(analyze_batch_async())
+    else:
+        summary = run_batch(users, analyze, **batch_options)
+    print(
+        f"Batch complete: {summary['completed']} analyzed, {summary['skipped']} already analyzed, "
+        f"{summary['failed']} failed, {summary['deferred']} deferred ({summary['users_per_hour']:.1f} users/hour)"
+    )
 
 
 def analyze_single_user():
@@ -245,31 +365,77 @@ def list_top_authors():
     import sys
     args = parser.parse_args(sys.argv[2:])
 
-    from RedditReportGenerator.tools.annotated import load_reddit_posts, load_reddit_comments, get_community_top_authors
+    from RedditReportGenerator.tools.annotated import (
+        load_reddit_posts,
+        load_reddit_comments,
+        get_community_overall_stats,
+        get_community_top_authors,
+    )
 
     posts = load_reddit_posts()
     comments = load_reddit_comments()
 
+    # Both calls are served from the same community aggregates
     top_authors = get_community_top_authors(posts, comments, args.limit)
+    total_authors = get_community_overall_stats(posts, comments)["total_authors"]
 
-    print(f"Top {args.limit} authors in the dataset:")
+    print(f"Top {args.limit} of {total_authors} authors in the dataset:")
     for i, author in enumerate(top_authors, 1):
         print(f"{i}. {author['author']}: {author['activity_count']} activities")
 
     return top_authors
 
 
+def ingest_dataset():
+    """Convert the JSONL datasets into memory-mapped columnar snapshots"""
+    parser = argparse.ArgumentParser(description="Build columnar snapshots of the Reddit dataset")
+    parser.add_argument("--posts", type=str, default="r_OpenAI_posts.jsonl", help="Posts JSONL file")
+    parser.add_argument("--comments", type=str, default="r_OpenAI_comments.jsonl", help="Comments JSONL file")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for parsing JSONL")
+    import sys
+    args = parser.parse_args(sys.argv[2:])
+
+    from RedditReportGenerator.tools.reddit_snapshot import snapshot_path, write_snapshot
+
+    for file_path in (args.posts, args.comments):
+        manifest = write_snapshot(file_path, workers=args.workers)
+        print(f"Ingested {manifest['rows']} records from {file_path} into {snapshot_path(file_path)}")
+
+
 # Run with fastapi
 def serve():
+    import threading
+    import time
     import uvicorn
     from fastapi import FastAPI
 
+    set_global_data(load_reddit_posts(), load_reddit_comments())
+
+    def refresh_loop():
+        while True:
+            try:
+                # Influence scores are updated from the previous ones, off the request path
+                update_global_influence()
+            except Exception as e:
+                print(f"Error updating influence scores: {e}")
+            time.sleep(DATA_REFRESH_SECONDS)
+            try:
+                refresh_global_data()
+            except Exception as e:
+                print(f"Error refreshing dataset: {e}")
+
+    threading.Thread(target=refresh_loop, daemon=True).start()
+
     app = FastAPI()
 
     @app.get("/")
     async def read_root():
         return {"Hello": "World"}
 
+    @app.post("/refresh")
+    def refresh():
+        return refresh_global_data()
+
     @app.get("/start")
     async def read_item():
         return {"status": "success"}
@@ -303,7 +469,27 @@ if __name__ == "__main__":
     subparsers = parser.add_subparsers(title="Commands", dest="command")
 
     # Start command
-    subparsers.add_parser("start", help="Start analysis from config file")
+    start_parser = subparsers.add_parser("start", help="Start analysis from config file")
+    start_parser.add_argument("--pwd", type=str, default=".", help="Working directory")
+    start_parser.add_argument("--config", type=str, default="config.json", help="Configuration file")
+    start_parser.add_argument("--openai-api-key", type=str, help="OpenAI API key")
+    start_parser.add_argument("--openai-base-url", type=str, help="OpenAI base URL")
+    start_parser.add_argument(
+        "--concurrency", type=int, default=BATCH_CONCURRENCY, help="Users/communities analyzed at once"
+    )
+    start_parser.add_argument(
+        "--token-budget", type=int, default=BATCH_TOKEN_BUDGET, help="LLM tokens after which no analyses are started"
+    )
+    start_parser.add_argument(
+        "--order",
+        type=str,
+        choices=BATCH_ORDERS,
+        default=BATCH_ORDER,
+        help="Start the analyses with the longest or shortest predicted, or in config order",
+    )
+    start_parser.add_argument(
+        "--async", dest="use_async", action="store_true", help="Run the batch on one asyncio loop and AsyncOpenAI"
+    )
 
     # Analyze single user command
     analyze_parser = subparsers.add_parser("analyze", help="Analyze a single user")
@@ -311,11 +497,20 @@ if __name__ == "__main__":
     analyze_parser.add_argument("--pwd", type=str, default=".", help="Working directory")
     analyze_parser.add_argument("--openai-api-key", type=str, help="OpenAI API key")
     analyze_parser.add_argument("--openai-base-url", type=str, help="OpenAI base URL")
+    analyze_parser.add_argument(
+        "--async", dest="use_async", action="store_true", help="Run the pipeline on asyncio and AsyncOpenAI"
+    )
 
     # List top authors command
     list_parser = subparsers.add_parser("list-authors", help="List top authors from dataset")
     list_parser.add_argument("--limit", type=int, default=10, help="Number of top authors to list")
 
+    # Ingest command
+    ingest_parser = subparsers.add_parser("ingest", help="Build memory-mapped snapshots of the dataset")
+    ingest_parser.add_argument("--posts", type=str, default="r_OpenAI_posts.jsonl", help="Posts JSONL file")
+    ingest_parser.add_argument("--comments", type=str, default="r_OpenAI_comments.jsonl", help="Comments JSONL file")
+    ingest_parser.add_argument("--workers", type=int, default=None, help="Worker processes for parsing JSONL")
+
     # Serve command
     subparsers.add_parser("serve", help="Start FastAPI server")
 
@@ -326,6 +521,8 @@ if __name__ == "__main__":
 
     if args.command == "list-authors":
         list_top_authors()
+    elif args.command == "ingest":
+        ingest_dataset()
     else:
         from RedditReportGenerator.roles.domain_expert import DomainExpertAnalyst
         from RedditReportGenerator.roles.meta_controller import MetaController
@@ -335,7 +532,7 @@ if __name__ == "__main__":
 
         # Initialize OpenAI client only for commands that need it
         from openai import OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        client = limited_client(OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
 
         if args.command == "start":
             start()
@@ -347,7 +544,10 @@ if __name__ == "__main__":
             analysis_categories = json.load(open("analysis_categories.json"))
             posts = load_reddit_posts()
             comments = load_reddit_comments()
-            result = workflow(args.user, analysis_categories, posts, comments)
+            if args.use_async:
+                result = asyncio.run(async_workflow(args.user, analysis_categories, posts, comments))
+            else:
+                result = workflow(args.user, analysis_categories, posts, comments)
             print(f"Analysis complete. Report saved to score_reports/{args.user}.output.md")
         elif args.command == "serve":
             serve()
@@ -0,0 +1,453 @@
+"""
+Concurrent analysis of a batch of users and communities.
+
+A batch runs up to a fixed number of analyses at once, on threads
+(run_batch) or as tasks of one event loop (run_batch_async). They share
+the loaded dataset, the tool caches and the LLM limiter, so the limiter
+(not the batch) bounds the requests in flight. Users whose report already
+exists are skipped when their turn comes, so an interrupted batch resumes
+where it stopped, and two batches over the same directory don't redo each
+other's users. Once the batch has used its token budget, no further
+analyses are started and the ones running are finished.
+
+A failed analysis is logged and counted; it does not stop the batch.
+Progress and throughput are logged after every analysis.
+
+Analyses are started in order of their predicted cost: the tokens each
+analysis used are recorded with the activity (posts and comments) of its
+user, and tokens are fitted as a linear function of activity, which the
+dataset gives for every user before any request. Starting the heaviest
+first keeps a few large analyses from prolonging the end of the batch;
+starting the lightest first gets the first reports out soonest. With a
+token budget, analyses are packed into what is left of it: the next one
+started is the first, in that order, whose predicted tokens still fit.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from RedditReportGenerator.common.rate_limit import RateLimiter, UsageMeter, llm_limiter, metered
+from RedditReportGenerator.common.utils import get_logger, run_tasks
+
+# Analyses running at once in a batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# LLM tokens after which a batch starts no more analyses (0: unlimited)
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", "0"))
+
+# Order in which analyses are started: "longest" first (shortest batch),
+# "shortest" first (first reports soonest) or "config" (as listed)
+BATCH_ORDER = os.getenv("BATCH_ORDER", "longest")
+BATCH_ORDERS = ("longest", "shortest", "config")
+
+# Activity and tokens of past analyses, kept across batches
+BATCH_HISTORY_FILE = os.getenv("BATCH_HISTORY_FILE", "batch_history.json")
+
+REPORTS_DIRECTORY = "score_reports"
+
+
+def report_exists(user_or_community_id: str) -> bool:
+    """Check whether the final report of a user/community was already written"""
+    return os.path.exists(os.path.join(REPORTS_DIRECTORY, f"{user_or_community_id}.output.md"))
+
+
+class CostModel:
+    """Predicts the LLM tokens of an analysis from the activity of its user
+
+    Args:
+        activity: Gets the number of posts and comments of an ID
+        path: JSON file of past analyses ("" keeps them in memory only)
+
+    Until an analysis has been recorded there is nothing to predict tokens
+    from; IDs are then only ranked by activity.
+    """
+
+    def __init__(self, activity: Callable[[str], int], path: str = BATCH_HISTORY_FILE):
+        self.activity_of = activity
+        self.path = path
+        self.activities: Dict[str, int] = {}
+        self.history: Dict[str, Dict] = self._load()
+        self.base: Optional[float] = None
+        self.per_activity: Optional[float] = None
+        self.lock = threading.Lock()
+        self._fit()
+
+    def _load(self) -> Dict[str, Dict]:
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring batch history {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        if not self.path:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.history, f, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
+
+    def _fit(self):
+        """Fit tokens = base + per_activity * activity by least squares"""
+        points = [(entry["activity"], entry["tokens"]) for entry in self.history.values() if entry.get("tokens")]
+        if not points:
+            return
+        count = len(points)
+        mean_activity = sum(activity for activity, _ in points) / count
+        mean_tokens = sum(tokens for _, tokens in points) / count
+        variance = sum((activity - mean_activity) ** 2 for activity, _ in points)
+        covariance = sum((activity - mean_activity) * (tokens - mean_tokens) for activity, tokens in points)
+        slope = covariance / variance if variance else 0.0
+        base = mean_tokens - slope * mean_activity
+        if slope <= 0 or base < 0:
+            # Too few or too scattered analyses for a line; assume tokens
+            # proportional to activity (or the same for everyone)
+            slope = mean_tokens / mean_activity if mean_activity else 0.0
+            base = 0.0 if mean_activity else mean_tokens
+        self.base, self.per_activity = base, slope
+
+    @property
+    def calibrated(self) -> bool:
+        """Whether tokens can be predicted (some analysis was recorded)"""
+        return self.base is not None
+
+    def activity(self, user_or_community_id: str) -> int:
+        activity = self.activities.get(user_or_community_id)
+        if activity is None:
+            activity = self.activities[user_or_community_id] = self.activity_of(user_or_community_id)
+        return activity
+
+    def estimate(self, user_or_community_id: str) -> Optional[float]:
+        """Predicted tokens of an analysis, or None before any was recorded
+
+        An ID analyzed before is predicted the tokens it used then.
+        """
+        with self.lock:
+            past = self.history.get(user_or_community_id)
+            if past and past.get("tokens"):
+                return float(past["tokens"])
+            if self.base is None:
+                return None
+            return self.base + self.per_activity * self.activity(user_or_community_id)
+
+    def record(self, user_or_community_id: str, tokens: int, seconds: float):
+        """Add a finished analysis to the history and refit"""
+        with self.lock:
+            self.history[user_or_community_id] = {
+                "activity": self.activity(user_or_community_id),
+                "tokens": tokens,
+                "seconds": round(seconds, 1),
+            }
+            self._fit()
+            try:
+                self._save()
+            except OSError as e:
+                logging.warning(f"Could not save batch history {self.path}: {e}")
+
+
+def schedule(users: Iterable[str], costs: Optional[CostModel] = None, order: str = BATCH_ORDER) -> List[str]:
+    """Order IDs (without duplicates) by predicted cost, then activity
+
+    Args:
+        users: IDs of the users and communities
+        costs: Cost model; without it the IDs keep their order
+        order: "longest" first, "shortest" first, or "config" to keep the order
+
+    Returns:
+        The IDs in the order to start them; ties keep their order
+    """
+    if order not in BATCH_ORDERS:
+        raise ValueError(f"Unknown batch order {order!r}, expected one of {BATCH_ORDERS}")
+    users = list(dict.fromkeys(users))
+    if costs is None or order == "config":
+        return users
+    return sorted(
+        users,
+        key=lambda user: (costs.estimate(user) or 0.0, costs.activity(user)),
+        reverse=order == "longest",
+    )
+
+
+class BatchProgress:
+    """Counts of a batch's analyses and its throughput
+
+    Args:
+        total: Number of users and communities in the batch
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.deferred = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, outcome: str):
+        """Count an analysis as "completed", "failed", "skipped" or "deferred" """
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def users_per_hour(self) -> float:
+        """Analyses completed per hour since the batch started"""
+        hours = (time.monotonic() - self.started) / 3600
+        return self.completed / hours if hours > 0 else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            remaining = self.total - self.completed - self.failed - self.skipped - self.deferred
+            rate = self.users_per_hour()
+            return {
+                "total": self.total,
+                "completed": self.completed,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "deferred": self.deferred,
+                "remaining": remaining,
+                "elapsed_seconds": time.monotonic() - self.started,
+                "users_per_hour": rate,
+                "eta_hours": remaining / rate if rate else None,
+            }
+
+
+class _Batch:
+    """State of a running batch, shared by its thread and asyncio drivers
+
+    Drivers take IDs to start from next_user() while they run fewer than
+    concurrency analyses, count them in running while they run, and report
+    each with completed() or failed().
+    """
+
+    def __init__(
+        self,
+        users: Iterable[str],
+        concurrency: int,
+        token_budget: int,
+        limiter: RateLimiter,
+        is_done: Callable[[str], bool],
+        costs: Optional[CostModel],
+        order: str,
+    ):
+        self.logger = get_logger("Batch", "batch")
+        self.pending = schedule(users, costs, order)
+        self.progress = BatchProgress(len(self.pending))
+        self.concurrency = max(1, concurrency)
+        self.token_budget = token_budget
+        self.limiter = limiter
+        self.is_done = is_done
+        self.costs = costs
+        self.tokens_at_start = limiter.stats()["tokens_used"]
+        self.estimates = {user: costs.estimate(user) for user in self.pending} if costs is not None else {}
+        self.packing = bool(token_budget) and costs is not None and costs.calibrated
+        # Driver's handle of each running analysis -> (ID, meter)
+        self.running: Dict[Any, tuple] = {}
+
+        self.logger.warning(
+            f"Starting batch of {self.progress.total} users/communities, {self.concurrency} at a time"
+            + (f", {order} first" if costs is not None and order != "config" else "")
+        )
+
+    def tokens_used(self) -> int:
+        return self.limiter.stats()["tokens_used"] - self.tokens_at_start
+
+    def committed(self) -> float:
+        """Tokens used, plus those the running analyses are predicted to use still"""
+        return self.tokens_used() + sum(
+            max(0.0, (self.estimates.get(user) or 0.0) - meter.tokens) for user, meter in self.running.values()
+        )
+
+    def _take(self) -> Optional[str]:
+        """Take the first pending ID that fits in the budget, or None"""
+        if not self.token_budget:
+            return self.pending.pop(0)
+        if not self.packing:
+            return self.pending.pop(0) if self.tokens_used() < self.token_budget else None
+        left = self.token_budget - self.committed()
+        for position, user in enumerate(self.pending):
+            if (self.estimates.get(user) or 0.0) <= left:
+                return self.pending.pop(position)
+        return None
+
+    def next_user(self) -> Optional[str]:
+        """Take the next ID to analyze, skipping those already analyzed
+
+        Returns:
+            The ID, or None when none is pending or none fits in the budget
+        """
+        while self.pending:
+            user_or_community_id = self._take()
+            if user_or_community_id is None:
+                return None
+            if not self.is_done(user_or_community_id):
+                return user_or_community_id
+            self.logger.info(f"User/community {user_or_community_id} already analyzed.")
+            self.progress.record("skipped")
+        return None
+
+    def defer_pending(self):
+        """Give up on the pending IDs once nothing running can free budget for them"""
+        if self.pending:
+            self.logger.warning(
+                f"Token budget of {self.token_budget} used up, not starting {len(self.pending)} users/communities"
+            )
+            for _ in self.pending:
+                self.progress.record("deferred")
+            self.pending.clear()
+
+    def completed(self, user_or_community_id: str, meter: UsageMeter, seconds: float):
+        self.progress.record("completed")
+        estimate = self.estimates.get(user_or_community_id)
+        self.logger.info(
+            f"Analysis of {user_or_community_id} finished in {seconds / 60:.1f} min, "
+            f"{meter.tokens} tokens" + (f" (predicted {estimate:.0f})" if estimate is not None else "")
+        )
+        if self.costs is not None:
+            self.costs.record(user_or_community_id, meter.tokens, seconds)
+        _log_progress(self.logger, self.progress.summary(), self.tokens_used())
+
+    def failed(self, user_or_community_id: str, error: Exception):
+        self.progress.record("failed")
+        self.logger.error(f"Analysis of {user_or_community_id} failed: {error!r}")
+        _log_progress(self.logger, self.progress.summary(), self.tokens_used())
+
+    def summary(self) -> Dict[str, Any]:
+        summary = self.progress.summary()
+        summary["tokens_used"] = self.tokens_used()
+        self.logger.warning(f"Batch finished: {summary}")
+        return summary
+
+
+def run_batch(
+    users: Iterable[str],
+    analyze: Callable[[str], Any],
+    concurrency: int = BATCH_CONCURRENCY,
+    token_budget: int = BATCH_TOKEN_BUDGET,
+    limiter: RateLimiter = llm_limiter,
+    is_done: Callable[[str], bool] = report_exists,
+    costs: Optional[CostModel] = None,
+    order: str = BATCH_ORDER,
+) -> Dict[str, Any]:
+    """Analyze users and communities, several at a time on threads
+
+    Args:
+        users: IDs of the users and communities (duplicates are analyzed once)
+        analyze: Runs the whole analysis of one ID
+        concurrency: Analyses running at once
+        token_budget: LLM tokens, counted by the limiter, after which no
+            further analyses are started (0: unlimited)
+        limiter: Limiter the analyses' requests go through
+        is_done: Whether an ID already has its report and is skipped
+        costs: Predicts the tokens of each analysis and records the tokens
+            it used (optional; without it IDs are started in the given order)
+        order: Order of predicted cost to start the analyses in (see schedule())
+
+    Returns:
+        Summary of the batch: counts of completed, failed, skipped and
+        deferred (not started for lack of budget) analyses, and throughput
+    """
+    batch = _Batch(users, concurrency, token_budget, limiter, is_done, costs, order)
+
+    def timed(user_or_community_id: str, meter: UsageMeter) -> float:
+        started = time.monotonic()
+        with metered(meter):
+            analyze(user_or_community_id)
+        return time.monotonic() - started
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=batch.concurrency, thread_name_prefix="batch") as executor:
+        while batch.pending or batch.running:
+            while len(batch.running) < batch.concurrency:
+                user_or_community_id = batch.next_user()
+                if user_or_community_id is None:
+                    break
+                meter = UsageMeter()
+                future = executor.submit(timed, user_or_community_id, meter)
+                batch.running[future] = (user_or_community_id, meter)
+
+            if not batch.running:
+                batch.defer_pending()
+                break
+            finished, _ = concurrent.futures.wait(batch.running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                user_or_community_id, meter = batch.running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    batch.failed(user_or_community_id, e)
+                else:
+                    batch.completed(user_or_community_id, meter, seconds)
+
+    return batch.summary()
+
+
+async def run_batch_async(
+    users: Iterable[str],
+    analyze: Callable[[str], Awaitable],
+    concurrency: int = BATCH_CONCURRENCY,
+    token_budget: int = BATCH_TOKEN_BUDGET,
+    limiter: RateLimiter = llm_limiter,
+    is_done: Callable[[str], bool] = report_exists,
+    costs: Optional[CostModel] = None,
+    order: str = BATCH_ORDER,
+) -> Dict[str, Any]:
+    """Like run_batch, with the analyses as tasks of the running event loop
+
+    analyze returns a coroutine running the analysis of one ID. concurrency
+    workers take the IDs in turn, so a single loop and thread drive every
+    analysis of the batch. If the caller is cancelled, so are the running
+    analyses.
+    """
+    batch = _Batch(users, concurrency, token_budget, limiter, is_done, costs, order)
+    finished = asyncio.Condition()
+
+    async def worker():
+        while batch.pending:
+            user_or_community_id = batch.next_user()
+            if user_or_community_id is None:
+                if not batch.running:
+                    break
+                # The analyses running may leave budget for another when they finish
+                async with finished:
+                    await finished.wait()
+                continue
+
+            meter = UsageMeter()
+            key = object()
+            batch.running[key] = (user_or_community_id, meter)
+            started = time.monotonic()
+            try:
+                with metered(meter):
+                    await analyze(user_or_community_id)
+            except Exception as e:
+                batch.failed(user_or_community_id, e)
+            else:
+                batch.completed(user_or_community_id, meter, time.monotonic() - started)
+            finally:
+                del batch.running[key]
+                async with finished:
+                    finished.notify_all()
+
+    await run_tasks([worker] * batch.concurrency)
+    batch.defer_pending()
+    return batch.summary()
+
+
+def _log_progress(logger, summary: Dict[str, Any], tokens: int):
+    done = summary["completed"] + summary["failed"] + summary["skipped"]
+    eta = f", about {summary['eta_hours']:.1f} h left" if summary["eta_hours"] is not None else ""
+    logger.warning(
+        f"Batch progress: {done}/{summary['total']} "
+        f"({summary['completed']} completed, {summary['failed']} failed, {summary['skipped']} skipped), "
+        f"{summary['users_per_hour']:.1f} users/hour, {tokens} tokens{eta}"
+    )
@@ -0,0 +1,472 @@
+"""
+Process-wide, adaptive limit on LLM requests.
+
+Roles run on several threads at once (one per perspective), and all of
+their chat completions go through one shared limiter, so the provider's
+limits are respected in one place instead of by running work sequentially
+or sleeping a fixed time after errors.
+
+The limiter combines:
+
+- token buckets on requests and tokens per minute, each holding at most a
+  minute's worth; a request reserves one request and an estimate of its
+  tokens, and the estimate is corrected once the response reports usage
+- a cap on the requests in flight
+- AIMD: a rate-limit response halves the rates (multiplicative decrease)
+  and pauses every request for the ``Retry-After`` the provider asked for,
+  or an exponential backoff; each success raises them again by a small
+  step of the configured ceiling (additive increase)
+
+Rate-limited requests are retried by the limiter, so roles only see a
+rate-limit error once its retries are exhausted. Clients of either kind
+can be wrapped: completions of an async client are awaited through the
+same buckets and the same cap on requests in flight, which threads and
+tasks of any event loop share.
+"""
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import email.utils
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional
+
+# Configured ceilings (0 disables a bucket) and requests in flight at once,
+# across all roles and threads
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "150000"))
+LLM_MAX_CONCURRENT_REQUESTS = int(os.getenv("LLM_MAX_CONCURRENT_REQUESTS", "8"))
+
+# Retries of a rate-limited request before its error is raised
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "8"))
+
+# Completion tokens assumed for a request that doesn't set max_tokens
+COMPLETION_TOKENS_ESTIMATE = 1000
+
+# AIMD: share of the ceiling regained per success, factor applied on a rate
+# limit, and the lowest share of the ceiling the rates drop to
+AIMD_INCREASE = 0.02
+AIMD_DECREASE = 0.5
+AIMD_MIN_SCALE = 0.05
+
+# Longest wait between retries when the provider gives no Retry-After
+MAX_BACKOFF_SECONDS = 60.0
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Check whether an API error asks to slow down (HTTP 429 or a quota message)"""
+    if getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError":
+        return True
+    message = str(error).lower()
+    return any(phrase in message for phrase in ("rate limit", "quota", "too many requests", "resource exhausted"))
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Get the seconds the provider asked to wait before retrying, if it did"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given (1-based) attempt"""
+    return min(MAX_BACKOFF_SECONDS, 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+def estimate_tokens(request: Dict) -> int:
+    """Estimate the tokens a chat completion request uses (about 4 characters per token)"""
+    prompt = sum(len(json.dumps(message, default=str)) for message in request.get("messages", ()))
+    if request.get("tools"):
+        prompt += len(json.dumps(request["tools"], default=str))
+    return prompt // 4 + (request.get("max_tokens") or COMPLETION_TOKENS_ESTIMATE)
+
+
+class UsageMeter:
+    """Requests and tokens used by the completions made within metered()"""
+
+    def __init__(self):
+        self.requests = 0
+        self.tokens = 0
+        self.lock = threading.Lock()
+
+    def add(self, tokens: Optional[int]):
+        with self.lock:
+            self.requests += 1
+            self.tokens += tokens or 0
+
+
+_usage_meter: "contextvars.ContextVar[Optional[UsageMeter]]" = contextvars.ContextVar("usage_meter", default=None)
+
+
+@contextlib.contextmanager
+def metered(meter: Optional[UsageMeter] = None) -> Iterator[UsageMeter]:
+    """Count the usage of the completions made in this context
+
+    Tasks and asyncio.to_thread inherit the context; work submitted to an
+    executor has to be run in a copy of it (contextvars.copy_context().run).
+
+    Args:
+        meter: Meter to count on, e.g. to read it from another thread (default: a new one)
+    """
+    if meter is None:
+        meter = UsageMeter()
+    token = _usage_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _usage_meter.reset(token)
+
+
+class TokenBucket:
+    """Refills at a rate per minute, holding at most a minute's worth
+
+    Reservations may take the level below zero; the caller then waits until
+    the bucket has refilled to cover them, so concurrent callers are served
+    in the order they reserved.
+    """
+
+    def __init__(self, per_minute: float):
+        self.ceiling = per_minute
+        self.rate = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.rate, self.level + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take an amount and get the seconds to wait before using it"""
+        if not self.ceiling:
+            return 0.0
+        self._refill(now)
+        self.level -= amount
+        return max(0.0, -self.level * 60 / self.rate)
+
+    def adjust(self, amount: float):
+        """Take (or give back, if negative) an amount after the fact"""
+        if self.ceiling:
+            self.level -= amount
+
+    def scale(self, factor: float, now: float):
+        """Set the rate to a share of the ceiling"""
+        if self.ceiling:
+            self._refill(now)
+            self.rate = self.ceiling * factor
+            self.level = min(self.level, self.rate)
+
+
+class _SlotWaiter:
+    def __init__(self, wake: Callable[[], None]):
+        self.wake = wake
+        self.granted = False
+
+
+def _set_granted(future: "asyncio.Future"):
+    if not future.done():
+        future.set_result(None)
+
+
+class RequestSlots:
+    """Caps the requests in flight across threads and event loops
+
+    Used with ``with`` on a thread and ``async with`` in a coroutine. A freed
+    slot is handed to the longest waiting caller, whichever kind it is;
+    a waiting task is woken on its own loop.
+
+    Args:
+        limit: Requests in flight at once
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiters: "collections.deque[_SlotWaiter]" = collections.deque()
+        self.lock = threading.Lock()
+
+    def _take(self, waiter: _SlotWaiter) -> bool:
+        """Take a free slot, or queue the waiter for the next one freed"""
+        with self.lock:
+            if self.in_flight < self.limit and not self.waiters:
+                self.in_flight += 1
+                return True
+            self.waiters.append(waiter)
+            return False
+
+    def _abandon(self, waiter: _SlotWaiter):
+        """Stop waiting, giving back the slot if it was handed over meanwhile"""
+        with self.lock:
+            if not waiter.granted:
+                self.waiters.remove(waiter)
+                return
+        self.release()
+
+    def acquire(self):
+        granted = threading.Event()
+        waiter = _SlotWaiter(granted.set)
+        if self._take(waiter):
+            return
+        try:
+            granted.wait()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        waiter = _SlotWaiter(lambda: loop.call_soon_threadsafe(_set_granted, granted))
+        if self._take(waiter):
+            return
+        try:
+            await granted
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def release(self):
+        while True:
+            with self.lock:
+                if not self.waiters:
+                    self.in_flight -= 1
+                    return
+                # The slot passes straight to the waiter, staying in flight
+                waiter = self.waiters.popleft()
+                waiter.granted = True
+            try:
+                waiter.wake()
+                return
+            except RuntimeError:
+                # The waiter's event loop is closed, so pass the slot on
+                continue
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class RateLimiter:
+    """Paces and retries the chat completions of the whole process
+
+    Args:
+        requests_per_minute: Ceiling on requests per minute (0: unlimited)
+        tokens_per_minute: Ceiling on tokens per minute (0: unlimited)
+        max_concurrent: Requests in flight at once
+        max_retries: Retries of a rate-limited request
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        max_concurrent: int = LLM_MAX_CONCURRENT_REQUESTS,
+        max_retries: int = LLM_MAX_RETRIES,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.slots = RequestSlots(max_concurrent)
+        self.lock = threading.Lock()
+        self.scale = 1.0
+        self.paused_until = 0.0
+        self.completed = 0
+        self.rate_limited = 0
+        self.tokens_used = 0
+
+    def _reserve(self, tokens: int) -> float:
+        with self.lock:
+            now = time.monotonic()
+            return max(self.requests.reserve(1, now), self.tokens.reserve(tokens, now))
+
+    def _pause_left(self) -> float:
+        with self.lock:
+            return self.paused_until - time.monotonic()
+
+    def acquire(self, tokens: int):
+        """Wait until a request of about this many tokens may be sent"""
+        while self._pause_left() > 0:
+            time.sleep(self._pause_left())
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        # A rate limit may have paused everyone while this request waited
+        while self._pause_left() > 0:
+            time.sleep(self._pause_left())
+
+    async def acquire_async(self, tokens: int):
+        """Like acquire, without blocking the event loop"""
+        while self._pause_left() > 0:
+            await asyncio.sleep(self._pause_left())
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        while self._pause_left() > 0:
+            await asyncio.sleep(self._pause_left())
+
+    def succeeded(self, estimated: int, used: Optional[int]):
+        """Correct the token estimate and raise the rates a step"""
+        with self.lock:
+            self.completed += 1
+            if used is not None:
+                self.tokens.adjust(used - estimated)
+                self.tokens_used += used
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale + AIMD_INCREASE)
+                now = time.monotonic()
+                self.requests.scale(self.scale, now)
+                self.tokens.scale(self.scale, now)
+
+    def throttled(self, error: Exception, attempt: int, estimated: int) -> float:
+        """Halve the rates and pause all requests after a rate-limit response
+
+        Returns:
+            Seconds every request now waits
+        """
+        delay = retry_after(error)
+        if delay is None or delay < 0:
+            delay = retry_delay(attempt)
+        with self.lock:
+            self.rate_limited += 1
+            now = time.monotonic()
+            # The rejected request used no tokens
+            self.tokens.adjust(-estimated)
+            self.scale = max(AIMD_MIN_SCALE, self.scale * AIMD_DECREASE)
+            self.requests.scale(self.scale, now)
+            self.tokens.scale(self.scale, now)
+            self.paused_until = max(self.paused_until, now + delay)
+        return delay
+
+    def _retry(self, error: Exception, attempt: int, estimated: int) -> float:
+        """Throttle after a rate-limit error that may still be retried, or re-raise the error"""
+        if not is_rate_limit_error(error) or attempt > self.max_retries:
+            raise error
+        delay = self.throttled(error, attempt, estimated)
+        logging.warning(
+            f"Rate limited ({error}), retrying in {delay:.1f}s at {self.scale:.0%} of the configured rate"
+        )
+        return delay
+
+    def _completed(self, completion, estimated: int):
+        used = getattr(getattr(completion, "usage", None), "total_tokens", None)
+        self.succeeded(estimated, used)
+        meter = _usage_meter.get()
+        if meter is not None:
+            meter.add(used)
+        return completion
+
+    def call(self, create: Callable, **kwargs):
+        """Send a request through the limiter, retrying it while it is rate limited"""
+        estimated = estimate_tokens(kwargs)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.acquire(estimated)
+            try:
+                with self.slots:
+                    completion = create(**kwargs)
+            except Exception as e:
+                self._retry(e, attempt, estimated)
+                continue
+            return self._completed(completion, estimated)
+
+    async def call_async(self, create: Callable, **kwargs):
+        """Like call, for a coroutine function such as AsyncOpenAI's completions"""
+        estimated = estimate_tokens(kwargs)
+        attempt = 0
+        while True:
+            attempt += 1
+            await self.acquire_async(estimated)
+            try:
+                async with self.slots:
+                    completion = await create(**kwargs)
+            except Exception as e:
+                self._retry(e, attempt, estimated)
+                continue
+            return self._completed(completion, estimated)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "completed": self.completed,
+                "rate_limited": self.rate_limited,
+                "tokens_used": self.tokens_used,
+                "rate_scale": self.scale,
+            }
+
+
+llm_limiter = RateLimiter()
+
+
+class _LimitedCompletions:
+    def __init__(self, completions, limiter: RateLimiter):
+        self._completions = completions
+        self._limiter = limiter
+
+    def create(self, **kwargs):
+        if inspect.iscoroutinefunction(self._completions.create):
+            return self._limiter.call_async(self._completions.create, **kwargs)
+        return self._limiter.call(self._completions.create, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+
+class _LimitedChat:
+    def __init__(self, chat, limiter: RateLimiter):
+        self.completions = _LimitedCompletions(chat.completions, limiter)
+        self._chat = chat
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+
+class LimitedClient:
+    """OpenAI or AsyncOpenAI client whose chat completions go through a shared limiter
+
+    The SDK's own retries are turned off, so a rate-limited request reaches
+    the limiter (which retries it) instead of being retried behind its back.
+    Everything else is passed through to the wrapped client.
+    """
+
+    def __init__(self, client, limiter: RateLimiter = llm_limiter):
+        if hasattr(client, "with_options"):
+            client = client.with_options(max_retries=0)
+        self.client = client
+        self.limiter = limiter
+        self.chat = _LimitedChat(client.chat, limiter)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def limited_client(client, limiter: RateLimiter = llm_limiter) -> LimitedClient:
+    """Wrap a client in the limiter, unless it already goes through one"""
+    return client if isinstance(client, LimitedClient) else LimitedClient(client, limiter)
@@ -0,0 +1,204 @@
+"""
+LLM exchanges written once for OpenAI and AsyncOpenAI clients
+
+A role describes an exchange as a generator of steps: it yields each step,
+gets the step's result back (or its error raised at the yield) and returns
+what the exchange produced. run_steps() performs the steps on the calling
+thread with an OpenAI client, run_steps_async() on the event loop with an
+AsyncOpenAI client. The messages, parsing and retries are shared, and only
+the calls to the client differ.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import time
+from typing import Any, Callable, Dict, Generator, List, Optional, Sequence, Tuple
+
+from RedditReportGenerator.common.rate_limit import is_rate_limit_error, retry_delay
+from RedditReportGenerator.common.utils import run_tasks
+
+Steps = Generator[Any, Any, Any]
+
+
+class Completion:
+    """Create a chat completion with the given request"""
+
+    def __init__(self, **request):
+        self.request = request
+
+
+class ModelInfo:
+    """Retrieve the info of a model"""
+
+    def __init__(self, model: str):
+        self.model = model
+
+
+class Pause:
+    """Wait before the next step"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+
+class Blocking:
+    """Call a blocking function (on a worker thread under asyncio)"""
+
+    def __init__(self, function: Callable, *args, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+
+class ToolCalls:
+    """Call tools with their arguments, one after another, or concurrently on worker threads under asyncio
+
+    The result has each call's result, or the exception it raised, in order.
+    """
+
+    def __init__(self, calls: Sequence[Tuple[Callable, Dict]]):
+        self.calls = calls
+
+
+class Parallel:
+    """Run exchanges side by side, at most limit at a time
+
+    The result has the exchanges' results in order. When one fails, the
+    others are cancelled (on threads, those that haven't started).
+    """
+
+    def __init__(self, exchanges: Sequence[Steps], limit: Optional[int] = None):
+        self.exchanges = exchanges
+        self.limit = limit
+
+
+def complete_with_retries(request: Dict, parse: Callable, log, action: str) -> Steps:
+    """Request a completion until its response parses, backing off between attempts
+
+    Rate-limit errors are re-raised, since the client's limiter has already
+    retried them.
+
+    Returns:
+        The parsed response
+    """
+    attempts = 0
+    while True:
+        try:
+            return parse((yield Completion(**request)))
+        except Exception as e:
+            if is_rate_limit_error(e):
+                raise
+            log.error(f"Error in {action}: {e}")
+            attempts += 1
+            yield Pause(retry_delay(attempts))
+
+
+def _call(tool: Callable, tool_args: Dict):
+    try:
+        return tool(**tool_args)
+    except Exception as e:
+        return e
+
+
+def _run_parallel(step: Parallel, client) -> List:
+    workers = max(1, min(step.limit or len(step.exchanges), len(step.exchanges) or 1))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parallel") as executor:
+        # In a copy of the context each, so their usage is metered with the caller's
+        futures = [
+            executor.submit(contextvars.copy_context().run, run_steps, exchange, client)
+            for exchange in step.exchanges
+        ]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _perform(step, client):
+    if isinstance(step, Completion):
+        return client.chat.completions.create(**step.request)
+    if isinstance(step, ModelInfo):
+        return client.models.retrieve(step.model)
+    if isinstance(step, Pause):
+        return time.sleep(step.seconds)
+    if isinstance(step, Blocking):
+        return step.function(*step.args, **step.kwargs)
+    if isinstance(step, ToolCalls):
+        return [_call(tool, tool_args) for tool, tool_args in step.calls]
+    if isinstance(step, Parallel):
+        return _run_parallel(step, client)
+    raise TypeError(f"Unknown step {step!r}")
+
+
+async def _perform_async(step, client):
+    if isinstance(step, Completion):
+        return await client.chat.completions.create(**step.request)
+    if isinstance(step, ModelInfo):
+        return await client.models.retrieve(step.model)
+    if isinstance(step, Pause):
+        return await asyncio.sleep(step.seconds)
+    if isinstance(step, Blocking):
+        return await asyncio.to_thread(step.function, *step.args, **step.kwargs)
+    if isinstance(step, ToolCalls):
+        results = await asyncio.gather(
+            *(asyncio.to_thread(tool, **tool_args) for tool, tool_args in step.calls),
+            return_exceptions=True,
+        )
+        for result in results:
+            # Only errors of the tools themselves are results
+            if isinstance(result, BaseException) and not isinstance(result, Exception):
+                raise result
+        return results
+    if isinstance(step, Parallel):
+        return await run_tasks(
+            [functools.partial(run_steps_async, exchange, client) for exchange in step.exchanges],
+            limit=step.limit,
+        )
+    raise TypeError(f"Unknown step {step!r}")
+
+
+def run_steps(steps: Steps, client):
+    """Run an exchange with an OpenAI client
+
+    Returns:
+        What the exchange returned
+    """
+    result, error = None, None
+    try:
+        while True:
+            try:
+                step = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                result = _perform(step, client)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+
+
+async def run_steps_async(steps: Steps, client):
+    """Run an exchange with an AsyncOpenAI client
+
+    Returns:
+        What the exchange returned
+    """
+    result, error = None, None
+    try:
+        while True:
+            try:
+                step = steps.send(result) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                result = await _perform_async(step, client)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
@@ -1,10 +1,21 @@
+import asyncio
+import hashlib
 import json
 import logging
 import os
-from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union, get_type_hints
+import threading
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Literal, Optional, Sequence, Tuple, Union, get_type_hints
 from langchain_core.utils.function_calling import convert_to_openai_tool
 from pydantic import BaseModel
 
+try:
+    import orjson
+except ImportError:  # optional faster decoder
+    orjson = None
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -12,34 +23,47 @@ logging.basicConfig(
 
 # Dictionary to store file handlers for different user/community ids
 user_handlers = {}
+_user_handlers_lock = threading.Lock()
+
+# Worker processes for parsing JSONL files (1 parses in-process)
+DEFAULT_JSONL_WORKERS = int(os.getenv("JSONL_WORKERS", "1"))
+
+# Upper bound on the bytes one worker parses at a time
+JSONL_CHUNK_BYTES = 64 * 1024 * 1024
+
+# Bytes hashed at the end of an ingested prefix to tell appends from rewrites
+STAMP_TAIL_BYTES = 4096
 
 
 def get_logger(name: str, user_or_community_id: str) -> logging.Logger:
-    logger = logging.getLogger(name)
+    # One logger per role and user, so users analyzed at the same time (or one
+    # after another) don't write to each other's log files
+    logger = logging.getLogger(f"{name}[{user_or_community_id}]")
     logger.setLevel(logging.INFO)
 
-    if not os.path.exists("logs"):
-        os.makedirs("logs")
-
     log_file = os.path.join("logs", f"{user_or_community_id}.log")
 
-    # Check if we already have a handler for this user/community
-    if user_or_community_id not in user_handlers:
-        # Create new handler
-        handler = logging.FileHandler(log_file)
-        formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        )
-        handler.setFormatter(formatter)
-        user_handlers[user_or_community_id] = handler
+    # Roles of several perspectives or users are created on different threads
+    with _user_handlers_lock:
+        os.makedirs("logs", exist_ok=True)
 
-    # Check if this logger already has the user/community-specific handler
-    has_user_handler = any(
-        handler is user_handlers[user_or_community_id] for handler in logger.handlers
-    )
+        # Check if we already have a handler for this user/community
+        if user_or_community_id not in user_handlers:
+            # Create new handler
+            handler = logging.FileHandler(log_file)
+            formatter = logging.Formatter(
+                "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+            )
+            handler.setFormatter(formatter)
+            user_handlers[user_or_community_id] = handler
+
+        # Check if this logger already has the user/community-specific handler
+        has_user_handler = any(
+            handler is user_handlers[user_or_community_id] for handler in logger.handlers
+        )
 
-    if not has_user_handler:
-        logger.addHandler(user_handlers[user_or_community_id])
+        if not has_user_handler:
+            logger.addHandler(user_handlers[user_or_community_id])
 
     return logger
 
@@ -54,6 +78,34 @@ def convert_tool(tool: Callable) -> Dict[str, Any]:
     return schema
 
 
+async def run_tasks(jobs: Iterable[Callable[[], Awaitable]], limit: Optional[int] = None) -> list:
+    """Run jobs (functions returning a coroutine) as tasks, at most limit at a time
+
+    Each job's coroutine is only created once it may run. When one fails, or
+    the caller is cancelled, the others are cancelled and awaited before the
+    error propagates, so no task outlives the call.
+
+    Returns:
+        The results of the jobs, in order
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def run(job: Callable[[], Awaitable]):
+        if semaphore is None:
+            return await job()
+        async with semaphore:
+            return await job()
+
+    tasks = [asyncio.ensure_future(run(job)) for job in jobs]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
 def try_validate_json(base: BaseModel, data: str):
     try:
         return base.model_validate_json(data)
@@ -64,15 +116,284 @@ def try_validate_json(base: BaseModel, data: str):
             raise ValueError("Invalid JSON data") from json_error
 
 
-def load_jsonl_file(file_path: str) -> List[Dict]:
-    """Load data from a JSONL file"""
-    data = []
-    with open(file_path, "r", encoding="utf-8") as f:
+def json_default(value: Any) -> Any:
+    """json.dumps hook that serializes read-only mappings such as record views"""
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def decode_json_line(line: Union[str, bytes]) -> Any:
+    """Decode one JSON line, using orjson when it is installed
+
+    orjson is stricter than the stdlib (e.g. lone surrogates, huge integers),
+    so lines it rejects get a second chance with json before counting as bad.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(line)
+
+
+def _jsonl_chunk_ranges(file_path: str, chunk_count: int, start: int, end: int) -> List[Tuple[int, int]]:
+    """Split a byte range of a file into ranges that start and end on line boundaries"""
+    boundaries = [start]
+    with open(file_path, "rb") as f:
+        for i in range(1, chunk_count):
+            position = start + (end - start) * i // chunk_count
+            if position <= boundaries[-1]:
+                continue
+            f.seek(position - 1)
+            f.readline()
+            if f.tell() >= end:
+                break
+            if f.tell() > boundaries[-1]:
+                boundaries.append(f.tell())
+    boundaries.append(end)
+    return [(first, last) for first, last in zip(boundaries, boundaries[1:]) if last > first]
+
+
+def jsonl_complete_end(file_path: str, start: int = 0) -> int:
+    """Get the offset just past the last complete line after start
+
+    Bytes after the last newline may be a line that is still being written.
+    """
+    with open(file_path, "rb") as f:
+        position = os.fstat(f.fileno()).st_size
+        while position > start:
+            block_start = max(start, position - 65536)
+            f.seek(block_start)
+            newline = f.read(position - block_start).rfind(b"\n")
+            if newline >= 0:
+                return block_start + newline + 1
+            position = block_start
+    return start
+
+
+def jsonl_stamp(file_path: str, size: Optional[int] = None) -> Dict:
+    """Describe the first size bytes of a file (default: all) to detect later changes"""
+    if size is None:
+        size = os.path.getsize(file_path)
+    tail_start = max(0, size - STAMP_TAIL_BYTES)
+    with open(file_path, "rb") as f:
+        f.seek(tail_start)
+        tail = f.read(size - tail_start)
+    return {"size": size, "tail_sha1": hashlib.sha1(tail).hexdigest()}
+
+
+def jsonl_growth(file_path: str, stamp: Dict) -> Optional[int]:
+    """Get how many bytes were appended to a file since stamp was taken
+
+    Returns None when the file was truncated or rewritten instead.
+    """
+    size = os.path.getsize(file_path)
+    if size < stamp["size"] or jsonl_stamp(file_path, stamp["size"]) != stamp:
+        return None
+    return size - stamp["size"]
+
+
+class JsonlSource:
+    """Read-only handle on a JSONL file for reading single lines back with pread"""
+
+    def __init__(self, file_path: str, lazy_fields: Sequence[str]):
+        self.file_path = file_path
+        self.lazy_fields = frozenset(lazy_fields)
+        self._fd = os.open(file_path, os.O_RDONLY)
+
+    def read_field(self, offset: int, length: int, key: str, default=None):
+        """Decode the line at offset and return one of its fields"""
+        record = decode_json_line(os.pread(self._fd, length, offset))
+        return record.get(key, default)
+
+    def __del__(self):
+        try:
+            os.close(self._fd)
+        except (AttributeError, OSError):
+            pass
+
+
+_LAZY_MISSING = object()
+
+
+class JsonlRecord(dict):
+    """Projected JSONL record that keeps only a byte offset for its large fields
+
+    Fields listed as lazy on the source are read back from the file with
+    pread on access, so they never stay resident.
+    """
+
+    __slots__ = ("source", "offset", "length")
+
+    def __init__(self, fields: Dict, source: JsonlSource, offset: int, length: int):
+        super().__init__(fields)
+        self.source = source
+        self.offset = offset
+        self.length = length
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        if key in self.source.lazy_fields:
+            return self.source.read_field(self.offset, self.length, key, default)
+        return default
+
+    def __missing__(self, key):
+        value = self.get(key, _LAZY_MISSING)
+        if value is _LAZY_MISSING:
+            raise KeyError(key)
+        return value
+
+
+def _project(
+    record: Any, fields: Optional[Sequence[str]], derived_fields: Optional[Mapping[str, Callable]] = None
+) -> Any:
+    if not isinstance(record, dict):
+        return record
+    # Derived values see the whole record, including fields projected away
+    derived = {name: derive(record) for name, derive in derived_fields.items()} if derived_fields else {}
+    if fields is not None:
+        record = {key: record[key] for key in fields if key in record}
+    record.update(derived)
+    return record
+
+
+def _parse_jsonl_lines(
+    data: bytes,
+    base_offset: int,
+    fields: Optional[Sequence[str]],
+    derived_fields: Optional[Mapping[str, Callable]] = None,
+) -> Tuple[List[Tuple[int, int, Any]], List[str]]:
+    """Parse a block of JSONL bytes into (offset, length, record) entries and errors"""
+    entries, errors = [], []
+    offset = base_offset
+    for line in data.split(b"\n"):
+        length = len(line)
+        stripped = line.strip()
+        if stripped:
+            try:
+                entries.append((offset, length, _project(decode_json_line(stripped), fields, derived_fields)))
+            except Exception as e:
+                errors.append(str(e))
+        offset += length + 1
+    return entries, errors
+
+
+def _parse_jsonl_chunk(
+    file_path: str,
+    start: int,
+    end: int,
+    fields: Optional[Sequence[str]] = None,
+    derived_fields: Optional[Mapping[str, Callable]] = None,
+) -> Tuple[List[Tuple[int, int, Any]], List[str]]:
+    """Parse the lines in a byte range, returning entries and parse errors"""
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return _parse_jsonl_lines(data, start, fields, derived_fields)
+
+
+def _iter_jsonl_parallel(
+    file_path: str,
+    workers: int,
+    fields: Optional[Sequence[str]],
+    derived_fields: Optional[Mapping[str, Callable]],
+    start: int,
+    end: int,
+) -> Iterator[Tuple[int, int, Any]]:
+    """Parse newline-aligned chunks of a JSONL file in a process pool, in order"""
+    chunk_count = max(workers * 4, -(-(end - start) // JSONL_CHUNK_BYTES))
+    ranges = _jsonl_chunk_ranges(file_path, chunk_count, start, end)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded window in flight so streaming callers don't buffer the whole file
+        pending = deque()
+        for first, last in ranges:
+            pending.append(pool.submit(_parse_jsonl_chunk, file_path, first, last, fields, derived_fields))
+            if len(pending) >= workers * 2:
+                yield from _drain_jsonl_chunk(file_path, pending.popleft().result())
+        while pending:
+            yield from _drain_jsonl_chunk(file_path, pending.popleft().result())
+
+
+def _iter_jsonl_sequential(
+    file_path: str,
+    fields: Optional[Sequence[str]],
+    derived_fields: Optional[Mapping[str, Callable]],
+    start: int,
+    end: int,
+) -> Iterator[Tuple[int, int, Any]]:
+    offset = start
+    with open(file_path, "rb") as f:
+        f.seek(start)
         for line in f:
-            line = line.strip()
-            if line:
+            if offset >= end:
+                break
+            # Never read past end, even if the file grew while we were parsing
+            line = line[:end - offset]
+            stripped = line.strip()
+            if stripped:
                 try:
-                    data.append(json.loads(line))
+                    record = decode_json_line(stripped)
                 except Exception as e:
                     logging.warning(f"Failed to parse line in {file_path}: {e}")
-    return data
+                else:
+                    yield offset, len(line), _project(record, fields, derived_fields)
+            offset += len(line)
+
+
+def _drain_jsonl_chunk(file_path: str, result) -> Iterator[Tuple[int, int, Any]]:
+    entries, errors = result
+    for error in errors:
+        logging.warning(f"Failed to parse line in {file_path}: {error}")
+    yield from entries
+
+
+def iter_jsonl_file(
+    file_path: str,
+    workers: Optional[int] = None,
+    fields: Optional[Sequence[str]] = None,
+    lazy_fields: Sequence[str] = (),
+    start: int = 0,
+    end: Optional[int] = None,
+    derived_fields: Optional[Mapping[str, Callable]] = None,
+) -> Iterator[Dict]:
+    """Stream records from a JSONL file, skipping lines that fail to parse
+
+    Args:
+        file_path: Path to the JSONL file
+        workers: Worker processes to parse with (default: JSONL_WORKERS env, 1 = in-process)
+        fields: Keys to keep resident in each record (default: all)
+        lazy_fields: Keys to drop from memory and read back from the file on access
+        start: Byte offset to start at, which must be a line boundary
+        end: Byte offset to stop at (default: the file size when called)
+        derived_fields: Fields to add to each record, computed from the whole parsed
+            record by module-level functions (they run in the worker processes)
+    """
+    workers = DEFAULT_JSONL_WORKERS if workers is None else workers
+    if end is None:
+        end = os.path.getsize(file_path)
+    if workers > 1:
+        entries = _iter_jsonl_parallel(file_path, workers, fields, derived_fields, start, end)
+    else:
+        entries = _iter_jsonl_sequential(file_path, fields, derived_fields, start, end)
+
+    if not lazy_fields:
+        for _, _, record in entries:
+            yield record
+        return
+
+    source = JsonlSource(file_path, lazy_fields)
+    for offset, length, record in entries:
+        yield JsonlRecord(record, source, offset, length) if isinstance(record, dict) else record
+
+
+def load_jsonl_file(
+    file_path: str,
+    workers: Optional[int] = None,
+    fields: Optional[Sequence[str]] = None,
+    lazy_fields: Sequence[str] = (),
+) -> List[Dict]:
+    """Load data from a JSONL file (see iter_jsonl_file for the options)"""
+    return list(iter_jsonl_file(file_path, workers, fields, lazy_fields))
@@ -1,8 +1,8 @@
 import json
 import logging
-import time
 from openai import Client
 from pydantic import BaseModel, Field
+from RedditReportGenerator.common.steps import Completion, Steps, complete_with_retries, run_steps, run_steps_async
 from RedditReportGenerator.common.utils import get_logger, try_validate_json
 from RedditReportGenerator.common.data_types import TODOItem, PerspectivePlan
 
@@ -67,94 +67,104 @@ ACTION: Analyze the Reddit user/community from the {perspective} perspective to
         self.log = get_logger(f"{perspective}-DomainExpert", user_or_community_id)
         self.plan = None
 
-    def breakdown(self, user_or_community_id) -> PerspectivePlan:
-        """Break down the analysis task into specific questions and prompts"""
+    def _breakdown_messages(self, user_or_community_id) -> list:
         breakdown_prompt = BREAKDOWN_PROMPT.format(
             user_or_community_id=user_or_community_id,
             tips=self.tips,
             plan_json_schema=PerspectivePlan.model_json_schema(),
         )
 
-        messages = [
+        return [
             {"role": "system", "content": self.system_message},
             {"role": "user", "content": breakdown_prompt},
         ]
 
-        while True:
-            try:
-                completion = self.client.chat.completions.create(
-                    model=self.model, messages=messages, temperature=0.7
-                )
-                response = completion.choices[0].message.content
-                self.log.info("Breakdown response: %s", response)
-
-                # First, try to find and parse a single PerspectivePlan object
-                plan = None
-
-                # Try parsing the entire response directly
-                try:
-                    # Clean up the response - remove markdown code blocks
-                    cleaned_response = response.strip()
-                    if cleaned_response.startswith("```json"):
-                        cleaned_response = cleaned_response[7:]
-                    if cleaned_response.startswith("```"):
-                        cleaned_response = cleaned_response[3:]
-                    if cleaned_response.endswith("```"):
-                        cleaned_response = cleaned_response[:-3]
-                    cleaned_response = cleaned_response.strip()
-
-                    plan = try_validate_json(PerspectivePlan, cleaned_response)
-                except Exception:
-                    # Try parsing by splitting on ```json\n
-                    plans = []
-                    for no_prefix in response.split("```json\n"):
-                        if no_prefix and '"$defs"' not in no_prefix:
-                            try:
-                                cleaned = no_prefix.strip("\n```").strip()
-                                if cleaned:
-                                    parsed_plan = try_validate_json(PerspectivePlan, cleaned)
-                                    plans.append(parsed_plan)
-                            except Exception:
-                                pass
-
-                    if plans:
-                        plan = plans[0]
-
-                if plan is None:
-                    # Try parsing as array and take first element
+    def _parse_breakdown(self, completion) -> PerspectivePlan:
+        response = completion.choices[0].message.content
+        self.log.info("Breakdown response: %s", response)
+
+        # First, try to find and parse a single PerspectivePlan object
+        plan = None
+
+        # Try parsing the entire response directly
+        try:
+            # Clean up the response - remove markdown code blocks
+            cleaned_response = response.strip()
+            if cleaned_response.startswith("```json"):
+                cleaned_response = cleaned_response[7:]
+            if cleaned_response.startswith("```"):
+                cleaned_response = cleaned_response[3:]
+            if cleaned_response.endswith("```"):
+                cleaned_response = cleaned_response[:-3]
+            cleaned_response = cleaned_response.strip()
+
+            plan = try_validate_json(PerspectivePlan, cleaned_response)
+        except Exception:
+            # Try parsing by splitting on ```json\n
+            plans = []
+            for no_prefix in response.split("```json\n"):
+                if no_prefix and '"$defs"' not in no_prefix:
                     try:
-                        cleaned_response = response.strip()
-                        if cleaned_response.startswith("```json"):
-                            cleaned_response = cleaned_response[7:]
-                        if cleaned_response.startswith("```"):
-                            cleaned_response = cleaned_response[3:]
-                        if cleaned_response.endswith("```"):
-                            cleaned_response = cleaned_response[:-3]
-                        cleaned_response = cleaned_response.strip()
-
-                        parsed_array = json.loads(cleaned_response)
-                        if isinstance(parsed_array, list) and len(parsed_array) > 0:
-                            plan = PerspectivePlan(**parsed_array[0])
+                        cleaned = no_prefix.strip("\n```").strip()
+                        if cleaned:
+                            parsed_plan = try_validate_json(PerspectivePlan, cleaned)
+                            plans.append(parsed_plan)
                     except Exception:
                         pass
 
-                if plan is None:
-                    raise ValueError(
-                        "No valid JSON found in the response {}".format(response)
-                    )
-                break
+            if plans:
+                plan = plans[0]
 
-            except Exception as e:
-                self.log.error(f"Error in breakdown: {e}")
-                time.sleep(10)
-                continue
+        if plan is None:
+            # Try parsing as array and take first element
+            try:
+                cleaned_response = response.strip()
+                if cleaned_response.startswith("```json"):
+                    cleaned_response = cleaned_response[7:]
+                if cleaned_response.startswith("```"):
+                    cleaned_response = cleaned_response[3:]
+                if cleaned_response.endswith("```"):
+                    cleaned_response = cleaned_response[:-3]
+                cleaned_response = cleaned_response.strip()
+
+                parsed_array = json.loads(cleaned_response)
+                if isinstance(parsed_array, list) and len(parsed_array) > 0:
+                    plan = PerspectivePlan(**parsed_array[0])
+            except Exception:
+                pass
+
+        if plan is None:
+            raise ValueError(
+                "No valid JSON found in the response {}".format(response)
+            )
+        return plan
+
+    def breakdown_steps(self, user_or_community_id) -> Steps:
+        """Steps that break down the analysis task (see common.steps)"""
+        plan = yield from complete_with_retries(
+            dict(
+                model=self.model,
+                messages=self._breakdown_messages(user_or_community_id),
+                temperature=0.7,
+            ),
+            self._parse_breakdown,
+            self.log,
+            "breakdown",
+        )
 
         self.log.info("Plan: %s", plan)
         self.plan = plan
         return plan
 
-    def analyze(self, analysis_categories, merged_chat_history) -> str:
-        """Analyze the user/community based on the gathered information and infer insights"""
+    def breakdown(self, user_or_community_id) -> PerspectivePlan:
+        """Break down the analysis task into specific questions and prompts"""
+        return run_steps(self.breakdown_steps(user_or_community_id), self.client)
+
+    async def breakdown_async(self, user_or_community_id) -> PerspectivePlan:
+        """Like breakdown, with an AsyncOpenAI client"""
+        return await run_steps_async(self.breakdown_steps(user_or_community_id), self.client)
+
+    def _analysis_messages(self, analysis_categories, merged_chat_history) -> list:
         plan_text = "Here is the plan to analyze the " + self.plan.target + ":\n"
         plan_text += "\n".join(f"- {item.question}" for item in self.plan.items)
 
@@ -170,14 +180,13 @@ ACTION: Analyze the Reddit user/community from the {perspective} perspective to
             *merged_chat_history,
         ]
 
-        while True:
-            system_message = self.system_message.format()
-            messages = [
-                {"role": "system", "content": system_message},
-                *chat_history,
-                {
-                    "role": "user",
-                    "content": f"""Please analyze the {self.plan.target} from the perspective of {self.perspective}.
+        system_message = self.system_message.format()
+        messages = [
+            {"role": "system", "content": system_message},
+            *chat_history,
+            {
+                "role": "user",
+                "content": f"""Please analyze the {self.plan.target} from the perspective of {self.perspective}.
 
 Focus on identifying key patterns, insights, and actionable information. Your analysis should include:
 - Quantifiable metrics and trends
@@ -187,27 +196,28 @@ Focus on identifying key patterns, insights, and actionable information. Your an
 
 The analysis should cover categories such as:
 {analysis_categories}
-                    """,
-                },
-            ]
+                """,
+            },
+        ]
 
-            self.log.debug("Analyst messages: %s", messages)
+        self.log.debug("Analyst messages: %s", messages)
+        return messages
 
-            completion = self.client.chat.completions.create(
-                model=self.model, messages=messages, temperature=0
-            )
+    def analysis_steps(self, analysis_categories, merged_chat_history) -> Steps:
+        """Steps that analyze the gathered information (see common.steps)"""
+        completion = yield Completion(
+            model=self.model,
+            messages=self._analysis_messages(analysis_categories, merged_chat_history),
+            temperature=0,
+        )
 
-            self.log.debug("Analyst completion: %s", completion)
-            response = completion.choices[0].message.content
-
-            chat_history.extend(
-                [
-                    {
-                        "role": "user",
-                        "content": "Please analyze against the retrieved data.",
-                    },
-                    {"role": "assistant", "content": response},
-                ]
-            )
+        self.log.debug("Analyst completion: %s", completion)
+        return completion.choices[0].message.content
+
+    def analyze(self, analysis_categories, merged_chat_history) -> str:
+        """Analyze the user/community based on the gathered information and infer insights"""
+        return run_steps(self.analysis_steps(analysis_categories, merged_chat_history), self.client)
 
-            return response
+    async def analyze_async(self, analysis_categories, merged_chat_history) -> str:
+        """Like analyze, with an AsyncOpenAI client"""
+        return await run_steps_async(self.analysis_steps(analysis_categories, merged_chat_history), self.client)
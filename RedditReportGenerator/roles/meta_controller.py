@@ -1,8 +1,8 @@
 import os
-import time
 from openai import Client
 from pydantic import BaseModel, Field
 
+from RedditReportGenerator.common.steps import Steps, complete_with_retries, run_steps, run_steps_async
 from RedditReportGenerator.common.utils import convert_tool, get_logger, try_validate_json
 from RedditReportGenerator.common.data_types import AnalysisPerspective, MetaPlan
 
@@ -61,9 +61,8 @@ Make sure your response is ONE valid JSON that follows this schema exactly
 
         self.log = get_logger("MetaController", user_or_community_id)
 
-    def build_meta_plan(self, tools: list) -> MetaPlan:
-        """Build a meta analysis plan by determining which perspectives to analyze"""
-        messages = [
+    def _meta_plan_messages(self, tools: list) -> list:
+        return [
             {
                 "role": "system",
                 "content": self.system_message.format(
@@ -80,40 +79,51 @@ Make sure your response is ONE valid JSON that follows this schema exactly
             },
         ]
 
-        while True:
-            try:
-                completion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=1,
-                )
-                response = completion.choices[0].message.content
+    def _parse_meta_plan(self, completion) -> MetaPlan:
+        response = completion.choices[0].message.content
 
-                self.log.info("Meta plan response: %s", response)
+        self.log.info("Meta plan response: %s", response)
 
-                plans = [
-                    try_validate_json(MetaPlan, no_prefix.strip("\n```"))
-                    for no_prefix in response.split("```json\n")
-                    if no_prefix and '"$defs"' not in no_prefix
-                ]
-
-                existing_plans = [plan for plan in plans if plan]
+        plans = [
+            try_validate_json(MetaPlan, no_prefix.strip("\n```"))
+            for no_prefix in response.split("```json\n")
+            if no_prefix and '"$defs"' not in no_prefix
+        ]
 
-                if not existing_plans:
-                    raise ValueError(
-                        "No valid JSON found in the response {}".format(response)
-                    )
+        existing_plans = [plan for plan in plans if plan]
 
-                plan = existing_plans[0]
-                break
+        if not existing_plans:
+            raise ValueError(
+                "No valid JSON found in the response {}".format(response)
+            )
 
-            except Exception as e:
-                self.log.error(f"Error in building meta plan: {e}")
-                time.sleep(10)
-                continue
+        return existing_plans[0]
 
+    def _save_meta_plan(self, plan: MetaPlan):
         os.makedirs("meta_plans", exist_ok=True)
         with open(f"meta_plans/{self.user_or_community_id}.json", "w") as f:
             f.write(plan.model_dump_json(indent=4))
 
+    def meta_plan_steps(self, tools: list) -> Steps:
+        """Steps that build the meta plan (see common.steps)"""
+        plan = yield from complete_with_retries(
+            dict(
+                model=self.model,
+                messages=self._meta_plan_messages(tools),
+                temperature=1,
+            ),
+            self._parse_meta_plan,
+            self.log,
+            "building meta plan",
+        )
+
+        self._save_meta_plan(plan)
         return plan
+
+    def build_meta_plan(self, tools: list) -> MetaPlan:
+        """Build a meta analysis plan by determining which perspectives to analyze"""
+        return run_steps(self.meta_plan_steps(tools), self.client)
+
+    async def build_meta_plan_async(self, tools: list) -> MetaPlan:
+        """Like build_meta_plan, with an AsyncOpenAI client"""
+        return await run_steps_async(self.meta_plan_steps(tools), self.client)
@@ -1,10 +1,15 @@
 import json
 import logging
 import tiktoken
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Optional, Tuple
 from openai import BadRequestError, Client
 from openai.types.chat import ChatCompletionMessage
-from RedditReportGenerator.common.utils import convert_tool, get_logger
+from RedditReportGenerator.common.rate_limit import is_rate_limit_error
+from RedditReportGenerator.common.steps import Completion, Steps, ToolCalls, run_steps, run_steps_async
+from RedditReportGenerator.common.utils import convert_tool, get_logger, json_default
+
+# Requests per question before the solver settles for its last answer
+MAX_ITERATIONS = 10
 
 
 class QuestionSolverAnalyst:
@@ -21,6 +26,7 @@ class QuestionSolverAnalyst:
         known_facts: str,
         main_perspective: str,
         tools: List[Callable],
+        model_info=None,
     ):
         self.name = "QuestionSolver"
         self.model = model
@@ -53,14 +59,15 @@ ACTION: Collect as much information as possible about the Reddit user/community
 
         self.converted_tools = converted_tools
 
-        self.model_info = client.models.retrieve(self.model)
+        # Workflows retrieve the model info once and pass it to each solver
+        self.model_info = model_info if model_info is not None else client.models.retrieve(self.model)
         self.log.info(f"Model info: {self.model_info}")
         self.token_limit = self.model_info.to_dict().get("token_limit", 130000)
         self.log.warning(f"Token limit: {self.token_limit}")
 
     def _truncate_tool_result(self, result, max_chars: int = 2000) -> str:
         """Truncate tool result to fit within reasonable token limits"""
-        result_str = json.dumps(result)
+        result_str = json.dumps(result, default=json_default)
 
         # If result is too large, truncate it intelligently
         if len(result_str) > max_chars:
@@ -68,7 +75,7 @@ ACTION: Collect as much information as possible about the Reddit user/community
 
             if isinstance(result, list):
                 # For lists lists, keep only first few items
-                result_str = json.dumps(result[:3]) + "... (truncated)"
+                result_str = json.dumps(result[:3], default=json_default) + "... (truncated)"
             elif isinstance(result, dict):
                 # For dicts, keep only summary keys
                 summary = {}
@@ -77,58 +84,64 @@ ACTION: Collect as much information as possible about the Reddit user/community
                         summary[key] = f"<{type(value).__name__} with {len(value)} items>" if isinstance(value, list) else f"<complex {type(value).__name__}>"
                     else:
                         summary[key] = value
-                result_str = json.dumps(summary) + "... (truncated)"
+                result_str = json.dumps(summary, default=json_default) + "... (truncated)"
             else:
                 result_str = result_str[:max_chars] + "... (truncated)"
 
         return result_str
 
-    def call_tools(self, question: str, response: ChatCompletionMessage) -> list:
-        """Call tools based on the model's response"""
-        tool_messages = [response.to_dict()]
+    def _prepare_tool_call(self, question: str, tool_call) -> Optional[Tuple[Callable, Dict]]:
+        """Get the tool and arguments of a tool call (None if the arguments don't parse)"""
+        tool_name = tool_call.function.name
+        try:
+            tool_args = json.loads(tool_call.function.arguments)
+        except json.JSONDecodeError as e:
+            self.log.error(f"Failed to parse tool arguments for {tool_name}: {e}")
+            self.log.error(f"Raw arguments: {tool_call.function.arguments}")
+            return None
+
+        self.log.warning(
+            f"For {question} call Tool: {tool_name} with args {tool_args}"
+        )
 
+        tool = self.tool_map.get(tool_name)
+        if not tool:
+            raise ValueError(f"Tool {tool_name} not found in tool map")
+        return tool, tool_args
+
+    def _tool_message(self, tool_call, tool_args: Dict, result=None, error: Optional[Exception] = None) -> Dict:
+        if error is None:
+            content = self._truncate_tool_result(result)
+        else:
+            content = f"Error in tool {tool_call.function.name} with args {tool_args}: {str(error)}"
+            self.log.error(content)
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "content": content,
+        }
+
+    def tool_steps(self, question: str, response: ChatCompletionMessage) -> Steps:
+        """Steps that call the tools of the model's response (see common.steps)"""
+        prepared = []
         for tool_call in response.tool_calls:
-            tool_name = tool_call.function.name
-            try:
-                tool_args = json.loads(tool_call.function.arguments)
-            except json.JSONDecodeError as e:
-                self.log.error(f"Failed to parse tool arguments for {tool_name}: {e}")
-                self.log.error(f"Raw arguments: {tool_call.function.arguments}")
-                continue
-
-            self.log.warning(
-                f"For {question} call Tool: {tool_name} with args {tool_args}"
-            )
+            call = self._prepare_tool_call(question, tool_call)
+            if call is not None:
+                prepared.append((tool_call, *call))
+        results = yield ToolCalls([(tool, tool_args) for _, tool, tool_args in prepared])
 
-            tool = self.tool_map.get(tool_name)
-            if tool:
-                try:
-                    result = tool(**tool_args)
-                    truncated_result = self._truncate_tool_result(result)
-                    tool_messages.append(
-                        {
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": truncated_result,
-                        }
-                    )
-                except Exception as e:
-                    error_message = (
-                        f"Error in tool {tool_name} with args {tool_args}: {str(e)}"
-                    )
-                    self.log.error(error_message)
-                    tool_messages.append(
-                        {
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": error_message,
-                        }
-                    )
+        tool_messages = [response.to_dict()]
+        for (tool_call, _, tool_args), result in zip(prepared, results):
+            if isinstance(result, Exception):
+                tool_messages.append(self._tool_message(tool_call, tool_args, error=result))
             else:
-                raise ValueError(f"Tool {tool_name} not found in tool map")
-
+                tool_messages.append(self._tool_message(tool_call, tool_args, result))
         return tool_messages
 
+    def call_tools(self, question: str, response: ChatCompletionMessage) -> list:
+        """Call tools based on the model's response"""
+        return run_steps(self.tool_steps(question, response), self.client)
+
     def cut_history(self, previous_chat_history: list) -> list:
         """Cuts the chat history to fit within token limit"""
         if not previous_chat_history:
@@ -195,9 +208,8 @@ ACTION: Collect as much information as possible about the Reddit user/community
 
         return previous_chat_history
 
-    def analyze(self, previous_chat_history: list, question: str, prompt: str) -> str:
-        """Analyze a specific sub-question using tools and LLM capabilities"""
-        chat_history = [
+    def _start_history(self, previous_chat_history: list, question: str, prompt: str) -> list:
+        return [
             *previous_chat_history,
             {
                 "role": "user",
@@ -205,92 +217,73 @@ ACTION: Collect as much information as possible about the Reddit user/community
             },
         ]
 
-        max_iterations = 10
-        iterations = 0
+    def _request(self, chat_history: list) -> Dict:
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            *self.cut_history(chat_history),
+        ]
+        return dict(
+            model=self.model,
+            messages=messages,
+            tools=self.converted_tools,
+            tool_choice="auto",
+            temperature=0,
+        )
 
-        while iterations < max_iterations:
-            iterations += 1
-            self.log.info(
-                f"Iteration {iterations} for question: {question} ({self.main_perspective})"
+    def _recover(self, chat_history: list, question: str, e: Exception) -> list:
+        """Get the history to retry with after a failed request, or re-raise the error"""
+        if is_rate_limit_error(e) and not isinstance(e, BadRequestError):
+            # The client's limiter already backed off and retried
+            # LLM_MAX_RETRIES times, so retrying here would only multiply that
+            self.log.error(
+                f"Rate limit exceeded for question: {question}, giving up"
+            )
+            raise e
+        if "maximum" in str(e).lower():
+            self.log.warning(
+                f"Max context length exceeded for question: {question} ({e}), rolling back history"
+            )
+            return self.rollback_history(chat_history, e)
+        raise e
+
+    def _answer(self, chat_history: list, question: str, response, iterations: int) -> Optional[list]:
+        """Record a reply without tool calls; get the question's result if it is the final one"""
+        if "END" in response.content:
+            final_response = response.content.replace("END", "").strip()
+            self.log.info(f"Analysis complete after {iterations} iterations")
+            chat_history.append(
+                {
+                    "role": "assistant",
+                    "content": final_response,
+                }
             )
 
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                *self.cut_history(chat_history),
+            self.log.info(f"Final response: {final_response}")
+
+            return [
+                {
+                    "role": "user",
+                    "content": question,
+                },
+                {
+                    "role": "assistant",
+                    "content": final_response,
+                },
             ]
 
-            try:
-                completion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    tools=self.converted_tools,
-                    tool_choice="auto",
-                    temperature=0,
-                )
-            except BadRequestError as e:
-                if "maximum" in str(e).lower():
-                    self.log.warning(
-                        f"Max context length exceeded for question: {question} ({e}), rolling back history"
-                    )
-                    chat_history = self.rollback_history(chat_history, e)
-                    continue
-                else:
-                    raise e
-            except Exception as e:
-                if (
-                    "rate" in str(e).lower()
-                    or "quota" in str(e).lower()
-                    or "resource" in str(e).lower()
-                    or "maximum" in str(e).lower()
-                ):
-                    self.log.warning(
-                        f"Rate limit exceeded for question: {question}, rolling back history"
-                    )
-                    chat_history = self.rollback_history(chat_history, e)
-                    continue
-                else:
-                    raise e
+        chat_history.append({"role": "assistant", "content": response.content})
 
-            response = completion.choices[0].message
+        self.log.info(f"Response: {response.content}")
 
-            if response.tool_calls:
-                tool_messages = self.call_tools(question, response)
-                chat_history.extend(tool_messages)
-            else:
-                if "END" in response.content:
-                    final_response = response.content.replace("END", "").strip()
-                    self.log.info(f"Analysis complete after {iterations} iterations")
-                    chat_history.append(
-                        {
-                            "role": "assistant",
-                            "content": final_response,
-                        }
-                    )
-
-                    self.log.info(f"Final response: {final_response}")
-
-                    return [
-                        {
-                            "role": "user",
-                            "content": question,
-                        },
-                        {
-                            "role": "assistant",
-                            "content": final_response,
-                        },
-                    ]
-
-                chat_history.append({"role": "assistant", "content": response.content})
-
-                self.log.info(f"Response: {response.content}")
-
-                chat_history.append(
-                    {
-                        "role": "user",
-                        "content": "Continue analyzing this question. When you have completed the analysis, include 'END' at the end of your response.",
-                    }
-                )
+        chat_history.append(
+            {
+                "role": "user",
+                "content": "Continue analyzing this question. When you have completed the analysis, include 'END' at the end of your response.",
+            }
+        )
+        return None
 
+    def _unfinished(self, chat_history: list, question: str) -> list:
         self.log.warning("Reached maximum iterations without completing analysis")
         self.log.warning(f"Final chat history: {chat_history}")
 
@@ -304,3 +297,40 @@ ACTION: Collect as much information as possible about the Reddit user/community
                 "content": chat_history[-1]["content"],
             },
         ]
+
+    def analysis_steps(self, previous_chat_history: list, question: str, prompt: str) -> Steps:
+        """Steps that analyze a sub-question (see common.steps)"""
+        chat_history = self._start_history(previous_chat_history, question, prompt)
+
+        iterations = 0
+
+        while iterations < MAX_ITERATIONS:
+            iterations += 1
+            self.log.info(
+                f"Iteration {iterations} for question: {question} ({self.main_perspective})"
+            )
+
+            try:
+                completion = yield Completion(**self._request(chat_history))
+            except Exception as e:
+                chat_history = self._recover(chat_history, question, e)
+                continue
+
+            response = completion.choices[0].message
+
+            if response.tool_calls:
+                chat_history.extend((yield from self.tool_steps(question, response)))
+            else:
+                result = self._answer(chat_history, question, response, iterations)
+                if result is not None:
+                    return result
+
+        return self._unfinished(chat_history, question)
+
+    def analyze(self, previous_chat_history: list, question: str, prompt: str) -> str:
+        """Analyze a specific sub-question using tools and LLM capabilities"""
+        return run_steps(self.analysis_steps(previous_chat_history, question, prompt), self.client)
+
+    async def analyze_async(self, previous_chat_history: list, question: str, prompt: str) -> str:
+        """Like analyze, with an AsyncOpenAI client"""
+        return await run_steps_async(self.analysis_steps(previous_chat_history, question, prompt), self.client)
@@ -1,10 +1,10 @@
 import json
 import os
-import time
 from typing import List, Dict, Any, Optional, Mapping
 from openai import Client
 from pydantic import BaseModel, Field
 
+from RedditReportGenerator.common.steps import Steps, complete_with_retries, run_steps, run_steps_async
 from RedditReportGenerator.common.utils import get_logger, try_validate_json
 from RedditReportGenerator.common.data_types import PerspectiveWeight, CheckReport
 
@@ -26,13 +26,7 @@ You are an expert evaluator to check the logical consistency and reasoning chain
 """.strip()
         self.log = get_logger("StatelessChecker", user_or_community_id=user_or_community_id)
 
-    def check(
-        self,
-        user_or_community_id: str,
-        analysis_categories: dict,
-        perspective_analyst_reports: dict,
-    ) -> CheckReport:
-        """Check the quality and consistency of perspective analysis reports"""
+    def _check_messages(self, analysis_categories: dict, perspective_analyst_reports: dict) -> list:
         system_message = self.system_message.format()
 
         analysis = ""
@@ -65,7 +59,7 @@ Make sure your response is ONE valid JSON that follows this schema exactly.
             check_report_schema=CheckReport.model_json_schema(),
         )
 
-        messages = [
+        return [
             {"role": "system", "content": system_message},
             {
                 "role": "user",
@@ -73,42 +67,75 @@ Make sure your response is ONE valid JSON that follows this schema exactly.
             },
         ]
 
-        self.log.debug(messages)
-
-        while True:
-            try:
-                completion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=0,
-                )
+    def _parse_check_report(self, completion) -> CheckReport:
+        self.log.debug(completion)
+        response = completion.choices[0].message.content
 
-                self.log.debug(completion)
-                response = completion.choices[0].message.content
-
-                reports = [
-                    try_validate_json(CheckReport, no_prefix.strip("\n```"))
-                    for no_prefix in response.split("```json\n")
-                    if no_prefix and '"$defs"' not in no_prefix
-                ]
-
-                existing_reports = [report for report in reports if report]
+        reports = [
+            try_validate_json(CheckReport, no_prefix.strip("\n```"))
+            for no_prefix in response.split("```json\n")
+            if no_prefix and '"$defs"' not in no_prefix
+        ]
 
-                if not existing_reports:
-                    raise ValueError(
-                        "No valid JSON found in the response {}".format(response)
-                    )
+        existing_reports = [report for report in reports if report]
 
-                report = existing_reports[0]
-                break
+        if not existing_reports:
+            raise ValueError(
+                "No valid JSON found in the response {}".format(response)
+            )
 
-            except Exception as e:
-                self.log.error(f"Error in checking: {e}")
-                time.sleep(10)
-                continue
+        return existing_reports[0]
 
+    @staticmethod
+    def _save_check_report(user_or_community_id: str, report: CheckReport):
         os.makedirs("check_reports", exist_ok=True)
         with open(f"check_reports/{user_or_community_id}.json", "w") as f:
             f.write(report.model_dump_json(indent=4))
 
+    def check_steps(
+        self,
+        user_or_community_id: str,
+        analysis_categories: dict,
+        perspective_analyst_reports: dict,
+    ) -> Steps:
+        """Steps that check the perspective reports (see common.steps)"""
+        messages = self._check_messages(analysis_categories, perspective_analyst_reports)
+        self.log.debug(messages)
+
+        report = yield from complete_with_retries(
+            dict(
+                model=self.model,
+                messages=messages,
+                temperature=0,
+            ),
+            self._parse_check_report,
+            self.log,
+            "checking",
+        )
+
+        self._save_check_report(user_or_community_id, report)
         return report
+
+    def check(
+        self,
+        user_or_community_id: str,
+        analysis_categories: dict,
+        perspective_analyst_reports: dict,
+    ) -> CheckReport:
+        """Check the quality and consistency of perspective analysis reports"""
+        return run_steps(
+            self.check_steps(user_or_community_id, analysis_categories, perspective_analyst_reports),
+            self.client,
+        )
+
+    async def check_async(
+        self,
+        user_or_community_id: str,
+        analysis_categories: dict,
+        perspective_analyst_reports: dict,
+    ) -> CheckReport:
+        """Like check, with an AsyncOpenAI client"""
+        return await run_steps_async(
+            self.check_steps(user_or_community_id, analysis_categories, perspective_analyst_reports),
+            self.client,
+        )
@@ -1,9 +1,9 @@
 import os
 import json
-import time
 from typing import List
 from openai import Client
 from pydantic import BaseModel, Field
+from RedditReportGenerator.common.steps import Steps, complete_with_retries, run_steps, run_steps_async
 from RedditReportGenerator.common.utils import get_logger, try_validate_json
 from RedditReportGenerator.common.data_types import CheckEval, FinalReport
 from RedditReportGenerator.roles.stateless_checker import CheckReport
@@ -24,14 +24,9 @@ ROLE: You are the final evaluator determining the comprehensive analysis of the
 """.strip()
         self.log = get_logger("StatelessScorer", user_or_community_id=user_or_community_id)
 
-    def score(
-        self,
-        user_or_community_id: str,
-        perspective_analyst_reports: dict,
-        check_report: CheckReport,
-        analysis_categories: dict,
-    ) -> FinalReport:
-        """Score and aggregate all perspective analyses to produce a final report"""
+    def _score_messages(
+        self, perspective_analyst_reports: dict, check_report: CheckReport, analysis_categories: dict
+    ) -> list:
         human_message = """
 Here are different perspective analysis reports for analyzing the same Reddit user/community:
 {analysis}
@@ -62,7 +57,7 @@ Wrap the output in `json` tags with the structure of the FinalReport.
         for perspective, report in perspective_analyst_reports.items():
             analysis += f"Report on {perspective} perspective:\n{report}\n\n"
 
-        messages = [
+        return [
             {"role": "system", "content": system_message},
             {
                 "role": "user",
@@ -74,44 +69,81 @@ Wrap the output in `json` tags with the structure of the FinalReport.
             },
         ]
 
-        self.log.debug(messages)
-
-        while True:
-            try:
-                completion = self.client.chat.completions.create(
-                    model=self.model, messages=messages, temperature=0
-                )
+    def _parse_final_report(self, completion) -> FinalReport:
+        response = completion.choices[0].message.content
+        self.log.debug(response)
 
-                response = completion.choices[0].message.content
-                self.log.debug(response)
-
-                reports = [
-                    try_validate_json(FinalReport, no_prefix.strip("\n```"))
-                    for no_prefix in response.split("```json\n")
-                    if no_prefix and '"$defs"' not in no_prefix
-                ]
-
-                existing_reports = [report for report in reports if report]
+        reports = [
+            try_validate_json(FinalReport, no_prefix.strip("\n```"))
+            for no_prefix in response.split("```json\n")
+            if no_prefix and '"$defs"' not in no_prefix
+        ]
 
-                if not existing_reports:
-                    raise ValueError(
-                        "No valid JSON found in the response {}".format(response)
-                    )
+        existing_reports = [report for report in reports if report]
 
-                report = existing_reports[0]
-                break
+        if not existing_reports:
+            raise ValueError(
+                "No valid JSON found in the response {}".format(response)
+            )
 
-            except Exception as e:
-                self.log.error(f"Error in scoring: {e}")
-                time.sleep(10)
-                continue
+        return existing_reports[0]
 
+    def _save_final_report(self, user_or_community_id: str, report: FinalReport, perspective_analyst_reports: dict):
         os.makedirs("score_reports", exist_ok=True)
         with open(f"score_reports/{user_or_community_id}.output.md", "w") as f:
             f.write(self._format_report(report, perspective_analyst_reports))
 
+    def score_steps(
+        self,
+        user_or_community_id: str,
+        perspective_analyst_reports: dict,
+        check_report: CheckReport,
+        analysis_categories: dict,
+    ) -> Steps:
+        """Steps that score the perspective reports into the final report (see common.steps)"""
+        messages = self._score_messages(perspective_analyst_reports, check_report, analysis_categories)
+        self.log.debug(messages)
+
+        report = yield from complete_with_retries(
+            dict(
+                model=self.model,
+                messages=messages,
+                temperature=0,
+            ),
+            self._parse_final_report,
+            self.log,
+            "scoring",
+        )
+
+        self._save_final_report(user_or_community_id, report, perspective_analyst_reports)
         return report
 
+    def score(
+        self,
+        user_or_community_id: str,
+        perspective_analyst_reports: dict,
+        check_report: CheckReport,
+        analysis_categories: dict,
+    ) -> FinalReport:
+        """Score and aggregate all perspective analyses to produce a final report"""
+        return run_steps(
+            self.score_steps(user_or_community_id, perspective_analyst_reports, check_report, analysis_categories),
+            self.client,
+        )
+
+    async def score_async(
+        self,
+        user_or_community_id: str,
+        perspective_analyst_reports: dict,
+        check_report: CheckReport,
+        analysis_categories: dict,
+    ) -> FinalReport:
+        """Like score, with an AsyncOpenAI client"""
+        return await run_steps_async(
+            self.score_steps(user_or_community_id, perspective_analyst_reports, check_report, analysis_categories),
+            self.client,
+        )
+
     def _format_report(self, final_report: FinalReport, perspective_reports: dict) -> str:
         """Format the final report as Markdown"""
         markdown = f"""# Reddit User/Community Analysis Report
@@ -0,0 +1,1249 @@
+import json
+import sys
+sys.path.insert(0, '.')
+
+from RedditReportGenerator.tools.reddit_snapshot import open_snapshot, write_snapshot
+from RedditReportGenerator.tools.reddit_tools import (
+    RedditRecords,
+    get_user_posts,
+    get_user_comments,
+    get_user_activity_count,
+    get_user_karma,
+    get_top_comments,
+    get_post_comment_ratio,
+)
+
+POSTS = [
+    {"id": "p1", "author": "alice", "title": "Hello", "selftext": "great model", "score": 10, "created": 100},
+    {"id": "p2", "author": "bob", "title": "Question", "selftext": "bad answer", "score": 3, "created": 200},
+    {"id": "p3", "author": "alice", "title": "Again", "selftext": "", "score": 5, "created": 300},
+]
+
+COMMENTS = [
+    {"id": "c1", "author": "bob", "body": "good point", "score": 2, "created": 150, "parent_id": "t3_p1"},
+    {"id": "c2", "author": "alice", "body": "thanks", "score": 7, "created": 160, "parent_id": "t1_c1"},
+    {"id": "c3", "author": "", "body": "[removed]", "score": 0, "created": 170, "parent_id": "t3_p1"},
+    {"id": "c4", "author": "bob", "body": "awful", "score": -1, "created": 250, "parent_id": "t3_p2"},
+]
+
+
+def test_indexed_lookup_matches_scan():
+    posts, comments = RedditRecords(POSTS), RedditRecords(COMMENTS)
+    for user in ["alice", "bob", "nobody"]:
+        assert get_user_posts(user, posts) == get_user_posts(user, POSTS)
+        assert get_user_comments(user, comments) == get_user_comments(user, COMMENTS)
+        assert get_user_karma(user, posts, comments) == get_user_karma(user, POSTS, COMMENTS)
+
+
+def test_user_counts_and_ratio():
+    posts, comments = RedditRecords(POSTS), RedditRecords(COMMENTS)
+    assert get_user_activity_count("alice", posts, comments) == {
+        "total_posts": 2,
+        "total_comments": 1,
+        "total_activity": 3,
+    }
+    assert get_post_comment_ratio("alice", posts, comments) == 2.0
+    assert get_post_comment_ratio("bob", posts, comments) == 0.5
+    assert [c["id"] for c in get_top_comments("bob", comments, limit=1)] == ["c1"]
+
+
+def _write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def test_snapshot_round_trip(tmp_path):
+    posts_file, comments_file = str(tmp_path / "posts.jsonl"), str(tmp_path / "comments.jsonl")
+    _write_jsonl(posts_file, POSTS)
+    _write_jsonl(comments_file, COMMENTS)
+    assert open_snapshot(posts_file) is None
+
+    write_snapshot(posts_file)
+    write_snapshot(comments_file)
+    posts, comments = open_snapshot(posts_file), open_snapshot(comments_file)
+
+    assert len(posts) == len(POSTS) and len(comments) == len(COMMENTS)
+    assert comments[1].get("parent_id") == "t1_c1"
+    for user in ["alice", "bob", "nobody"]:
+        assert get_user_posts(user, posts) == get_user_posts(user, POSTS)
+        assert get_user_comments(user, comments) == get_user_comments(user, COMMENTS)
+
+
+def test_snapshot_is_ignored_when_source_changes(tmp_path):
+    posts_file = str(tmp_path / "posts.jsonl")
+    _write_jsonl(posts_file, POSTS)
+    write_snapshot(posts_file)
+    _write_jsonl(posts_file, POSTS[:1])
+    assert open_snapshot(posts_file) is None
+
+
+def test_parallel_jsonl_matches_sequential(tmp_path, caplog):
+    from RedditReportGenerator.common import utils
+
+    comments_file = str(tmp_path / "comments.jsonl")
+    _write_jsonl(comments_file, COMMENTS * 50)
+    with open(comments_file, "a", encoding="utf-8") as f:
+        f.write("{broken\n")
+
+    sequential = utils.load_jsonl_file(comments_file, workers=1)
+    sequential_warnings = len(caplog.records)
+    parallel = utils.load_jsonl_file(comments_file, workers=3)
+
+    assert parallel == sequential == COMMENTS * 50
+    assert sequential_warnings == 1
+    assert len(caplog.records) == 2
+
+
+def test_projected_load_reads_text_lazily(tmp_path):
+    from RedditReportGenerator.tools.reddit_tools import load_comments
+
+    comments_file = str(tmp_path / "comments.jsonl")
+    _write_jsonl(comments_file, [dict(comment, extra="x" * 100) for comment in COMMENTS])
+    comments = load_comments(comments_file)
+
+    assert "extra" not in comments[0]
+    assert type(comments.columns["body"]).__name__ == "LazyTextColumn"
+    assert comments[0].get("body") == "good point"
+    assert comments[3]["body"] == "awful"
+    assert get_user_comments("bob", comments) == get_user_comments("bob", COMMENTS)
+
+
+def test_compact_store_round_trips_records():
+    from RedditReportGenerator.tools.reddit_store import RedditRecords as Store
+
+    records = [
+        {"id": "abc12", "author": "alice", "parent_id": "t3_zz9", "score": 4, "flair": ["x"]},
+        {"id": "0lead", "author": "alice", "parent_id": "weird", "body": None},
+        {"author": "bob", "parent_id": "t1_Upper", "score": -2},
+    ]
+    store = Store(records)
+
+    assert store[0]["id"] == "abc12" and store[0]["parent_id"] == "t3_zz9"
+    assert store[0]["flair"] == ["x"]
+    assert store[1]["id"] == "0lead" and store[1]["parent_id"] == "weird"
+    assert store[1]["score"] == 0 and store[1]["body"] == ""
+    assert store[2]["parent_id"] == "t1_Upper" and store[2]["id"] == ""
+    assert [view.row for view in store.by_author("alice")] == [0, 1]
+    assert store.author_counts() == {"alice": 2, "bob": 1}
+    assert json.dumps(store[2].to_dict())
+
+
+def test_incomplete_store_fails_when_created():
+    import pytest
+
+    from RedditReportGenerator.tools.reddit_store import ColumnarRecords
+
+    class NoAuthorIndex(ColumnarRecords):
+        def author_counts(self):
+            return {}
+
+    with pytest.raises(TypeError):
+        NoAuthorIndex()
+
+
+def test_refresh_ingests_appended_lines(tmp_path):
+    from RedditReportGenerator.tools.reddit_tools import load_comments
+
+    comments_file = str(tmp_path / "comments.jsonl")
+    _write_jsonl(comments_file, COMMENTS[:2])
+    comments = load_comments(comments_file)
+    assert comments.refresh() == 0
+
+    with open(comments_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(COMMENTS[2]) + "\n" + json.dumps(COMMENTS[3]) + "\n" + '{"id": "c5", "auth')
+
+    version = comments.version
+    assert comments.refresh() == 2
+    assert comments.version == version + 1
+    assert get_user_comments("bob", comments) == get_user_comments("bob", COMMENTS)
+    assert comments[3]["body"] == "awful"
+
+
+def test_load_stops_before_partial_last_line(tmp_path):
+    comments_file = str(tmp_path / "comments.jsonl")
+    line = json.dumps(COMMENTS[1])
+    with open(comments_file, "w", encoding="utf-8") as f:
+        f.write(json.dumps(COMMENTS[0]) + "\n" + line[:10])
+    comments = RedditRecords.from_jsonl(comments_file)
+    assert [comment["id"] for comment in comments] == ["c1"]
+
+    with open(comments_file, "a", encoding="utf-8") as f:
+        f.write(line[10:] + "\n")
+    assert comments.refresh() == 1
+    assert [comment["id"] for comment in comments] == ["c1", "c2"]
+
+
+def test_snapshot_appends_new_lines(tmp_path):
+    posts_file = str(tmp_path / "posts.jsonl")
+    _write_jsonl(posts_file, POSTS[:2])
+    write_snapshot(posts_file)
+    posts = open_snapshot(posts_file)
+
+    with open(posts_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(POSTS[2]) + "\n")
+
+    assert posts.refresh() == 1
+    assert get_user_posts("alice", posts) == get_user_posts("alice", POSTS)
+    assert get_user_karma("alice", posts, []) == get_user_karma("alice", POSTS, [])
+    assert open_snapshot(posts_file).manifest["rows"] == len(POSTS)
+
+    _write_jsonl(posts_file, POSTS + [dict(POSTS[0], id="p4", author="carol")])
+    reopened = open_snapshot(posts_file)
+    assert len(reopened) == 4 and reopened.author_counts()["carol"] == 1
+
+
+def test_profiles_match_scanned_records(tmp_path):
+    from RedditReportGenerator.tools.reddit_tools import get_user_profile, get_user_sentiment
+
+    posts_file, comments_file = str(tmp_path / "posts.jsonl"), str(tmp_path / "comments.jsonl")
+    _write_jsonl(posts_file, POSTS)
+    _write_jsonl(comments_file, COMMENTS)
+    write_snapshot(posts_file)
+    write_snapshot(comments_file)
+
+    for posts, comments in [
+        (RedditRecords(POSTS), RedditRecords(COMMENTS)),
+        (open_snapshot(posts_file), open_snapshot(comments_file)),
+    ]:
+        for user in ["alice", "bob", "nobody"]:
+            assert get_user_sentiment(user, posts, comments) == get_user_sentiment(user, POSTS, COMMENTS)
+            assert get_user_karma(user, posts, comments) == get_user_karma(user, POSTS, COMMENTS)
+
+        profile = get_user_profile("alice", posts, comments)
+        assert profile.posts.to_dict() == {
+            "count": 2, "karma": 15, "score_squares": 125.0, "min_score": 5, "max_score": 10,
+            "sentiment": 1.0, "first_created": 100, "last_created": 300,
+        }
+        assert profile.active_span() == {"first_activity": 100, "last_activity": 300}
+
+
+def test_sentiment_matches_whole_words(tmp_path):
+    from RedditReportGenerator.tools.reddit_text import batch_sentiment
+    from RedditReportGenerator.tools.reddit_tools import analyze_post_sentiment, get_community_sentiment
+
+    assert analyze_post_sentiment("Goodbye, poorly worded") == 0.0
+    assert analyze_post_sentiment("GOOD good, but bad!") == 0.0
+    assert list(batch_sentiment(["great", "awful awful", "great but poor or bad"])) == [1.0, -1.0, -1 / 3]
+
+    comments_file = str(tmp_path / "comments.jsonl")
+    _write_jsonl(comments_file, COMMENTS)
+    write_snapshot(comments_file)
+    for comments in [RedditRecords(COMMENTS), open_snapshot(comments_file)]:
+        assert list(comments.columns["sentiment"]) == [1.0, 0.0, 0.0, -1.0]
+        assert get_community_sentiment(POSTS, comments) == get_community_sentiment(POSTS, COMMENTS)
+
+
+def test_keyword_matrix_matches_streaming_counts():
+    from RedditReportGenerator.tools import reddit_tools
+    from RedditReportGenerator.tools.reddit_tools import extract_keywords, get_keyword_idf, get_user_keywords
+
+    posts = RedditRecords(POSTS + [{"author": "carol", "title": "model rare-word!", "score": 1}])
+    comments = RedditRecords(COMMENTS + [{"author": "dave", "body": "model again", "score": 1}])
+    streamed = {user: get_user_keywords(user, posts, comments) for user in ["alice", "bob", "carol"]}
+    assert streamed["carol"] == ["model", "rareword"]
+
+    reddit_tools.USE_KEYWORD_MATRIX = True
+    try:
+        for user, keywords in streamed.items():
+            assert get_user_keywords(user, posts, comments) == keywords
+    finally:
+        reddit_tools.USE_KEYWORD_MATRIX = False
+
+    assert posts.term_matrix() is posts.term_matrix()
+    assert get_user_keywords("carol", posts, comments, tfidf=True) == ["rareword", "model"]
+    idf = get_keyword_idf(posts, comments)
+    assert extract_keywords("model model rareword rareword", idf=idf) == ["rareword", "model"]
+
+
+def test_community_aggregates_follow_dataset_version(tmp_path):
+    from RedditReportGenerator.tools.reddit_tools import (
+        get_community_activity_stats,
+        get_community_aggregates,
+        get_top_authors,
+        load_comments,
+    )
+
+    comments_file = str(tmp_path / "comments.jsonl")
+    _write_jsonl(comments_file, COMMENTS[:3])
+    posts, comments = RedditRecords(POSTS), load_comments(comments_file)
+    aggregates = get_community_aggregates(posts, comments)
+    assert get_community_aggregates(posts, comments) is aggregates
+    assert get_top_authors(posts, comments, 1) == [{"author": "alice", "activity_count": 3}]
+
+    with open(comments_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(COMMENTS[3]) + "\n" + json.dumps(dict(COMMENTS[3], id="c5")) + "\n")
+    comments.refresh()
+
+    assert get_community_aggregates(posts, comments) is not aggregates
+    assert get_top_authors(posts, comments, 2) == get_top_authors(POSTS, COMMENTS + [dict(COMMENTS[3], id="c5")], 2)
+    assert get_community_activity_stats(posts, comments)["total_comments"] == 5
+
+
+def test_time_index_frequency_and_histograms():
+    from RedditReportGenerator.tools.reddit_tools import get_post_frequency_stats, get_user_timeline
+
+    day = 86400
+    # Monday 2023-03-27 00:00 UTC, records deliberately out of time order
+    start = 1679875200
+    posts = [
+        {"id": f"p{i}", "author": "alice" if i % 2 else "bob", "created": start + offset, "score": 1}
+        for i, offset in enumerate([9 * day, 0, 3600, 2 * day, 8 * day, 9 * day + 7200, 0])
+    ]
+    posts[-1]["created"] = 0
+
+    for records in [posts, RedditRecords(posts)]:
+        stats = get_post_frequency_stats(records)
+        assert stats["total_posts"] == 7
+        assert stats["span_days"] == 9 * day / day + 7200 / day
+        assert stats["avg_posts_per_day"] == 6 / stats["span_days"]
+        assert (stats["first_post"], stats["last_post"]) == ("2023-03-27", "2023-04-05")
+        assert stats["active_days"] == 4
+        assert stats["trend"] == {"direction": "stable", "earlier_half": 3, "later_half": 3, "change": 0.0}
+
+        timeline = get_user_timeline("alice", records, [], bucket="week")
+        assert timeline["activity"]["total"] == 3
+        assert timeline["histogram"] == [
+            {"start": "2023-03-27", "posts": 2, "comments": 0},
+            {"start": "2023-04-03", "posts": 1, "comments": 0},
+        ]
+
+
+def test_time_windows_match_filtered_records():
+    from RedditReportGenerator.tools.reddit_tools import (
+        get_post_frequency_stats,
+        get_top_authors,
+        get_user_activity_count,
+        get_user_karma,
+        window_records,
+    )
+
+    day = 86400
+    start = 1679875200
+    posts = [
+        {"id": f"p{i}", "author": ["alice", "bob", "carol"][i % 3], "created": start + i * day // 2, "score": i}
+        for i in range(12)
+    ]
+    comments = [dict(post, id=f"c{i}", body="reply") for i, post in enumerate(reversed(posts))]
+    since, until = "2023-03-28", "2023-03-30"
+    low, high = start + day, start + 4 * day
+    expected_posts = [post for post in posts if low <= post["created"] < high]
+    expected_comments = [comment for comment in comments if low <= comment["created"] < high]
+
+    for post_records, comment_records in [(posts, comments), (RedditRecords(posts), RedditRecords(comments))]:
+        windowed_posts = window_records(post_records, since, until)
+        windowed_comments = window_records(comment_records, since, until)
+        assert [post["id"] for post in windowed_posts] == [post["id"] for post in expected_posts]
+        assert get_user_activity_count("alice", windowed_posts, windowed_comments) == get_user_activity_count(
+            "alice", expected_posts, expected_comments
+        )
+        assert get_user_karma("bob", windowed_posts, windowed_comments) == get_user_karma(
+            "bob", expected_posts, expected_comments
+        )
+        assert get_top_authors(windowed_posts, windowed_comments, 2) == get_top_authors(
+            expected_posts, expected_comments, 2
+        )
+        assert get_post_frequency_stats(windowed_posts)["total_posts"] == len(expected_posts)
+        assert window_records(post_records) is post_records
+
+
+def test_windowed_graph_and_threads_are_cached_per_bounds():
+    from RedditReportGenerator.tools.reddit_tools import (
+        get_influence_scores,
+        get_reply_graph,
+        get_user_comment_contexts,
+        get_user_influence,
+        window_records,
+    )
+
+    posts, comments = RedditRecords(POSTS), RedditRecords(COMMENTS)
+    expected_posts = [post for post in POSTS if 100 <= post["created"] < 200]
+    expected_comments = [comment for comment in COMMENTS if 100 <= comment["created"] < 200]
+    windowed_posts, windowed_comments = window_records(posts, 100, 200), window_records(comments, 100, 200)
+    assert window_records(posts, 100, 200) is windowed_posts
+
+    graph = get_reply_graph(windowed_posts, windowed_comments)
+    assert get_reply_graph(window_records(posts, 100, 200), window_records(comments, 100, 200)) is graph
+    assert get_reply_graph(posts, comments) is not graph
+    assert get_influence_scores(windowed_posts, windowed_comments) is get_influence_scores(
+        windowed_posts, windowed_comments
+    )
+    assert get_user_influence("bob", windowed_posts, windowed_comments) == get_user_influence(
+        "bob", expected_posts, expected_comments
+    )
+    assert get_user_comment_contexts("bob", windowed_posts, windowed_comments) == get_user_comment_contexts(
+        "bob", expected_posts, expected_comments
+    )
+
+    posts.append({"id": "p4", "author": "bob", "created": 150})
+    posts.version += 1
+    assert window_records(posts, 100, 200) is not windowed_posts
+    assert len(window_records(posts, 100, 200)) == 2
+
+
+def test_reply_graph_degrees_and_interlocutors():
+    from RedditReportGenerator.tools.reddit_tools import get_user_interlocutors, get_user_reply_stats
+
+    posts = [{"id": "p1", "author": "alice"}, {"id": "p2", "author": "bob"}]
+    comments = [
+        {"id": "c1", "author": "bob", "parent_id": "t3_p1"},
+        {"id": "c2", "author": "alice", "parent_id": "t1_c1"},
+        {"id": "c3", "author": "carol", "parent_id": "t1_c2"},
+        {"id": "c4", "author": "bob", "parent_id": "t1_c2"},
+        {"id": "c5", "author": "alice", "parent_id": "t3_p2"},
+        {"id": "c6", "author": "alice", "parent_id": "t3_p1"},
+        {"id": "c7", "author": "dave", "parent_id": "t3_gone"},
+        {"id": "c8", "author": "[deleted]", "parent_id": "t3_p1"},
+    ]
+
+    for post_records, comment_records in [(posts, comments), (RedditRecords(posts), RedditRecords(comments))]:
+        assert get_user_reply_stats("alice", post_records, comment_records) == {
+            "out_degree": 1,
+            "in_degree": 2,
+            "replies_sent": 2,
+            "replies_received": 3,
+            "mutual_connections": 1,
+            "reciprocity": 1.0,
+        }
+        assert get_user_interlocutors("alice", post_records, comment_records) == [
+            {"author": "bob", "replies_sent": 2, "replies_received": 2, "total_replies": 4},
+            {"author": "carol", "replies_sent": 0, "replies_received": 1, "total_replies": 1},
+        ]
+        assert get_user_reply_stats("carol", post_records, comment_records)["reciprocity"] == 0.0
+        assert get_user_interlocutors("nobody", post_records, comment_records) == []
+
+
+def test_influence_scores_update_incrementally(tmp_path):
+    from RedditReportGenerator.tools.reddit_graph import InfluenceScores, ReplyGraph
+    from RedditReportGenerator.tools.reddit_tools import get_influence_scores, get_user_influence, load_comments
+
+    posts = [{"id": f"p{i}", "author": f"u{i}"} for i in range(4)]
+    comments = [
+        {"id": f"c{i}", "author": f"u{i * 7 % 5}", "parent_id": f"t3_p{i % 4}" if i % 3 else f"t1_c{i // 2}"}
+        for i in range(40)
+    ]
+
+    # Dense power iteration as a reference
+    graph = ReplyGraph.build(posts, comments)
+    n = len(graph.authors)
+    weights = [[0] * n for _ in range(n)]
+    for source in range(n):
+        for target, count in graph.replied_to(graph.authors[source]).items():
+            weights[source][target] = count
+    expected = [1.0 / n] * n
+    for _ in range(200):
+        passed = [
+            [0.85 * expected[s] * w / sum(weights[s]) for w in weights[s]] if sum(weights[s]) else None
+            for s in range(n)
+        ]
+        jump = (0.15 + 0.85 * sum(expected[s] for s in range(n) if passed[s] is None)) / n
+        expected = [jump + sum(passed[s][t] for s in range(n) if passed[s]) for t in range(n)]
+
+    scores = InfluenceScores.compute(graph)
+    assert all(abs(a - b) < 1e-6 for a, b in zip(scores.scores, expected))
+    assert abs(sum(scores.scores) - 1) < 1e-9
+    top = scores.top_authors(1)[0]
+    assert top["rank"] == 1 and top["pagerank"] == max(scores.scores)
+
+    comments_file = str(tmp_path / "comments.jsonl")
+    with open(comments_file, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(comment) + "\n" for comment in comments[:30])
+    stored = load_comments(comments_file)
+    posts = RedditRecords(posts)
+    before = get_influence_scores(posts, stored)
+    assert get_influence_scores(posts, stored) is before
+
+    with open(comments_file, "a", encoding="utf-8") as f:
+        f.writelines(json.dumps(comment) + "\n" for comment in comments[30:])
+    stored.refresh()
+    after = get_influence_scores(posts, stored)
+    assert after is not before
+    for author in graph.authors:
+        assert abs(get_user_influence(author, posts, stored)["pagerank"] - expected[graph.author_ids[author]]) < 1e-5
+    assert get_user_influence("nobody", posts, stored)["rank"] is None
+
+
+def test_influence_scores_converge_on_large_graphs(monkeypatch):
+    import random
+
+    from RedditReportGenerator.tools import reddit_graph
+    from RedditReportGenerator.tools.reddit_graph import InfluenceScores, ReplyGraph
+
+    rng = random.Random(0)
+    posts = [{"id": f"p{i}", "author": f"u{i}"} for i in range(2000)]
+    comments = []
+    for i in range(8000):
+        parent = f"t1_c{rng.randrange(i)}" if i and rng.random() < 0.5 else f"t3_p{rng.randrange(2000)}"
+        comments.append({"id": f"c{i}", "author": f"u{rng.randrange(2000)}", "parent_id": parent})
+
+    graph = ReplyGraph.build(posts, comments)
+    previous = InfluenceScores.compute(ReplyGraph.build(posts, comments[:7700]))
+    scores = InfluenceScores.compute(graph)
+    updated = InfluenceScores.compute(graph, previous)
+
+    monkeypatch.setattr(reddit_graph, "TOLERANCE", 0.0)
+    monkeypatch.setattr(reddit_graph, "MAX_ITERATIONS", 500)
+    converged = InfluenceScores.compute(graph)
+
+    # Warm-started from the scores before the last replies, the update converges sooner
+    assert len(graph.authors) > 1000 and updated.iterations < scores.iterations
+    for result in (scores, updated):
+        assert sum(abs(a - b) for a, b in zip(result.scores, converged.scores)) < 1e-5
+
+
+def test_thread_index_context_and_engagement():
+    from RedditReportGenerator.tools.reddit_tools import get_comment_context, get_thread_engagement
+
+    posts = [{"id": "p1", "author": "alice", "title": "Hello", "score": 3}, {"id": "p2", "author": "bob"}]
+    comments = [
+        {"id": "c3", "author": "carol", "parent_id": "t1_c1", "score": 1, "created": 30},
+        {"id": "c1", "author": "bob", "parent_id": "t3_p1", "score": 5, "created": 10},
+        {"id": "c2", "author": "alice", "parent_id": "t1_c1", "score": 9, "created": 20},
+        {"id": "c4", "author": "bob", "parent_id": "t1_c3", "score": 2, "created": 40},
+        {"id": "c5", "author": "dave", "parent_id": "t3_p1", "score": 0, "created": 50},
+        {"id": "c6", "author": "erin", "parent_id": "t3_p2", "score": 4, "created": 60},
+        {"id": "c7", "author": "erin", "parent_id": "t1_gone", "link_id": "t3_p2", "created": 70},
+    ]
+
+    for post_records, comment_records in [(posts, comments), (RedditRecords(posts), RedditRecords(comments))]:
+        index = comment_records.thread_index() if hasattr(comment_records, "thread_index") else None
+        if index is not None:
+            c1 = index.row_of("t1_c1")
+            assert [comments[row]["id"] for row in index.subtree(c1)] == ["c1", "c3", "c4", "c2"]
+            assert index.sizes[c1] == 4 and index.depths[index.row_of("c4")] == 2
+
+        context = get_comment_context("c3", post_records, comment_records, reply_limit=1)
+        assert context["post"]["title"] == "Hello" and context["post"]["author"] == "alice"
+        assert [parent["id"] for parent in context["ancestors"]] == ["c1"]
+        assert context["comment"]["depth"] == 1 and context["comment"]["replies"] == 1
+        assert [reply["id"] for reply in context["top_replies"]] == ["c4"]
+        assert [reply["id"] for reply in get_comment_context("c1", post_records, comment_records)["top_replies"]] == [
+            "c2", "c3"
+        ]
+        assert get_comment_context("c7", post_records, comment_records)["post"]["id"] == "p2"
+
+        engagement = get_thread_engagement("t3_p1", post_records, comment_records)
+        assert engagement["total_comments"] == 5 and engagement["top_level_comments"] == 2
+        assert (engagement["max_depth"], engagement["avg_depth"]) == (2, 0.8)
+        assert (engagement["participants"], engagement["author_replies"]) == (4, 1)
+        assert (engagement["first_comment"], engagement["last_comment"]) == (10, 50)
+        assert get_thread_engagement("p2", post_records, comment_records)["total_comments"] == 2
+        assert get_thread_engagement("missing", post_records, comment_records)["total_comments"] == 0
+
+
+def test_search_index_segments_match_memory(tmp_path, monkeypatch):
+    from RedditReportGenerator.tools import reddit_snapshot
+    from RedditReportGenerator.tools.reddit_tools import search_content
+
+    words = ["pricing", "api", "model", "latency", "python", "token"]
+    day = 86400
+    posts = [
+        {"id": f"p{i}", "author": f"u{i % 3}", "title": f"{words[i % 6]} question", "selftext": words[i * 5 % 6],
+         "score": i, "created": 1680000000 + i * day}
+        for i in range(20)
+    ]
+    comments = [
+        {"id": f"c{i}", "author": f"u{i % 4}", "body": f"the {words[i % 6]} and {words[i * 5 % 6]} api",
+         "score": i, "created": 1680000000 + i * day // 2, "parent_id": "t3_p1"}
+        for i in range(30)
+    ]
+    posts_file, comments_file = str(tmp_path / "posts.jsonl"), str(tmp_path / "comments.jsonl")
+    _write_jsonl(posts_file, posts)
+    _write_jsonl(comments_file, comments[:25])
+    monkeypatch.setattr(reddit_snapshot, "SEGMENT_ROWS", 7)
+    write_snapshot(posts_file)
+    write_snapshot(comments_file)
+    with open(comments_file, "a", encoding="utf-8") as f:
+        f.writelines(json.dumps(comment) + "\n" for comment in comments[25:])
+    snapshot_posts, snapshot_comments = open_snapshot(posts_file), open_snapshot(comments_file)
+    assert snapshot_comments.manifest["search_segments"] == [0, 7, 14, 21, 25]
+
+    queries = [
+        ("api pricing", None, None, None),
+        ("python", "u1", None, None),
+        ("model token", None, "2023-04-01", "2023-04-05"),
+    ]
+    for query, author, since, until in queries:
+        expected = search_content(query, posts, comments, author, since, until, limit=8)
+        assert expected
+        assert search_content(query, RedditRecords(posts), RedditRecords(comments), author, since, until, 8) == expected
+        assert search_content(query, snapshot_posts, snapshot_comments, author, since, until, 8) == expected
+        assert all(author is None or result["author"] == author for result in expected)
+        assert all(any(word in result["snippet"] for word in query.split()) for result in expected)
+    assert search_content("nothing matches", snapshot_posts, snapshot_comments) == []
+
+
+def test_sql_queries_are_read_only_and_limited(tmp_path):
+    import pytest
+    from RedditReportGenerator.tools.reddit_tools import get_sql_database, load_comments, run_sql_query
+
+    comments_file = str(tmp_path / "comments.jsonl")
+    _write_jsonl(comments_file, COMMENTS[:3])
+    posts, comments = RedditRecords(POSTS), load_comments(comments_file)
+
+    result = run_sql_query(
+        "SELECT author, COUNT(*), SUM(score) FROM posts GROUP BY author ORDER BY author", posts, comments
+    )
+    assert result == {
+        "columns": ["author", "COUNT(*)", "SUM(score)"],
+        "rows": [["alice", 2, 15], ["bob", 1, 3]],
+        "truncated": False,
+    }
+    assert run_sql_query("SELECT id FROM comments ORDER BY id", posts, comments, max_rows=2) == {
+        "columns": ["id"], "rows": [["c1"], ["c2"]], "truncated": True
+    }
+
+    _write_jsonl(comments_file, COMMENTS)
+    comments.refresh()
+    query = "SELECT COUNT(*) FROM comments WHERE parent_id LIKE 't3_%' AND sentiment < 0"
+    assert run_sql_query(query, posts, comments)["rows"] == [[1]]
+
+    for statement in ["DELETE FROM posts", "PRAGMA table_info(posts)", "SELECT 1; DROP TABLE posts"]:
+        with pytest.raises(ValueError):
+            run_sql_query(statement, posts, comments)
+    with pytest.raises(ValueError, match="did not finish"):
+        get_sql_database(posts, comments).query(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT MAX(i) FROM n", max_seconds=0.2
+        )
+    assert run_sql_query("SELECT COUNT(*) FROM posts", posts, comments)["rows"] == [[3]]
+
+
+def test_tool_cache_keys_on_arguments_and_dataset_version(tmp_path):
+    from RedditReportGenerator.tools.reddit_tools import load_comments
+    from RedditReportGenerator.tools.tool_cache import ToolCache, memoize_tool
+
+    cache, calls = ToolCache(max_bytes=10_000), []
+    dataset = {"key": [RedditRecords(POSTS)]}
+
+    @memoize_tool(lambda: dataset["key"], cache, persistent=None)
+    def tool(user_id: str, posts: list = None, comments: list = None, limit: int = 5):
+        calls.append(user_id)
+        return {"user": user_id, "limit": limit, "comments": len(comments) if comments is not None else 0}
+
+    assert tool("alice") == tool("alice", limit=5) == tool(user_id="alice", posts=None)
+    assert calls == ["alice"] and cache.stats()["hits"] == 2
+    tool("alice", limit=6)
+    dataset["key"][0].version += 1
+    tool("alice")
+    assert calls == ["alice", "alice", "alice"]
+
+    comments_file = str(tmp_path / "comments.jsonl")
+    _write_jsonl(comments_file, COMMENTS[:2])
+    comments = load_comments(comments_file)
+    assert tool("bob", comments=comments)["comments"] == 2
+    _write_jsonl(comments_file, COMMENTS)
+    comments.refresh()
+    assert tool("bob", comments=comments)["comments"] == 4
+    # Plain lists can't be keyed, so they are not cached
+    tool("bob", comments=COMMENTS)
+    tool("bob", comments=COMMENTS)
+    assert calls.count("bob") == 4
+
+    small = ToolCache(max_bytes=120)
+
+    @memoize_tool(lambda: (), small, persistent=None)
+    def echo(text: str):
+        return {"text": text}
+
+    for text in ["a" * 30, "b" * 30, "a" * 30, "c" * 30]:
+        echo(text)
+    stats = small.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (1, 3, 1, 2)
+    assert stats["bytes"] <= 120
+
+
+def test_persistent_tool_cache_follows_dataset_fingerprint(tmp_path):
+    from RedditReportGenerator.tools.reddit_tools import load_comments
+    from RedditReportGenerator.tools.tool_cache import DiskToolCache, ToolCache, memoize_tool
+
+    comments_file = str(tmp_path / "comments.jsonl")
+    _write_jsonl(comments_file, COMMENTS[:2])
+    disk, calls = DiskToolCache(str(tmp_path / "cache" / "tools.sqlite")), []
+
+    def make_tool():
+        # A fresh in-process cache per "run", sharing the database
+        @memoize_tool(lambda: None, ToolCache(), disk)
+        def tool(user_id: str, comments: list = None):
+            calls.append(user_id)
+            return {"user": user_id, "comments": len(comments)}
+
+        return tool
+
+    assert make_tool()("alice", comments=load_comments(comments_file)) == {"user": "alice", "comments": 2}
+    assert make_tool()("alice", comments=load_comments(comments_file)) == {"user": "alice", "comments": 2}
+    assert calls == ["alice"] and disk.stats()["hits"] == 1
+
+    # Appending to the source changes the fingerprint
+    _write_jsonl(comments_file, COMMENTS)
+    assert make_tool()("alice", comments=load_comments(comments_file))["comments"] == 4
+    assert calls == ["alice", "alice"]
+    # In-memory data has no fingerprint, so it is only cached in process
+    make_tool()("alice", comments=RedditRecords(COMMENTS))
+    assert disk.stats()["entries"] == 2
+
+    small = DiskToolCache(str(tmp_path / "small.sqlite"), max_bytes=100)
+    for key in ["a", "b", "c"]:
+        small.put(key, '"%s"' % (key * 40))
+    assert small.get("a") is None and small.get("c") is not None
+    assert small.stats()["bytes"] <= 100
+
+
+def test_data_store_loads_once_across_threads(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from RedditReportGenerator.tools import annotated, data_store
+
+    posts_file, comments_file = str(tmp_path / "posts.jsonl"), str(tmp_path / "comments.jsonl")
+    _write_jsonl(posts_file, POSTS)
+    _write_jsonl(comments_file, COMMENTS)
+    loads = []
+
+    def load_posts(file_path):
+        loads.append(file_path)
+        return data_store.load_posts(file_path)
+
+    monkeypatch.setitem(data_store._LOADERS, "posts", load_posts)
+    store = data_store.DataStore(posts_file=posts_file, comments_file=comments_file)
+    assert store.loaded() is None
+    with ThreadPoolExecutor(8) as pool:
+        resolved = list(pool.map(lambda _: store.posts, range(32)))
+    assert loads == [posts_file] and all(posts is resolved[0] for posts in resolved)
+
+    monkeypatch.setattr(annotated, "_data_store", store)
+    assert annotated.get_user_total_activity_count("alice")["total_posts"] == 2
+    posts, comments = annotated.get_global_data()
+    annotated.set_global_data(posts, comments)
+    assert annotated.get_data_store() is store and loads == [posts_file]
+    annotated.set_global_data(comments=RedditRecords(COMMENTS[:1]))
+    assert annotated.get_data_store() is not store and annotated.get_data_store().posts is posts
+
+
+def test_derived_indexes_are_built_once_across_threads():
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    records = RedditRecords(POSTS)
+    builds, barrier = [], threading.Barrier(8)
+
+    def build():
+        builds.append(threading.get_ident())
+        time.sleep(0.05)
+        return object()
+
+    def lookup(_):
+        barrier.wait()
+        return records.derived("index", build)
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lookup, range(8)))
+    assert len(builds) == 1 and all(result is results[0] for result in results)
+    assert records.search_index() is records.search_index()
+
+
+def test_limited_client_is_the_only_retry_layer():
+    from openai import AsyncOpenAI, OpenAI
+
+    from RedditReportGenerator.common.rate_limit import limited_client
+
+    for client in (OpenAI(api_key="key"), AsyncOpenAI(api_key="key")):
+        assert client.max_retries > 0
+        assert limited_client(client).client.max_retries == 0
+
+
+def test_limited_client_caps_concurrent_completions():
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from types import SimpleNamespace
+
+    from RedditReportGenerator.common.rate_limit import RateLimiter, limited_client
+
+    lock, state = threading.Lock(), {"active": 0, "peak": 0}
+
+    def create(**kwargs):
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        time.sleep(0.01)
+        with lock:
+            state["active"] -= 1
+        return kwargs["model"]
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)), models="models")
+    limited = limited_client(client, RateLimiter(0, 0, max_concurrent=2))
+    assert limited_client(limited) is limited and limited.models == "models"
+    with ThreadPoolExecutor(8) as pool:
+        assert list(pool.map(lambda i: limited.chat.completions.create(model=i), range(16))) == list(range(16))
+    assert state["peak"] == 2
+
+
+def test_rate_limiter_honors_retry_after_and_backs_off():
+    import time
+    from types import SimpleNamespace
+
+    import pytest
+
+    from RedditReportGenerator.common.rate_limit import AIMD_INCREASE, RateLimiter, TokenBucket
+
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60, bucket.updated) == 0.0
+    assert bucket.reserve(1, bucket.updated) == pytest.approx(1.0)
+
+    class RateLimitError(Exception):
+        status_code = 429
+        response = SimpleNamespace(headers={"retry-after-ms": "50"})
+
+    failures = [RateLimitError("slow down"), RateLimitError("slow down")]
+
+    def create(**kwargs):
+        if failures:
+            raise failures.pop()
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=42))
+
+    limiter = RateLimiter(6000, 100000, max_concurrent=2, max_retries=3)
+    started = time.monotonic()
+    assert limiter.call(create, messages=[{"role": "user", "content": "hi"}]).usage.total_tokens == 42
+    assert time.monotonic() - started >= 0.1
+    stats = limiter.stats()
+    assert (stats["completed"], stats["rate_limited"], stats["tokens_used"]) == (1, 2, 42)
+    assert stats["rate_scale"] == pytest.approx(0.25 + AIMD_INCREASE)
+    assert limiter.requests.rate == pytest.approx(6000 * stats["rate_scale"])
+
+    failures[:] = [RateLimitError("slow down")] * 2
+    with pytest.raises(RateLimitError):
+        RateLimiter(0, 0, max_retries=1).call(create, messages=[])
+
+
+def test_roles_give_up_once_the_limiter_has(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+
+    import pytest
+
+    from RedditReportGenerator.roles.meta_controller import MetaController
+    from RedditReportGenerator.roles.question_solver import QuestionSolverAnalyst
+
+    class RateLimitError(Exception):
+        status_code = 429
+
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        raise RateLimitError("slow down")
+
+    monkeypatch.chdir(tmp_path)
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    solver = QuestionSolverAnalyst(
+        "model", client, "u1", "", "activity", [], model_info=SimpleNamespace(to_dict=dict)
+    )
+    monkeypatch.setattr(solver, "cut_history", lambda history: history)
+    with pytest.raises(RateLimitError):
+        solver.analyze([], "question", "prompt")
+    with pytest.raises(RateLimitError):
+        MetaController("model", client, "u1").build_meta_plan([])
+    assert len(calls) == 2
+
+
+def test_workflow_runs_perspectives_concurrently(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+    import time
+    from types import SimpleNamespace
+
+    import RedditReportGenerator.__main__ as main
+    from RedditReportGenerator.common.rate_limit import metered
+    from RedditReportGenerator.common.steps import Blocking, Completion
+    from RedditReportGenerator.tools import annotated
+
+    lock, state = threading.Lock(), {"active": 0, "peak": 0}
+
+    def research(seconds):
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        time.sleep(seconds)
+        with lock:
+            state["active"] -= 1
+
+    class Meta:
+        def __init__(self, model, client, user_or_community_id):
+            pass
+
+        def meta_plan_steps(self, tools):
+            yield Completion(messages=[])
+            names = [f"p{i}" for i in range(5)]
+            return SimpleNamespace(
+                perspectives=[SimpleNamespace(name=name, prompt="", tips=[], tool_suggestions=[]) for name in names]
+            )
+
+    class Expert:
+        def __init__(self, model, client, user_or_community_id, perspective, tips):
+            self.perspective = perspective
+
+        def breakdown_steps(self, user_or_community_id):
+            yield Completion(messages=[])
+            return SimpleNamespace(items=[SimpleNamespace(question="q", prompt="p")])
+
+        def analysis_steps(self, analysis_categories, chat_histories):
+            yield Completion(messages=[])
+            return self.perspective + ": " + chat_histories
+
+    class Solver:
+        def __init__(self, model, client, main_perspective, model_info, **kwargs):
+            self.perspective = main_perspective
+
+        def analysis_steps(self, chat_histories, question, prompt):
+            # Later perspectives finish first
+            yield Blocking(research, 0.05 * (5 - int(self.perspective[1:])))
+            yield Completion(messages=[])
+            return "researched"
+
+    class Checker:
+        def __init__(self, *args):
+            pass
+
+        def check_steps(self, user_or_community_id, analysis_categories, reports):
+            return (yield Completion(messages=[]))
+
+    class Scorer(Checker):
+        def score_steps(self, user_or_community_id, reports, check_report, analysis_categories):
+            yield Completion(messages=[])
+            return list(reports.values())
+
+    def create(**kwargs):
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=10))
+
+    def retrieve(model):
+        return SimpleNamespace(to_dict=dict)
+
+    async def create_async(**kwargs):
+        return create(**kwargs)
+
+    async def retrieve_async(model):
+        return retrieve(model)
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(annotated, "_data_store", annotated._data_store)
+    monkeypatch.setattr(main, "EXPERT_CONCURRENCY", 2)
+    for name, role in [
+        ("MetaController", Meta), ("DomainExpertAnalyst", Expert), ("QuestionSolverAnalyst", Solver),
+        ("StatelessChecker", Checker), ("StatelessScorer", Scorer),
+    ]:
+        monkeypatch.setattr(main, name, role)
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create)),
+        models=SimpleNamespace(retrieve=retrieve),
+    )
+    monkeypatch.setattr(main, "client", client)
+    async_client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create_async)),
+        models=SimpleNamespace(retrieve=retrieve_async),
+    )
+    reports = [f"p{i}: researched" for i in range(5)]
+
+    with metered() as meter:
+        assert main.workflow("u1", {}, RedditRecords([]), RedditRecords([]))["final_report"] == reports
+    # One request of the meta controller, the checker and the scorer, three per perspective
+    assert (meter.requests, meter.tokens, state["peak"]) == (18, 180, 2)
+
+    state["peak"] = 0
+    with metered() as meter:
+        result = asyncio.run(
+            main.async_workflow("u1", {}, RedditRecords([]), RedditRecords([]), expert_concurrency=3, async_client=async_client)
+        )
+    assert result["final_report"] == reports
+    assert (meter.requests, state["peak"]) == (18, 3)
+
+
+def test_async_completions_and_task_cancellation():
+    import asyncio
+    from types import SimpleNamespace
+
+    import pytest
+
+    from RedditReportGenerator.common.rate_limit import RateLimiter, limited_client
+    from RedditReportGenerator.common.utils import run_tasks
+
+    active, peak = 0, 0
+
+    async def create(**kwargs):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=5))
+
+    limiter = RateLimiter(0, 0, max_concurrent=2)
+    client = limited_client(SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))), limiter)
+
+    async def complete():
+        return await client.chat.completions.create(messages=[])
+
+    results = asyncio.run(run_tasks([complete] * 6, limit=4))
+    assert [result.usage.total_tokens for result in results] == [5] * 6
+    assert peak == 2 and limiter.stats()["tokens_used"] == 30
+
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_tasks([slow, fail, slow]))
+    assert cancelled == [True, True]
+
+
+def test_requests_in_flight_are_capped_across_threads_and_event_loops():
+    import asyncio
+    import threading
+    import time
+    from types import SimpleNamespace
+
+    from RedditReportGenerator.common.rate_limit import RateLimiter, limited_client
+
+    lock, state = threading.Lock(), {"active": 0, "peak": 0}
+
+    def enter():
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+
+    def leave():
+        with lock:
+            state["active"] -= 1
+
+    def create(**kwargs):
+        enter()
+        time.sleep(0.01)
+        leave()
+
+    async def create_async(**kwargs):
+        enter()
+        await asyncio.sleep(0.01)
+        leave()
+
+    limiter = RateLimiter(0, 0, max_concurrent=3)
+    sync_client = limited_client(SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))), limiter)
+    async_client = limited_client(
+        SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create_async))), limiter
+    )
+
+    def complete():
+        for _ in range(5):
+            sync_client.chat.completions.create(messages=[])
+
+    async def complete_many():
+        await asyncio.gather(*(async_client.chat.completions.create(messages=[]) for _ in range(8)))
+
+    # Two threads calling the sync client, two others each running an event loop
+    threads = [threading.Thread(target=complete) for _ in range(2)]
+    threads += [threading.Thread(target=asyncio.run, args=(complete_many(),)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert state["peak"] == 3 and limiter.stats()["completed"] == 26
+    assert limiter.slots.in_flight == 0
+
+    async def cancel_waiter():
+        async with limiter.slots:
+            async with limiter.slots:
+                async with limiter.slots:
+                    waiting = asyncio.ensure_future(limiter.slots.acquire_async())
+                    await asyncio.sleep(0)
+                    waiting.cancel()
+                    await asyncio.gather(waiting, return_exceptions=True)
+        return len(limiter.slots.waiters), limiter.slots.in_flight
+
+    assert asyncio.run(cancel_waiter()) == (0, 0)
+
+
+def test_role_steps_run_alike_on_sync_and_async_clients(tmp_path, monkeypatch):
+    import asyncio
+    import json
+    from types import SimpleNamespace
+
+    from RedditReportGenerator.common import steps
+    from RedditReportGenerator.roles.meta_controller import MetaController
+    from RedditReportGenerator.roles.question_solver import QuestionSolverAnalyst
+
+    plan = {"perspectives": [{"name": "p", "description": "d", "prompt": "p", "tool_suggestions": [], "tips": []}]}
+    tool_call = SimpleNamespace(id="c1", function=SimpleNamespace(name="karma", arguments='{"user_id": "u1"}'))
+
+    def reply(request):
+        if "tools" not in request:
+            # The first meta plan doesn't parse, so it is requested again
+            content = "not json" if len(requests) == 1 else json.dumps(plan)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+        if request["messages"][-1]["role"] != "tool":
+            message = SimpleNamespace(content=None, tool_calls=[tool_call], to_dict=lambda: {"role": "assistant"})
+        else:
+            message = SimpleNamespace(content=request["messages"][-1]["content"] + " END", tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def create(**request):
+        requests.append(request)
+        return reply(request)
+
+    async def create_async(**request):
+        return create(**request)
+
+    def karma(user_id):
+        return {"user_id": user_id, "karma": 7}
+
+    def analyze(client, run):
+        solver = QuestionSolverAnalyst("model", client, "u1", "", "activity", [karma], model_info=SimpleNamespace(to_dict=dict))
+        solver.cut_history = lambda history: history
+        return (
+            run(MetaController("model", client, "u1").meta_plan_steps([])),
+            run(solver.analysis_steps([], "question", "prompt")),
+        )
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(steps, "retry_delay", lambda attempt: 0)
+    requests = []
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    results = analyze(client, lambda exchange: steps.run_steps(exchange, client))
+    sync_requests, requests = requests, []
+    async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create_async)))
+    async_results = analyze(async_client, lambda exchange: asyncio.run(steps.run_steps_async(exchange, async_client)))
+
+    assert results == async_results and requests == sync_requests and len(requests) == 4
+    assert results[0].perspectives[0].name == "p"
+    assert results[1][1]["content"] == '{"user_id": "u1", "karma": 7}'
+
+
+def test_batch_runs_users_concurrently_within_budget(tmp_path, monkeypatch):
+    import threading
+    import time
+
+    from RedditReportGenerator.common.batch import run_batch
+    from RedditReportGenerator.common.rate_limit import RateLimiter
+
+    monkeypatch.chdir(tmp_path)
+    limiter = RateLimiter(0, 0)
+    lock = threading.Lock()
+    active, peak, analyzed = 0, 0, []
+
+    def analyze(user):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+            analyzed.append(user)
+        time.sleep(0.02)
+        with lock:
+            active -= 1
+        if user == "broken":
+            raise RuntimeError("no report")
+        limiter.succeeded(0, 10)
+
+    users = ["a", "b", "done", "broken", "c", "a", "d"]
+    summary = run_batch(users, analyze, concurrency=3, limiter=limiter, is_done=lambda user: user == "done")
+    assert sorted(analyzed) == ["a", "b", "broken", "c", "d"] and peak == 3
+    assert (summary["total"], summary["completed"], summary["failed"], summary["skipped"]) == (6, 4, 1, 1)
+    assert summary["tokens_used"] == 40 and summary["remaining"] == 0 and summary["users_per_hour"] > 0
+
+    analyzed.clear()
+    summary = run_batch(["a", "b", "c", "d"], analyze, concurrency=1, token_budget=20, limiter=limiter)
+    assert analyzed == ["a", "b"]
+    assert (summary["completed"], summary["deferred"], summary["tokens_used"]) == (2, 2, 20)
+
+
+def test_async_batch_runs_users_on_one_loop(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+
+    from RedditReportGenerator.common.batch import CostModel, run_batch_async
+    from RedditReportGenerator.common.rate_limit import RateLimiter
+
+    monkeypatch.chdir(tmp_path)
+    limiter = RateLimiter(0, 0)
+    active, peak, analyzed, threads = 0, 0, [], set()
+
+    async def analyze(user):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        analyzed.append(user)
+        threads.add(threading.get_ident())
+        await asyncio.sleep(0.02)
+        active -= 1
+        if user == "broken":
+            raise RuntimeError("no report")
+        limiter.succeeded(0, 10)
+
+    users = ["a", "b", "done", "broken", "c", "a", "d"]
+    summary = asyncio.run(
+        run_batch_async(users, analyze, concurrency=3, limiter=limiter, is_done=lambda user: user == "done")
+    )
+    assert sorted(analyzed) == ["a", "b", "broken", "c", "d"] and peak == 3 and len(threads) == 1
+    assert (summary["total"], summary["completed"], summary["failed"], summary["skipped"]) == (6, 4, 1, 1)
+    assert summary["tokens_used"] == 40 and summary["remaining"] == 0
+
+    # Predicted 15 tokens each, "b" only fits in the budget of 25 once "a" has used its 10
+    costs = CostModel({"a": 1, "b": 1, "c": 1, "x": 1}.get, path="")
+    costs.record("x", 15, 1.0)
+    analyzed.clear()
+    peak = 0
+    summary = asyncio.run(
+        run_batch_async(["a", "b", "c"], analyze, concurrency=2, token_budget=25, limiter=limiter, costs=costs)
+    )
+    assert analyzed == ["a", "b"] and peak == 1
+    assert (summary["completed"], summary["deferred"], summary["tokens_used"]) == (2, 1, 20)
+
+
+def test_batch_schedules_and_packs_by_predicted_cost(tmp_path, monkeypatch):
+    import json
+    from types import SimpleNamespace
+
+    import pytest
+
+    from RedditReportGenerator.common.batch import CostModel, run_batch, schedule
+    from RedditReportGenerator.common.rate_limit import RateLimiter, limited_client
+
+    monkeypatch.chdir(tmp_path)
+    activity = {"light": 1, "medium": 10, "heavy": 100, "new": 50}
+    costs = CostModel(activity.get, path="history.json")
+    assert not costs.calibrated and costs.estimate("heavy") is None
+    assert schedule(["light", "heavy", "medium"], costs) == ["heavy", "medium", "light"]
+    assert schedule(["light", "heavy", "medium"], costs, "shortest") == ["light", "medium", "heavy"]
+    assert schedule(["light", "heavy", "light"], costs, "config") == ["light", "heavy"]
+
+    # Each analysis uses 1000 tokens plus 100 per activity, through a metered client
+    class Completions:
+        def create(self, **kwargs):
+            return SimpleNamespace(usage=SimpleNamespace(total_tokens=kwargs["tokens"]))
+
+    limiter = RateLimiter(0, 0)
+    client = limited_client(SimpleNamespace(chat=SimpleNamespace(completions=Completions())), limiter)
+    started = []
+
+    def analyze(user):
+        started.append(user)
+        client.chat.completions.create(messages=[], tokens=500)
+        client.chat.completions.create(messages=[], tokens=500 + 100 * activity[user])
+
+    run_batch(["light", "medium"], analyze, concurrency=1, limiter=limiter, costs=costs)
+    assert costs.calibrated and costs.estimate("new") == pytest.approx(6000)
+    assert json.load(open("history.json"))["medium"]["tokens"] == 2000
+
+    # A reloaded model predicts from the history; packing starts what fits in the budget
+    costs = CostModel(activity.get, path="history.json")
+    started.clear()
+    summary = run_batch(
+        ["light", "heavy", "medium", "new"], analyze, concurrency=1, token_budget=9100,
+        limiter=limiter, costs=costs, order="longest",
+    )
+    assert started == ["new", "medium", "light"]
+    assert (summary["completed"], summary["deferred"], summary["tokens_used"]) == (3, 1, 9100)
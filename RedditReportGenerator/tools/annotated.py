@@ -1,3 +1,5 @@
+import threading
+
 from RedditReportGenerator.tools.reddit_tools import (
     load_posts,
     load_comments,
@@ -8,33 +10,92 @@ from RedditReportGenerator.tools.reddit_tools import (
     get_top_posts,
     get_top_comments,
     extract_keywords,
+    get_keyword_idf,
     get_user_keywords,
     analyze_post_sentiment,
     get_user_sentiment,
     get_post_comment_ratio,
     get_community_activity_stats,
+    get_community_sentiment,
     get_top_authors,
-    get_post_frequency_stats
+    get_post_frequency_stats,
+    get_user_timeline,
+    get_community_timeline,
+    get_user_interlocutors,
+    get_user_reply_stats,
+    get_influence_scores,
+    get_user_influence,
+    get_influential_authors,
+    get_comment_context,
+    get_user_comment_contexts,
+    get_thread_engagement,
+    search_content,
+    run_sql_query,
+    window_records
 )
+from RedditReportGenerator.tools.data_store import DataStore
+from RedditReportGenerator.tools.tool_cache import memoize_tool
+
+# Dataset the tools read when they are not given posts and comments. Replaced
+# as a whole (never mutated) so concurrent tool calls see a consistent pair
+_data_store = DataStore()
+_data_store_lock = threading.Lock()
+
+
+def _global_dataset():
+    """Get the global data tools read, to key the tool cache on (None while it is not loaded)"""
+    return _data_store.loaded()
+
+
+def get_data_store() -> DataStore:
+    """Get the dataset shared by the tools"""
+    return _data_store
 
-# Global storage for posts and comments data
-# This allows tool functions to access data without passing them as parameters
-_global_posts = None
-_global_comments = None
+
+def set_data_store(store: DataStore):
+    """Make tools read another dataset"""
+    global _data_store
+    with _data_store_lock:
+        _data_store = store
 
 
 def set_global_data(posts=None, comments=None):
-    """Set global posts and comments data for tool access"""
-    global _global_posts, _global_comments
-    if posts is not None:
-        _global_posts = posts
-    if comments is not None:
-        _global_comments = comments
+    """Set global posts and comments data for tool access
+
+    The data is wrapped with an author index (once) so every user tool
+    resolves a user's records without scanning the whole dataset. Setting
+    the data the tools already read keeps the current store (and the
+    results cached for it).
+    """
+    global _data_store
+    with _data_store_lock:
+        _data_store = _data_store.replace(posts, comments)
 
 
 def get_global_data():
-    """Get global posts and comments data"""
-    return _global_posts, _global_comments
+    """Get global posts and comments data, loading them on first use"""
+    store = _data_store
+    return store.posts, store.comments
+
+
+def update_global_influence():
+    """Bring the reply graph and influence scores of the global data up to date
+
+    Meant to run in the background after loading or refreshing, so the
+    influence tools answer with a lookup.
+    """
+    data = _data_store.loaded()
+    if data is not None:
+        get_influence_scores(*data)
+
+
+def refresh_global_data():
+    """Ingest records appended to the source files of the global data
+
+    Returns:
+        Number of new posts and comments
+    """
+    return _data_store.refresh()
 
 
 # Post loading and manipulation functions
@@ -65,135 +126,167 @@ def load_reddit_comments(file_path: str = "r_OpenAI_comments.jsonl"):
 
 
 # User activity functions
-def get_user_post_activity(user_id: str, posts: list = None):
+@memoize_tool(_global_dataset)
+def get_user_post_activity(user_id: str, posts: list = None, since: str = None, until: str = None):
     """Get all posts by a specific user
 
     Args:
         user_id: Reddit user ID
         posts: List of all posts (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         List of posts by user
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
+        posts = _data_store.posts
+    posts = window_records(posts, since, until)
     return get_user_posts(user_id, posts)
 
 
-def get_user_comment_activity(user_id: str, comments: list = None):
+@memoize_tool(_global_dataset)
+def get_user_comment_activity(user_id: str, comments: list = None, since: str = None, until: str = None):
     """Get all comments by a specific user
 
     Args:
         user_id: Reddit user ID
         comments: List of all comments (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         List of comments by user
     """
     if comments is None:
-        comments = _global_comments
-    if comments is None:
-        comments = load_comments()
+        comments = _data_store.comments
+    comments = window_records(comments, since, until)
     return get_user_comments(user_id, comments)
 
 
-def get_user_total_activity_count(user_id: str, posts: list = None, comments: list = None):
+@memoize_tool(_global_dataset)
+def get_user_total_activity_count(
+    user_id: str, posts: list = None, comments: list = None, since: str = None, until: str = None
+):
     """Get total activity count (posts and comments) for a user
 
     Args:
         user_id: Reddit user ID
         posts: List of all posts (optional, uses global if not provided)
         comments: List of all comments (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         Dictionary with total posts, comments, and activity count
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
+        posts = _data_store.posts
     if comments is None:
-        comments = _global_comments
-    if comments is None:
-        comments = load_comments()
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
     return get_user_activity_count(user_id, posts, comments)
 
 
-def get_user_total_karma(user_id: str, posts: list = None, comments: list = None):
+@memoize_tool(_global_dataset)
+def get_user_total_karma(
+    user_id: str, posts: list = None, comments: list = None, since: str = None, until: str = None
+):
     """Get total karma for a user from posts and comments
 
     Args:
         user_id: Reddit user ID
         posts: List of all posts (optional, uses global if not provided)
         comments: List of all comments (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         Dictionary with post karma, comment karma, and total karma
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
-    if comments is None:
-        comments = _global_comments
+        posts = _data_store.posts
     if comments is None:
-        comments = load_comments()
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
     return get_user_karma(user_id, posts, comments)
 
 
-def get_user_top_posts(user_id: str, posts: list = None, limit: int = 5):
+@memoize_tool(_global_dataset)
+def get_user_top_posts(
+    user_id: str, posts: list = None, limit: int = 5, since: str = None, until: str = None
+):
     """Get top posts by a user based on karma score
 
     Args:
         user_id: Reddit user ID
         posts: List of all posts (optional, uses global if not provided)
         limit: Number of top posts to return (default: 5)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         List of top posts by karma
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
+        posts = _data_store.posts
+    posts = window_records(posts, since, until)
     return get_top_posts(user_id, posts, limit)
 
 
-def get_user_top_comments(user_id: str, comments: list = None, limit: int = 5):
+@memoize_tool(_global_dataset)
+def get_user_top_comments(
+    user_id: str, comments: list = None, limit: int = 5, since: str = None, until: str = None
+):
     """Get top comments by a user based on karma score
 
     Args:
         user_id: Reddit user ID
         comments: List of all comments (optional, uses global if not provided)
         limit: Number of top comments to return (default: 5)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         List of top comments by karma
     """
     if comments is None:
-        comments = _global_comments
-    if comments is None:
-        comments = load_comments()
+        comments = _data_store.comments
+    comments = window_records(comments, since, until)
     return get_top_comments(user_id, comments, limit)
 
 
 # Content and sentiment analysis
-def extract_text_keywords(text: str, top_n: int = 10):
+@memoize_tool(_global_dataset)
+def extract_text_keywords(text: str, top_n: int = 10, tfidf: bool = False):
     """Extract top keywords from text using frequency analysis
 
     Args:
         text: Text to analyze
         top_n: Number of top keywords to return (default: 10)
+        tfidf: Weight keywords by how rare they are in the community (default: False)
 
     Returns:
         List of top keywords
     """
-    return extract_keywords(text, top_n)
-
-
-def get_user_activity_keywords(user_id: str, posts: list = None, comments: list = None, top_n: int = 10):
+    if not tfidf:
+        return extract_keywords(text, top_n)
+    posts, comments = _data_store.posts, _data_store.comments
+    return extract_keywords(text, top_n, get_keyword_idf(posts, comments))
+
+
+@memoize_tool(_global_dataset)
+def get_user_activity_keywords(
+    user_id: str,
+    posts: list = None,
+    comments: list = None,
+    top_n: int = 10,
+    tfidf: bool = False,
+    since: str = None,
+    until: str = None,
+):
     """Get top keywords from a user's posts and comments
 
     Args:
@@ -201,21 +294,23 @@ def get_user_activity_keywords(user_id: str, posts: list = None, comments: list
         posts: List of all posts (optional, uses global if not provided)
         comments: List of all comments (optional, uses global if not provided)
         top_n: Number of top keywords to return (default: 10)
+        tfidf: Weight keywords by how rare they are in the community (default: False)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         List of top keywords from user's activity
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
-    if comments is None:
-        comments = _global_comments
+        posts = _data_store.posts
     if comments is None:
-        comments = load_comments()
-    return get_user_keywords(user_id, posts, comments, top_n)
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
+    return get_user_keywords(user_id, posts, comments, top_n, tfidf)
 
 
+@memoize_tool(_global_dataset)
 def analyze_text_sentiment(text: str):
     """Analyze sentiment of text (returns value between -1 and 1)
 
@@ -228,106 +323,459 @@ def analyze_text_sentiment(text: str):
     return analyze_post_sentiment(text)
 
 
-def get_user_activity_sentiment(user_id: str, posts: list = None, comments: list = None):
+@memoize_tool(_global_dataset)
+def get_user_activity_sentiment(
+    user_id: str, posts: list = None, comments: list = None, since: str = None, until: str = None
+):
     """Get sentiment analysis of a user's posts and comments
 
     Args:
         user_id: Reddit user ID
         posts: List of all posts (optional, uses global if not provided)
         comments: List of all comments (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         Dictionary with average post sentiment, average comment sentiment, and overall sentiment
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
-    if comments is None:
-        comments = _global_comments
+        posts = _data_store.posts
     if comments is None:
-        comments = load_comments()
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
     return get_user_sentiment(user_id, posts, comments)
 
 
 # Activity ratio functions
-def get_user_post_comment_ratio(user_id: str, posts: list = None, comments: list = None):
+@memoize_tool(_global_dataset)
+def get_user_post_comment_ratio(
+    user_id: str, posts: list = None, comments: list = None, since: str = None, until: str = None
+):
     """Get ratio of posts to comments for a user
 
     Args:
         user_id: Reddit user ID
         posts: List of all posts (optional, uses global if not provided)
         comments: List of all comments (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         Ratio of posts to comments
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
+        posts = _data_store.posts
     if comments is None:
-        comments = _global_comments
-    if comments is None:
-        comments = load_comments()
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
     return get_post_comment_ratio(user_id, posts, comments)
 
 
 # Community analysis functions
-def get_community_overall_stats(posts: list = None, comments: list = None):
+@memoize_tool(_global_dataset)
+def get_community_overall_stats(
+    posts: list = None, comments: list = None, since: str = None, until: str = None
+):
     """Get overall community activity statistics
 
     Args:
         posts: List of all posts (optional, uses global if not provided)
         comments: List of all comments (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         Dictionary with total posts, comments, authors, and average comments per post
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
-    if comments is None:
-        comments = _global_comments
+        posts = _data_store.posts
     if comments is None:
-        comments = load_comments()
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
     return get_community_activity_stats(posts, comments)
 
 
-def get_community_top_authors(posts: list = None, comments: list = None, limit: int = 10):
+@memoize_tool(_global_dataset)
+def get_community_overall_sentiment(
+    posts: list = None, comments: list = None, since: str = None, until: str = None
+):
+    """Get average sentiment of all posts and comments in the community
+
+    Args:
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        Dictionary with average post sentiment, average comment sentiment, and overall sentiment
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
+    return get_community_sentiment(posts, comments)
+
+
+@memoize_tool(_global_dataset)
+def get_community_top_authors(
+    posts: list = None, comments: list = None, limit: int = 10, since: str = None, until: str = None
+):
     """Get top authors in community by activity count
 
     Args:
         posts: List of all posts (optional, uses global if not provided)
         comments: List of all comments (optional, uses global if not provided)
         limit: Number of top authors to return (default: 10)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
         List of top authors with activity counts
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
-    if comments is None:
-        comments = _global_comments
+        posts = _data_store.posts
     if comments is None:
-        comments = load_comments()
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
     return get_top_authors(posts, comments, limit)
 
 
-def get_community_post_frequency(posts: list = None):
+@memoize_tool(_global_dataset)
+def get_community_post_frequency(posts: list = None, since: str = None, until: str = None):
     """Get post frequency statistics for community
 
     Args:
         posts: List of all posts (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
 
     Returns:
-        Dictionary with total posts and average posts per day (30-day period)
+        Dictionary with total posts, average posts per day over the period the posts span,
+        first and last post date, active days, and whether activity is increasing or decreasing
     """
     if posts is None:
-        posts = _global_posts
-    if posts is None:
-        posts = load_posts()
+        posts = _data_store.posts
+    posts = window_records(posts, since, until)
     return get_post_frequency_stats(posts)
+
+
+# Time series functions
+@memoize_tool(_global_dataset)
+def get_user_activity_timeline(
+    user_id: str, posts: list = None, comments: list = None, bucket: str = "day", since: str = None, until: str = None
+):
+    """Get how a user's activity is distributed over time
+
+    Args:
+        user_id: Reddit user ID
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        bucket: Histogram bucket size, one of "hour", "day" or "week" (default: "day")
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        Dictionary with activity rate per day, first and last activity, active days and trend,
+        and a histogram of posts and comments per bucket
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
+    return get_user_timeline(user_id, posts, comments, bucket)
+
+
+@memoize_tool(_global_dataset)
+def get_community_activity_timeline(
+    posts: list = None, comments: list = None, bucket: str = "week", since: str = None, until: str = None
+):
+    """Get how community activity is distributed over time
+
+    Args:
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        bucket: Histogram bucket size, one of "hour", "day" or "week" (default: "week")
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        Dictionary with activity rate per day, first and last activity, active days and trend,
+        and a histogram of posts and comments per bucket
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
+    return get_community_timeline(posts, comments, bucket)
+
+
+# Reply network functions
+@memoize_tool(_global_dataset)
+def get_user_top_interlocutors(
+    user_id: str, posts: list = None, comments: list = None, limit: int = 10, since: str = None, until: str = None
+):
+    """Get the users a user exchanged most replies with, in either direction
+
+    Args:
+        user_id: Reddit user ID
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        limit: Number of interlocutors to return (default: 10)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        List of users with the replies sent to and received from each, most replies first
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
+    return get_user_interlocutors(user_id, posts, comments, limit)
+
+
+@memoize_tool(_global_dataset)
+def get_user_reply_network(
+    user_id: str, posts: list = None, comments: list = None, since: str = None, until: str = None
+):
+    """Get a user's position in the reply network: who they reply to and who replies to them
+
+    Args:
+        user_id: Reddit user ID
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        Dictionary with out-degree (users replied to), in-degree (users who replied),
+        replies sent and received, mutual connections and reciprocity (0 to 1)
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
+    return get_user_reply_stats(user_id, posts, comments)
+
+
+@memoize_tool(_global_dataset)
+def get_user_influence_score(
+    user_id: str, posts: list = None, comments: list = None, since: str = None, until: str = None
+):
+    """Get how influential a user is in the community reply network (PageRank)
+
+    Args:
+        user_id: Reddit user ID
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        Dictionary with the user's PageRank, rank (1 = most influential), percentile (0-100)
+        and the number of ranked authors; rank is None if the user is not in the reply network
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
+    return get_user_influence(user_id, posts, comments)
+
+
+@memoize_tool(_global_dataset)
+def get_community_top_influencers(
+    posts: list = None, comments: list = None, limit: int = 10, since: str = None, until: str = None
+):
+    """Get the most influential users in the community reply network (PageRank)
+
+    Args:
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        limit: Number of users to return (default: 10)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        List of users with their PageRank, rank and percentile, most influential first
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
+    return get_influential_authors(posts, comments, limit)
+
+
+# Conversation thread functions
+@memoize_tool(_global_dataset)
+def get_comment_thread_context(comment_id: str, posts: list = None, comments: list = None, reply_limit: int = 5):
+    """Get the conversation a comment sits in: its post, the comments it replies to and its top replies
+
+    Args:
+        comment_id: Reddit comment ID (with or without the t1_ prefix)
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        reply_limit: Number of direct replies to return, highest score first (default: 5)
+
+    Returns:
+        Dictionary with the post, the parent comments from the top-level one down, the comment
+        itself and its top replies; comments include their author, depth and number of replies below them
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    return get_comment_context(comment_id, posts, comments, reply_limit)
+
+
+@memoize_tool(_global_dataset)
+def get_user_comment_threads(
+    user_id: str, posts: list = None, comments: list = None, limit: int = 3, since: str = None, until: str = None
+):
+    """Get the conversations a user's top comments (by karma) sit in
+
+    Args:
+        user_id: Reddit user ID
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        limit: Number of top comments to return the context of (default: 3)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        List of comment contexts, each with the post, parent comments, the comment and its top replies
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    posts = window_records(posts, since, until)
+    comments = window_records(comments, since, until)
+    return get_user_comment_contexts(user_id, posts, comments, limit)
+
+
+@memoize_tool(_global_dataset)
+def get_post_thread_engagement(post_id: str, posts: list = None, comments: list = None):
+    """Get engagement statistics of a post's comment thread
+
+    Args:
+        post_id: Reddit post ID (with or without the t3_ prefix)
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+
+    Returns:
+        Dictionary with the post title, author and score, total and top-level comments, max and average
+        reply depth, distinct participants, replies by the post author, average comment score and the
+        first and last comment times
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    return get_thread_engagement(post_id, posts, comments)
+
+
+# Full-text search functions
+@memoize_tool(_global_dataset)
+def search_user_content(
+    user_id: str,
+    query: str,
+    posts: list = None,
+    comments: list = None,
+    limit: int = 10,
+    since: str = None,
+    until: str = None,
+):
+    """Search what a user wrote about a topic in their posts and comments
+
+    Args:
+        user_id: Reddit user ID
+        query: Words to search for, e.g. "api pricing"; results contain any of them, best matches first
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        limit: Number of results to return (default: 10)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        List of matching posts and comments with type, id, title (posts), score, created time,
+        relevance and a snippet of the text around the match
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    return search_content(query, posts, comments, user_id, since, until, limit)
+
+
+@memoize_tool(_global_dataset)
+def search_community_content(
+    query: str, posts: list = None, comments: list = None, limit: int = 10, since: str = None, until: str = None
+):
+    """Search what the community wrote about a topic in all posts and comments
+
+    Args:
+        query: Words to search for, e.g. "api pricing"; results contain any of them, best matches first
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        limit: Number of results to return (default: 10)
+        since: Only include activity from this date or time on, e.g. "2023-04-01" (optional)
+        until: Only include activity up to this date (inclusive) or time (optional)
+
+    Returns:
+        List of matching posts and comments with type, id, author, title (posts), score, created time,
+        relevance and a snippet of the text around the match
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    return search_content(query, posts, comments, None, since, until, limit)
+
+
+# SQL query functions
+@memoize_tool(_global_dataset)
+def query_dataset_sql(sql: str, posts: list = None, comments: list = None, max_rows: int = 100):
+    """Run a read-only SQLite SELECT query over the dataset, for aggregations no other tool covers
+
+    Tables (created is a unix timestamp, e.g. strftime('%Y-%m', created, 'unixepoch') gives the month;
+    comment parent_id is "t3_<post id>" or "t1_<comment id>"; sentiment is from -1 to 1):
+    posts(id TEXT, author TEXT, subreddit TEXT, score INTEGER, created INTEGER, title TEXT, url TEXT, sentiment REAL)
+    comments(id TEXT, author TEXT, subreddit TEXT, score INTEGER, created INTEGER, parent_id TEXT, link_id TEXT,
+    sentiment REAL)
+
+    Args:
+        sql: A single SELECT statement, e.g. "SELECT strftime('%Y-%m', created, 'unixepoch') AS month,
+            AVG(score) FROM comments WHERE author = 'someone' GROUP BY month"
+        posts: List of all posts (optional, uses global if not provided)
+        comments: List of all comments (optional, uses global if not provided)
+        max_rows: Number of result rows to return at most (default: 100, at most 500)
+
+    Returns:
+        Dictionary with the column names, the result rows and whether more rows were cut off;
+        queries running longer than 10 seconds are stopped
+    """
+    if posts is None:
+        posts = _data_store.posts
+    if comments is None:
+        comments = _data_store.comments
+    return run_sql_query(sql, posts, comments, max_rows)
@@ -0,0 +1,101 @@
+"""
+The posts and comments shared by every tool.
+
+A DataStore holds one dataset. Each of its posts and comments is either
+given up front or loaded from its file the first time a tool needs it,
+exactly once, behind a lock, so tools running on any number of threads
+share one copy and no call can trigger a second load. The stores a
+DataStore resolves never change afterwards (they only grow through
+``refresh``); switching to other data means installing a new DataStore.
+"""
+
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from RedditReportGenerator.tools.reddit_tools import index_records, load_comments, load_posts
+from RedditReportGenerator.tools.reddit_store import ColumnarRecords
+
+POSTS_FILE = "r_OpenAI_posts.jsonl"
+COMMENTS_FILE = "r_OpenAI_comments.jsonl"
+
+_LOADERS = {"posts": load_posts, "comments": load_comments}
+
+
+class DataStore:
+    """Posts and comments loaded lazily, at most once
+
+    Args:
+        posts: Posts to use instead of loading posts_file (optional)
+        comments: Comments to use instead of loading comments_file (optional)
+        posts_file: Posts JSONL file (or its snapshot) loaded on first use
+        comments_file: Comments JSONL file (or its snapshot) loaded on first use
+    """
+
+    def __init__(
+        self,
+        posts=None,
+        comments=None,
+        posts_file: str = POSTS_FILE,
+        comments_file: str = COMMENTS_FILE,
+    ):
+        self._records: Dict[str, Optional[ColumnarRecords]] = {
+            "posts": index_records(posts) if posts is not None else None,
+            "comments": index_records(comments) if comments is not None else None,
+        }
+        self._files = {"posts": posts_file, "comments": comments_file}
+        self._load_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _resolve(self, name: str) -> ColumnarRecords:
+        records = self._records[name]
+        if records is None:
+            with self._load_lock:
+                records = self._records[name]
+                if records is None:
+                    logging.info(f"Loading {name} from {self._files[name]}")
+                    records = self._records[name] = _LOADERS[name](self._files[name])
+        return records
+
+    @property
+    def posts(self) -> ColumnarRecords:
+        return self._resolve("posts")
+
+    @property
+    def comments(self) -> ColumnarRecords:
+        return self._resolve("comments")
+
+    def loaded(self) -> Optional[Tuple[ColumnarRecords, ColumnarRecords]]:
+        """Get the posts and comments if both are resolved, without loading anything"""
+        posts, comments = self._records["posts"], self._records["comments"]
+        return None if posts is None or comments is None else (posts, comments)
+
+    def replace(self, posts=None, comments=None) -> "DataStore":
+        """Get a store with the given data swapped in, sharing the rest
+
+        Returns this store when the given data is what it already holds.
+        """
+        posts = index_records(posts) if posts is not None else None
+        comments = index_records(comments) if comments is not None else None
+        if (posts is None or posts is self._records["posts"]) and (
+            comments is None or comments is self._records["comments"]
+        ):
+            return self
+        return DataStore(
+            posts if posts is not None else self._records["posts"],
+            comments if comments is not None else self._records["comments"],
+            self._files["posts"],
+            self._files["comments"],
+        )
+
+    def refresh(self) -> Dict[str, int]:
+        """Ingest records appended to the source files of the loaded data
+
+        Returns:
+            Number of new posts and comments
+        """
+        with self._refresh_lock:
+            return {
+                name: records.refresh() if records is not None and hasattr(records, "refresh") else 0
+                for name, records in self._records.items()
+            }
@@ -0,0 +1,106 @@
+"""
+Sparse author x term count matrix for the keyword tools.
+
+Built once per dataset version by tokenizing every record, the matrix keeps
+each author's term counts as one CSR row (terms in order of first use) plus
+the number of records each term appears in. A user's top keywords, weighted
+by raw count or by TF-IDF against the community, are then read from one or
+two rows instead of re-tokenizing all of the user's text.
+"""
+
+import math
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+from RedditReportGenerator.tools.reddit_text import keyword_tokens, record_text
+
+
+class TermMatrix:
+    """Per-author term counts of one set of records in CSR form"""
+
+    def __init__(self):
+        self.terms: List[str] = []
+        self.term_ids: Dict[str, int] = {}
+        self.rows: Dict[str, int] = {}
+        self.row_offsets = array("q", [0])
+        self.term_columns = array("l")
+        self.counts = array("l")
+        self.document_frequency = array("l")
+        self.documents = 0
+
+    @classmethod
+    def build(cls, records: Iterable[Dict]) -> "TermMatrix":
+        """Tokenize every record once, grouping term counts by author"""
+        matrix = cls()
+        author_counts: Dict[str, Counter] = {}
+        for record in records:
+            counts = Counter(keyword_tokens(record_text(record)))
+            matrix.documents += 1
+            for term in counts:
+                matrix.document_frequency[matrix._term_id(term)] += 1
+            author = record.get("author")
+            if author and counts:
+                author_counts.setdefault(author, Counter()).update(counts)
+
+        for author, counts in author_counts.items():
+            matrix.rows[author] = len(matrix.row_offsets) - 1
+            for term, count in counts.items():
+                matrix.term_columns.append(matrix.term_ids[term])
+                matrix.counts.append(count)
+            matrix.row_offsets.append(len(matrix.counts))
+        return matrix
+
+    def _term_id(self, term: str) -> int:
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+            self.document_frequency.append(0)
+        return term_id
+
+    def author_terms(self, author: str) -> List[Tuple[str, int]]:
+        """Get an author's (term, count) pairs in order of first use"""
+        row = self.rows.get(author)
+        if row is None:
+            return []
+        start, end = self.row_offsets[row], self.row_offsets[row + 1]
+        return [
+            (self.terms[self.term_columns[i]], self.counts[i]) for i in range(start, end)
+        ]
+
+    def term_documents(self, term: str) -> int:
+        """Get the number of records a term appears in"""
+        term_id = self.term_ids.get(term)
+        return 0 if term_id is None else self.document_frequency[term_id]
+
+
+def community_idf(matrices: Iterable[TermMatrix]):
+    """Get a smoothed inverse document frequency function over several matrices
+
+    Terms no record uses get the highest weight.
+    """
+    matrices = list(matrices)
+    documents = sum(matrix.documents for matrix in matrices)
+
+    def idf(term: str) -> float:
+        frequency = sum(matrix.term_documents(term) for matrix in matrices)
+        return math.log((1 + documents) / (1 + frequency)) + 1
+
+    return idf
+
+
+def top_terms(counts: Counter, top_n: int, idf=None) -> List[str]:
+    """Rank terms by count, or by count x idf; ties keep first-use order"""
+    if idf is None:
+        return [term for term, _ in counts.most_common(top_n)]
+    ranked = sorted(counts.items(), key=lambda item: item[1] * idf(item[0]), reverse=True)
+    return [term for term, _ in ranked[:top_n]]
+
+
+def merge_author_terms(author: str, matrices: Iterable[TermMatrix]) -> Counter:
+    """Sum an author's term counts across matrices"""
+    counts = Counter()
+    for matrix in matrices:
+        counts.update(dict(matrix.author_terms(author)))
+    return counts
@@ -0,0 +1,185 @@
+"""
+Per-author and community-wide aggregates of posts and comments.
+
+Every store keeps, for each author code, the sums the user tools need
+(record count, karma, score moments, sentiment, first/last activity). They are
+accumulated while records are added, so answering a count, karma or sentiment
+question is a lookup instead of a scan over the user's records.
+"""
+
+import math
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from RedditReportGenerator.tools.reddit_text import batch_sentiment, record_text
+
+# Aggregate arrays indexed by author code, with their array type codes
+AGGREGATE_ARRAYS = {
+    "count": "q",
+    "karma": "q",
+    "score_squares": "d",
+    "min_score": "q",
+    "max_score": "q",
+    "sentiment": "d",
+    "first_created": "q",
+    "last_created": "q",
+}
+
+
+class ActivityStats:
+    """Aggregates over one author's posts or comments"""
+
+    __slots__ = tuple(AGGREGATE_ARRAYS)
+
+    def __init__(self, **values):
+        for name in AGGREGATE_ARRAYS:
+            setattr(self, name, values.get(name, 0))
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> "ActivityStats":
+        """Aggregate records that are not held in a store"""
+        records = list(records)
+        aggregates = AuthorAggregates()
+        for record, sentiment in zip(records, batch_sentiment(map(record_text, records))):
+            aggregates.add(0, record.get("score", 0), record.get("created", 0), sentiment)
+        return aggregates.stats(0)
+
+    @property
+    def avg_score(self) -> float:
+        return self.karma / self.count if self.count else 0
+
+    @property
+    def score_stddev(self) -> float:
+        if not self.count:
+            return 0.0
+        return math.sqrt(max(self.score_squares / self.count - self.avg_score ** 2, 0.0))
+
+    @property
+    def avg_sentiment(self) -> float:
+        return self.sentiment / self.count if self.count else 0.0
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in AGGREGATE_ARRAYS}
+
+
+class AuthorAggregates:
+    """Activity aggregates of every author of a store, in arrays indexed by author code
+
+    Args:
+        arrays: Existing arrays by name (see AGGREGATE_ARRAYS), e.g. mapped from a snapshot
+    """
+
+    def __init__(self, arrays: Optional[Dict[str, array]] = None):
+        self.arrays = arrays or {name: array(code) for name, code in AGGREGATE_ARRAYS.items()}
+
+    def __len__(self) -> int:
+        return len(self.arrays["count"])
+
+    def add(self, author_code: int, score, created, sentiment: float):
+        """Add one record to the aggregates of an author"""
+        arrays = self.arrays
+        while len(arrays["count"]) <= author_code:
+            for values in arrays.values():
+                values.append(0)
+
+        score, created = int(score or 0), int(created or 0)
+        if arrays["count"][author_code]:
+            arrays["min_score"][author_code] = min(arrays["min_score"][author_code], score)
+            arrays["max_score"][author_code] = max(arrays["max_score"][author_code], score)
+        else:
+            arrays["min_score"][author_code] = arrays["max_score"][author_code] = score
+        arrays["count"][author_code] += 1
+        arrays["karma"][author_code] += score
+        arrays["score_squares"][author_code] += score * score
+        arrays["sentiment"][author_code] += sentiment
+
+        # Records without a timestamp don't move the activity span
+        if created:
+            first = arrays["first_created"][author_code]
+            arrays["first_created"][author_code] = min(first, created) if first else created
+            arrays["last_created"][author_code] = max(arrays["last_created"][author_code], created)
+
+    def stats(self, author_code: Optional[int]) -> ActivityStats:
+        """Get the aggregates of an author (all zero for unknown authors)"""
+        if author_code is None or author_code >= len(self):
+            return ActivityStats()
+        return ActivityStats(**{name: values[author_code] for name, values in self.arrays.items()})
+
+
+class UserProfile:
+    """Aggregated activity of one user across posts and comments"""
+
+    __slots__ = ("user_id", "posts", "comments")
+
+    def __init__(self, user_id: str, posts: ActivityStats, comments: ActivityStats):
+        self.user_id = user_id
+        self.posts = posts
+        self.comments = comments
+
+    def activity_count(self) -> Dict:
+        return {
+            "total_posts": self.posts.count,
+            "total_comments": self.comments.count,
+            "total_activity": self.posts.count + self.comments.count,
+        }
+
+    def karma(self) -> Dict:
+        return {
+            "post_karma": self.posts.karma,
+            "comment_karma": self.comments.karma,
+            "total_karma": self.posts.karma + self.comments.karma,
+        }
+
+    def sentiment(self) -> Dict:
+        count = self.posts.count + self.comments.count
+        return {
+            "avg_post_sentiment": self.posts.avg_sentiment,
+            "avg_comment_sentiment": self.comments.avg_sentiment,
+            "overall_sentiment": (self.posts.sentiment + self.comments.sentiment) / count if count else 0.0,
+            "post_sentiment_count": self.posts.count,
+            "comment_sentiment_count": self.comments.count,
+        }
+
+    def active_span(self) -> Dict:
+        """Get the first and last activity timestamps (0 when unknown)"""
+        firsts = [stats.first_created for stats in (self.posts, self.comments) if stats.first_created]
+        return {
+            "first_activity": min(firsts) if firsts else 0,
+            "last_activity": max(self.posts.last_created, self.comments.last_created),
+        }
+
+
+class CommunityAggregates:
+    """Community totals and the author activity ranking of one dataset version"""
+
+    __slots__ = ("total_posts", "total_comments", "ranking")
+
+    def __init__(self, total_posts: int, total_comments: int, ranking: List[Tuple[str, int]]):
+        self.total_posts = total_posts
+        self.total_comments = total_comments
+        self.ranking = ranking
+
+    @classmethod
+    def build(
+        cls, total_posts: int, total_comments: int, post_counts: Dict[str, int], comment_counts: Dict[str, int]
+    ) -> "CommunityAggregates":
+        """Rank authors by posts plus comments; ties keep order of first appearance"""
+        counts = Counter(post_counts)
+        counts.update(comment_counts)
+        return cls(total_posts, total_comments, counts.most_common())
+
+    @property
+    def total_authors(self) -> int:
+        return len(self.ranking)
+
+    def activity_stats(self) -> Dict:
+        return {
+            "total_posts": self.total_posts,
+            "total_comments": self.total_comments,
+            "total_authors": self.total_authors,
+            "avg_comments_per_post": self.total_comments / self.total_posts if self.total_posts > 0 else 0.0,
+        }
+
+    def top_authors(self, limit: Optional[int] = 10) -> List[Dict]:
+        return [{"author": author, "activity_count": count} for author, count in self.ranking[:limit]]
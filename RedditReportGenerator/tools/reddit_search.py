@@ -0,0 +1,190 @@
+"""
+Inverted full-text index over the title, selftext and body of records.
+
+The index is a list of segments, each covering a range of rows: its terms
+in sorted order, and for each term the rows containing it (ascending) with
+the number of occurrences. Snapshots store segments as flat files written
+while ingesting, one more per append, so they are memory-mapped like the
+columns; in-memory stores build a single segment on the first search.
+
+Queries are ranked with BM25 and can be restricted to an author's rows and
+a time window. With an author, only the author's rows are looked up in the
+postings (by binary search), so the cost follows the author's activity
+rather than how common the query terms are.
+"""
+
+import math
+import re
+from array import array
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from RedditReportGenerator.tools.reddit_text import record_text
+
+# Rows per segment written while ingesting, which bounds the memory it takes
+SEGMENT_ROWS = 250_000
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Characters of context on each side of the first match in a snippet
+SNIPPET_CONTEXT = 80
+
+_WORD = re.compile(r"\w+")
+
+
+def search_tokens(text: str) -> List[str]:
+    """Split text into lowercase words of two or more characters"""
+    return [word for word in _WORD.findall(text.lower()) if len(word) > 1]
+
+
+class SegmentWriter:
+    """Collects the postings of consecutive rows into one segment"""
+
+    def __init__(self, start: int):
+        self.start = start
+        self.rows = start
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.lengths = array("i")
+
+    def add(self, text: str):
+        """Index the text of the next row"""
+        tokens = search_tokens(text)
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, count in counts.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array("q"), array("i"))
+            postings[0].append(self.rows)
+            postings[1].append(count)
+        self.lengths.append(len(tokens))
+        self.rows += 1
+
+    def segment(self) -> "SearchSegment":
+        """Pack the postings into sorted terms and flat arrays"""
+        terms = sorted(self.postings)
+        offsets, rows, frequencies = array("q", [0]), array("q"), array("i")
+        for term in terms:
+            term_rows, term_frequencies = self.postings[term]
+            rows.extend(term_rows)
+            frequencies.extend(term_frequencies)
+            offsets.append(len(rows))
+        return SearchSegment(terms, offsets, rows, frequencies)
+
+
+class SearchSegment:
+    """Postings of a range of rows
+
+    Args:
+        terms: Sorted terms (any sequence, e.g. read from a mapped blob)
+        offsets: Start of each term's postings, plus the end of the last
+        rows: Row positions of all postings, ascending within each term
+        frequencies: Occurrences of the term in each posting's row
+    """
+
+    def __init__(self, terms: Sequence[str], offsets: Sequence[int], rows: Sequence[int], frequencies: Sequence[int]):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.frequencies = frequencies
+
+    def postings(self, term: str) -> Tuple[Sequence[int], Sequence[int]]:
+        """Get the rows containing a term and the occurrences in each"""
+        position = bisect_left(self.terms, term)
+        if position == len(self.terms) or self.terms[position] != term:
+            return (), ()
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.rows[start:end], self.frequencies[start:end]
+
+
+class SearchIndex:
+    """BM25 search over the segments of one set of records
+
+    Args:
+        segments: Segments covering the rows, in any order
+        lengths: Number of indexed words of every row
+    """
+
+    def __init__(self, segments: List[SearchSegment], lengths: Sequence[int]):
+        self.segments = segments
+        self.lengths = lengths
+        self.average_length = sum(lengths) / len(lengths) if len(lengths) else 0.0
+
+    @classmethod
+    def build(cls, records: Iterable[Dict]) -> "SearchIndex":
+        """Index records held in memory as a single segment"""
+        writer = SegmentWriter(0)
+        for record in records:
+            writer.add(record_text(record))
+        return cls([writer.segment()], writer.lengths)
+
+    def search(
+        self,
+        query: str,
+        rows: Optional[Sequence[int]] = None,
+        accept: Optional[Callable[[int], bool]] = None,
+        limit: int = 10,
+    ) -> List[Tuple[int, float]]:
+        """Rank rows by BM25 relevance to the query
+
+        Args:
+            query: Words to look for; a row matches if it contains any of them
+            rows: Only consider these rows (ascending), e.g. an author's
+            accept: Only keep rows for which this returns True, e.g. a time window
+            limit: Number of results
+
+        Returns:
+            (row, relevance) pairs, most relevant first
+        """
+        terms = list(dict.fromkeys(search_tokens(query)))
+        documents = len(self.lengths)
+        if not terms or not documents:
+            return []
+
+        # BM25 length normalization is base + scale * length
+        lengths, base = self.lengths, K1 * (1 - B)
+        scale = K1 * B / self.average_length if self.average_length else 0.0
+        scores: Dict[int, float] = {}
+        get = scores.get
+        for term in terms:
+            postings = [segment.postings(term) for segment in self.segments]
+            frequency = sum(len(term_rows) for term_rows, _ in postings)
+            if not frequency:
+                continue
+            weight = math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5)) * (K1 + 1)
+            for term_rows, term_frequencies in postings:
+                matches = zip(term_rows, term_frequencies) if rows is None else self._matches(
+                    term_rows, term_frequencies, rows
+                )
+                for row, count in matches:
+                    scores[row] = get(row, 0.0) + weight * count / (count + base + scale * lengths[row])
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        if accept is not None:
+            ranked = (item for item in ranked if accept(item[0]))
+        return [item for _, item in zip(range(limit), ranked)]
+
+    @staticmethod
+    def _matches(term_rows: Sequence[int], term_frequencies: Sequence[int], rows: Sequence[int]):
+        """Yield (row, occurrences) of the postings, restricted to the given rows"""
+        if len(rows) > len(term_rows):
+            wanted = set(rows)
+            yield from ((row, count) for row, count in zip(term_rows, term_frequencies) if row in wanted)
+            return
+        for row in rows:
+            position = bisect_left(term_rows, row)
+            if position < len(term_rows) and term_rows[position] == row:
+                yield row, term_frequencies[position]
+
+
+def snippet(text: str, query: str, context: int = SNIPPET_CONTEXT) -> str:
+    """Cut the text around the first query word it contains"""
+    terms = search_tokens(query)
+    match = re.search(r"\b(?:%s)\b" % "|".join(map(re.escape, terms)), text, re.IGNORECASE) if terms else None
+    if match is None:
+        return text[:2 * context] + ("..." if len(text) > 2 * context else "")
+    start, end = max(match.start() - context, 0), min(match.end() + context, len(text))
+    return ("..." if start else "") + text[start:end] + ("..." if end < len(text) else "")
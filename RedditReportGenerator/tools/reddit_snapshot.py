@@ -0,0 +1,543 @@
+"""
+Columnar, memory-mapped snapshots of the Reddit JSONL datasets.
+
+A snapshot lives in a directory next to its source file (``<file>.snapshot``)
+and stores every field the tools read as a flat binary column:
+
+- numeric columns (``score``, ``created`` in whole seconds) as native int64 arrays,
+  and the per-record ``sentiment`` score (computed while parsing) as float64
+- interned columns (``author``, ``subreddit``) as int32 codes into a string table
+- text columns (``id``, ``parent_id``, ``link_id``, ``title``, ``selftext``, ``body``, ``url``)
+  as one UTF-8 blob plus an int64 offsets array
+- an author index in CSR form (row positions grouped by author code)
+- per-author activity aggregates (``profile.<name>.bin``, indexed by author code)
+- a full-text index (``search.lengths.bin`` plus ``search.<start>.*`` segments,
+  see reddit_search), one segment per ingest of up to SEGMENT_ROWS records
+
+Loading a snapshot only maps these files read-only, so start-up does not
+depend on the dataset size and the pages are shared between processes.
+
+The manifest checkpoints how many bytes of the source were ingested. When
+lines are appended to the source, only those lines are parsed and appended
+to the column files; the manifest is replaced last, so readers never see
+partially written rows.
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import shutil
+import sys
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from RedditReportGenerator.common.utils import (
+    iter_jsonl_file,
+    jsonl_complete_end,
+    jsonl_growth,
+    jsonl_stamp,
+)
+from RedditReportGenerator.tools.reddit_profiles import AGGREGATE_ARRAYS, AuthorAggregates
+from RedditReportGenerator.tools.reddit_search import SEGMENT_ROWS, SearchIndex, SearchSegment, SegmentWriter
+from RedditReportGenerator.tools.reddit_store import DERIVED_FIELDS, ColumnarRecords, InternedColumn
+from RedditReportGenerator.tools.reddit_text import SENTIMENT_FIELD, record_text
+
+SNAPSHOT_VERSION = 6
+MANIFEST_FILE = "manifest.json"
+
+NUMERIC_COLUMNS = {"score": "q", "created": "q", SENTIMENT_FIELD: "d"}
+INTERNED_COLUMNS = ("author", "subreddit")
+TEXT_COLUMNS = ("id", "parent_id", "link_id", "title", "selftext", "body", "url")
+SNAPSHOT_FIELDS = list(NUMERIC_COLUMNS) + list(INTERNED_COLUMNS) + list(TEXT_COLUMNS)
+
+# Lone surrogates are valid in JSON strings but not in strict UTF-8
+TEXT_ERRORS = "surrogatepass"
+
+
+def snapshot_path(file_path: str) -> str:
+    """Get the snapshot directory for a JSONL source file"""
+    return file_path + ".snapshot"
+
+
+@contextmanager
+def _snapshot_lock(file_path: str):
+    """Serialize snapshot writers, including those in other processes"""
+    with open(snapshot_path(file_path) + ".lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_manifest(directory: str) -> Optional[Dict]:
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _replace_file(path: str, data: bytes):
+    """Write a file next to path and rename it into place"""
+    staging = path + ".tmp"
+    with open(staging, "wb") as f:
+        f.write(data)
+    os.replace(staging, path)
+
+
+def _as_text(value) -> str:
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+def _author_csr(codes: array, authors: int):
+    """Group row positions by author code (counting sort)"""
+    counts = array("q", bytes(8 * (authors + 1)))
+    for author_code in codes:
+        counts[author_code + 1] += 1
+    for position in range(1, len(counts)):
+        counts[position] += counts[position - 1]
+
+    cursor = array("q", counts)
+    rows = array("q", bytes(8 * len(codes)))
+    for row, author_code in enumerate(codes):
+        rows[cursor[author_code]] = row
+        cursor[author_code] += 1
+    return counts, rows
+
+
+class _SnapshotBuilder:
+    """Appends records column by column to the files of a snapshot directory
+
+    Without a manifest the directory is filled from scratch; with one, the
+    builder resumes after the rows the manifest records, dropping anything an
+    interrupted append left past them.
+    """
+
+    def __init__(self, directory: str, manifest: Optional[Dict] = None):
+        self.directory = directory
+        self.rows = manifest["rows"] if manifest else 0
+        self.numeric = {name: array(code) for name, code in NUMERIC_COLUMNS.items()}
+        self.codes = {name: array("i") for name in INTERNED_COLUMNS}
+        self.offsets = {name: array("q") for name in TEXT_COLUMNS}
+        self.text_ends = {name: 0 for name in TEXT_COLUMNS}
+        self.search_segments = list(manifest.get("search_segments", [])) if manifest else []
+
+        if manifest:
+            self.tables = {name: self._read_table(name) for name in INTERNED_COLUMNS}
+            self.aggregates = AuthorAggregates(
+                {name: self._read_array(f"profile.{name}.bin", code) for name, code in AGGREGATE_ARRAYS.items()}
+            )
+            for name, code in NUMERIC_COLUMNS.items():
+                self._truncate(f"{name}.bin", self.rows * array(code).itemsize)
+            for name in INTERNED_COLUMNS:
+                self._truncate(f"{name}.bin", self.rows * 4)
+            for name in TEXT_COLUMNS:
+                self._truncate(f"{name}.offsets", (self.rows + 1) * 8)
+                self.text_ends[name] = self._read_offset(name, self.rows)
+                self._truncate(f"{name}.blob", self.text_ends[name])
+            self._truncate("search.lengths.bin", self.rows * 4)
+        else:
+            # Code 0 is reserved for records without a value
+            self.tables = {name: {"": 0} for name in INTERNED_COLUMNS}
+            self.aggregates = AuthorAggregates()
+            for name in TEXT_COLUMNS:
+                self.offsets[name].append(0)
+            open(self._path("search.lengths.bin"), "ab").close()
+
+        self.blobs = {name: open(self._path(f"{name}.blob"), "ab") for name in TEXT_COLUMNS}
+        self.search = SegmentWriter(self.rows)
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    def _truncate(self, file_name: str, size: int):
+        if os.path.getsize(self._path(file_name)) > size:
+            os.truncate(self._path(file_name), size)
+
+    def _read_offset(self, name: str, position: int) -> int:
+        with open(self._path(f"{name}.offsets"), "rb") as f:
+            f.seek(position * 8)
+            return array("q", f.read(8))[0]
+
+    def _read_array(self, file_name: str, code: str) -> array:
+        values = array(code)
+        with open(self._path(file_name), "rb") as f:
+            values.frombytes(f.read())
+        return values
+
+    def _read_table(self, name: str) -> Dict[str, int]:
+        offsets = array("q")
+        with open(self._path(f"{name}.table.offsets"), "rb") as f:
+            offsets.frombytes(f.read())
+        with open(self._path(f"{name}.table.blob"), "rb") as f:
+            blob = f.read()
+        return {
+            blob[offsets[code]:offsets[code + 1]].decode("utf-8", TEXT_ERRORS): code
+            for code in range(len(offsets) - 1)
+        }
+
+    def add(self, record: Dict):
+        for name, code in NUMERIC_COLUMNS.items():
+            value = record.get(name) or 0
+            self.numeric[name].append(int(value) if code == "q" else float(value))
+
+        for name in INTERNED_COLUMNS:
+            table = self.tables[name]
+            value = _as_text(record.get(name))
+            value_code = table.get(value)
+            if value_code is None:
+                value_code = table[value] = len(table)
+            self.codes[name].append(value_code)
+
+        author_code = self.codes["author"][-1]
+        if author_code:
+            self.aggregates.add(author_code, record.get("score"), record.get("created"), record[SENTIMENT_FIELD])
+
+        for name in TEXT_COLUMNS:
+            data = _as_text(record.get(name)).encode("utf-8", TEXT_ERRORS)
+            self.blobs[name].write(data)
+            self.text_ends[name] += len(data)
+            self.offsets[name].append(self.text_ends[name])
+
+        self.search.add(record_text(record))
+        self.rows += 1
+        if self.rows - self.search.start >= SEGMENT_ROWS:
+            self._write_search_segment()
+
+    def _write_search_segment(self):
+        """Write the postings collected so far as a segment and start a new one"""
+        writer = self.search
+        if writer.rows > writer.start:
+            segment = writer.segment()
+            prefix = f"search.{writer.start}"
+            terms = BlobTextColumn.pack(segment.terms)
+            _replace_file(self._path(f"{prefix}.terms.blob"), terms[0])
+            _replace_file(self._path(f"{prefix}.terms.offsets"), terms[1].tobytes())
+            _replace_file(self._path(f"{prefix}.offsets"), segment.offsets.tobytes())
+            _replace_file(self._path(f"{prefix}.rows"), segment.rows.tobytes())
+            _replace_file(self._path(f"{prefix}.frequencies"), segment.frequencies.tobytes())
+            self._append_array("search.lengths.bin", writer.lengths)
+            self.search_segments.append(writer.start)
+        self.search = SegmentWriter(writer.rows)
+
+    def _append_array(self, file_name: str, values: array):
+        with open(self._path(file_name), "ab") as f:
+            values.tofile(f)
+
+    def _write_table(self, name: str, table: Dict[str, int]):
+        # Dicts keep insertion order, which is code order
+        blob, offsets = BlobTextColumn.pack(table)
+        _replace_file(self._path(f"{name}.table.blob"), blob)
+        _replace_file(self._path(f"{name}.table.offsets"), offsets.tobytes())
+
+    def finish(self, source: Optional[Dict]) -> Dict:
+        for blob in self.blobs.values():
+            blob.close()
+        for name, values in self.numeric.items():
+            self._append_array(f"{name}.bin", values)
+        for name in INTERNED_COLUMNS:
+            self._append_array(f"{name}.bin", self.codes[name])
+            self._write_table(name, self.tables[name])
+        for name in TEXT_COLUMNS:
+            self._append_array(f"{name}.offsets", self.offsets[name])
+        self._write_search_segment()
+
+        author_codes = array("i")
+        with open(self._path("author.bin"), "rb") as f:
+            author_codes.frombytes(f.read())
+        author_offsets, author_rows = _author_csr(author_codes, len(self.tables["author"]))
+        _replace_file(self._path("author_index.offsets"), author_offsets.tobytes())
+        _replace_file(self._path("author_index.rows"), author_rows.tobytes())
+        for name, values in self.aggregates.arrays.items():
+            _replace_file(self._path(f"profile.{name}.bin"), values.tobytes())
+
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "byteorder": sys.byteorder,
+            "rows": self.rows,
+            "source": source,
+            "numeric_columns": NUMERIC_COLUMNS,
+            "interned_columns": list(INTERNED_COLUMNS),
+            "text_columns": list(TEXT_COLUMNS),
+            "search_segments": self.search_segments,
+        }
+        # Replaced last: until then readers only see the rows of the old manifest
+        _replace_file(self._path(MANIFEST_FILE), json.dumps(manifest, indent=4).encode())
+        return manifest
+
+
+def write_snapshot(file_path: str, workers: Optional[int] = None) -> Dict:
+    """Convert a JSONL file into a columnar snapshot next to it
+
+    Args:
+        file_path: Path to the JSONL source file
+        workers: Worker processes for parsing the JSONL (see iter_jsonl_file)
+
+    Returns:
+        The snapshot manifest
+    """
+    directory = snapshot_path(file_path)
+    staging = directory + ".tmp"
+
+    with _snapshot_lock(file_path):
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        end = jsonl_complete_end(file_path)
+        builder = _SnapshotBuilder(staging)
+        records = iter_jsonl_file(
+            file_path, workers, fields=SNAPSHOT_FIELDS, end=end, derived_fields=DERIVED_FIELDS
+        )
+        for record in records:
+            builder.add(record)
+        manifest = builder.finish(jsonl_stamp(file_path, end))
+
+        # Swap directories so readers never see a half-written snapshot; processes
+        # that still map the old files keep reading them until they close.
+        retired = directory + ".old"
+        shutil.rmtree(retired, ignore_errors=True)
+        if os.path.exists(directory):
+            os.rename(directory, retired)
+        os.rename(staging, directory)
+        shutil.rmtree(retired, ignore_errors=True)
+
+    logging.info(f"Wrote snapshot of {manifest['rows']} records to {directory}")
+    return manifest
+
+
+def append_snapshot(file_path: str, workers: Optional[int] = None) -> int:
+    """Ingest the lines appended to a JSONL file since its snapshot was updated
+
+    Args:
+        file_path: Path to the JSONL source file
+        workers: Worker processes for parsing the JSONL (see iter_jsonl_file)
+
+    Returns:
+        Number of records appended to the snapshot
+    """
+    directory = snapshot_path(file_path)
+    with _snapshot_lock(file_path):
+        manifest = _read_manifest(directory)
+        if manifest is None or manifest["source"] is None:
+            raise ValueError(f"No snapshot of {file_path} to append to, run ingest first")
+        if jsonl_growth(file_path, manifest["source"]) is None:
+            raise ValueError(f"{file_path} was rewritten since its snapshot was taken, re-run ingest")
+
+        start = manifest["source"]["size"]
+        end = jsonl_complete_end(file_path, start)
+        if end <= start:
+            return 0
+
+        builder = _SnapshotBuilder(directory, manifest)
+        records = iter_jsonl_file(
+            file_path, workers, fields=SNAPSHOT_FIELDS, start=start, end=end, derived_fields=DERIVED_FIELDS
+        )
+        for record in records:
+            builder.add(record)
+        added = builder.finish(jsonl_stamp(file_path, end))["rows"] - manifest["rows"]
+
+    logging.info(f"Appended {added} records from {file_path} to {directory}")
+    return added
+
+
+class BlobTextColumn:
+    """Text column read from a UTF-8 blob through an offsets array"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    @staticmethod
+    def pack(values: Iterable[str]):
+        """Encode strings into a blob and the offsets array that reads them back"""
+        offsets = array("q", [0])
+        blob = bytearray()
+        for value in values:
+            blob += value.encode("utf-8", TEXT_ERRORS)
+            offsets.append(len(blob))
+        return bytes(blob), offsets
+
+    def __getitem__(self, row: int) -> str:
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].decode("utf-8", TEXT_ERRORS)
+
+    def __len__(self) -> int:
+        return max(len(self.offsets) - 1, 0)
+
+
+class SnapshotRecords(ColumnarRecords):
+    """Memory-mapped snapshot exposed as a sequence of record views
+
+    Provides the same ``by_author`` lookup as the in-memory store, served
+    from the CSR author index stored in the snapshot.
+
+    Args:
+        directory: Snapshot directory
+        source_path: JSONL file the snapshot was taken from, for refresh()
+    """
+
+    def __init__(self, directory: str, source_path: Optional[str] = None):
+        self.directory = directory
+        self.source_path = source_path
+        self._open()
+
+    def _open(self):
+        manifest = _read_manifest(self.directory)
+        rows = manifest["rows"]
+        maps = []
+
+        columns = {}
+        for name, code in manifest["numeric_columns"].items():
+            columns[name] = self._map_array(maps, f"{name}.bin", code, rows)
+        for name in manifest["interned_columns"]:
+            columns[name] = InternedColumn(
+                self._map_array(maps, f"{name}.bin", "i", rows), self._read_table(maps, name)
+            )
+        for name in manifest["text_columns"]:
+            columns[name] = BlobTextColumn(
+                self._map_array(maps, f"{name}.offsets", "q", rows + 1), self._map_bytes(maps, f"{name}.blob")
+            )
+        author_offsets = self._map_array(maps, "author_index.offsets", "q")
+        author_rows = self._map_array(maps, "author_index.rows", "q")
+        authors = len(columns["author"].table)
+        aggregates = AuthorAggregates(
+            {name: self._map_array(maps, f"profile.{name}.bin", code, authors) for name, code in AGGREGATE_ARRAYS.items()}
+        )
+        search = SearchIndex(
+            [self._map_segment(maps, start) for start in manifest["search_segments"]],
+            self._map_array(maps, "search.lengths.bin", "i", rows),
+        )
+
+        # Rows are only ever appended, so readers of the old attributes stay
+        # consistent while the new ones are swapped in
+        self.manifest = manifest
+        self._maps = maps
+        self.columns = columns
+        self.author_offsets, self.author_rows = author_offsets, author_rows
+        self.aggregates = aggregates
+        self.search = search
+        self.rows = rows
+
+    def _map_bytes(self, maps: List[mmap.mmap], file_name: str):
+        path = os.path.join(self.directory, file_name)
+        # mmap cannot map empty files
+        if os.path.getsize(path) == 0:
+            return b""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        maps.append(mapped)
+        return mapped
+
+    def _map_array(self, maps: List[mmap.mmap], file_name: str, code: str, length: Optional[int] = None):
+        mapped = self._map_bytes(maps, file_name)
+        if not mapped:
+            return array(code)
+        values = memoryview(mapped).cast(code)
+        # Column files may hold rows of an append whose manifest is not written yet
+        return values if length is None else values[:length]
+
+    def _map_segment(self, maps: List[mmap.mmap], start: int) -> SearchSegment:
+        prefix = f"search.{start}"
+        return SearchSegment(
+            BlobTextColumn(
+                self._map_array(maps, f"{prefix}.terms.offsets", "q"), self._map_bytes(maps, f"{prefix}.terms.blob")
+            ),
+            self._map_array(maps, f"{prefix}.offsets", "q"),
+            self._map_array(maps, f"{prefix}.rows", "q"),
+            self._map_array(maps, f"{prefix}.frequencies", "i"),
+        )
+
+    def search_index(self) -> SearchIndex:
+        return self.search
+
+    def fingerprint(self) -> Optional[str]:
+        if self.manifest["source"] is None:
+            return None
+        return json.dumps([
+            "snapshot", os.path.abspath(self.directory), self.manifest["version"], self.manifest["source"], self.rows
+        ])
+
+    def _read_table(self, maps: List[mmap.mmap], name: str) -> List[str]:
+        column = BlobTextColumn(
+            self._map_array(maps, f"{name}.table.offsets", "q"), self._map_bytes(maps, f"{name}.table.blob")
+        )
+        return [column[code] for code in range(len(column))]
+
+    def refresh(self) -> int:
+        if self.source_path is not None and os.path.exists(self.source_path):
+            source = _read_manifest(self.directory)["source"]
+            growth = jsonl_growth(self.source_path, source) if source is not None else 0
+            if growth is None:
+                logging.warning(f"{self.source_path} was rewritten since its snapshot was taken, re-run ingest")
+                return 0
+            if growth:
+                append_snapshot(self.source_path)
+
+        # Another process may have appended to the snapshot as well
+        rows = self.rows
+        if _read_manifest(self.directory)["rows"] == rows:
+            return 0
+        self._open()
+        self.version += 1
+        return self.rows - rows
+
+    def author_positions(self, author: str) -> Sequence[int]:
+        author_code = self.columns["author"].lookup.get(author)
+        if not author_code:
+            return ()
+        return self.author_rows[self.author_offsets[author_code]:self.author_offsets[author_code + 1]]
+
+    def author_counts(self) -> Dict[str, int]:
+        offsets, table = self.author_offsets, self.columns["author"].table
+        counts = {}
+        for author_code in range(1, len(table)):
+            count = offsets[author_code + 1] - offsets[author_code]
+            if count:
+                counts[table[author_code]] = count
+        return counts
+
+    def close(self):
+        # Views handed out may still reference the maps, so drop them instead of
+        # closing; they are unmapped once the last view is gone
+        self.columns = {}
+        self.author_offsets = self.author_rows = array("q")
+        self.aggregates = AuthorAggregates()
+        self.search = SearchIndex([], array("i"))
+        self.rows = 0
+        self._maps = []
+
+
+def open_snapshot(file_path: str) -> Optional[SnapshotRecords]:
+    """Open the snapshot of a JSONL file if one exists and matches the file
+
+    Lines appended to the file since the snapshot was taken are ingested into
+    it first. Returns None when there is no usable snapshot, so callers can
+    fall back to parsing the JSONL file.
+    """
+    directory = snapshot_path(file_path)
+    manifest = _read_manifest(directory)
+    if manifest is None:
+        return None
+
+    if manifest.get("version") != SNAPSHOT_VERSION or manifest.get("byteorder") != sys.byteorder:
+        logging.warning(f"Snapshot {directory} has an incompatible format, re-run ingest")
+        return None
+
+    if os.path.exists(file_path) and manifest["source"] is not None:
+        growth = jsonl_growth(file_path, manifest["source"])
+        if growth is None:
+            logging.warning(f"Snapshot {directory} does not match {file_path}, re-run ingest")
+            return None
+        if growth:
+            try:
+                append_snapshot(file_path)
+            except OSError as e:
+                logging.warning(f"Could not update snapshot {directory}, using it as is: {e}")
+
+    logging.info(f"Memory-mapping snapshot {directory}")
+    return SnapshotRecords(directory, file_path)
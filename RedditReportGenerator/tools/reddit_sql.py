@@ -0,0 +1,138 @@
+"""
+Embedded SQLite copy of the dataset for ad-hoc analytical queries.
+
+Posts and comments are loaded into an in-process SQLite database (without
+their long text fields, which the search tools cover), indexed by author,
+time and parent, so aggregations such as scores per month run in SQLite
+instead of Python loops. Stores only ever grow, so a new dataset version
+only inserts the appended rows.
+
+Queries run read-only (an authorizer allows reads and functions only),
+return at most a fixed number of rows and are interrupted after a time
+limit.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Dict, Sequence
+
+from RedditReportGenerator.tools.reddit_text import SENTIMENT_FIELD, record_sentiment
+
+# Columns of each table, as (field, SQL type)
+SQL_TABLES = {
+    "posts": (
+        ("id", "TEXT"),
+        ("author", "TEXT"),
+        ("subreddit", "TEXT"),
+        ("score", "INTEGER"),
+        ("created", "INTEGER"),
+        ("title", "TEXT"),
+        ("url", "TEXT"),
+        ("sentiment", "REAL"),
+    ),
+    "comments": (
+        ("id", "TEXT"),
+        ("author", "TEXT"),
+        ("subreddit", "TEXT"),
+        ("score", "INTEGER"),
+        ("created", "INTEGER"),
+        ("parent_id", "TEXT"),
+        ("link_id", "TEXT"),
+        ("sentiment", "REAL"),
+    ),
+}
+
+SQL_INDEXES = {
+    "posts": ("author", "created", "id"),
+    "comments": ("author", "created", "parent_id", "link_id"),
+}
+
+# Upper bounds on what one query may return and how long it may run
+MAX_ROWS = 500
+MAX_SECONDS = 10.0
+
+# SQLite virtual machine steps between checks of the time limit
+_PROGRESS_STEPS = 10_000
+
+# Authorizer actions a query may perform (SQLITE_RECURSIVE, for WITH RECURSIVE, is
+# missing from older sqlite3 modules)
+_READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, 33}
+
+
+def _read_only(action, *_):
+    return sqlite3.SQLITE_OK if action in _READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def _sql_row(record: Dict, names: Sequence[str]) -> list:
+    row = [record.get(name) for name in names]
+    if SENTIMENT_FIELD in names and record.get(SENTIMENT_FIELD) is None:
+        # Plain record dicts are not scored at load time
+        row[names.index(SENTIMENT_FIELD)] = record_sentiment(record)
+    return row
+
+
+class SqlDatabase:
+    """In-memory SQLite tables of one set of posts and comments"""
+
+    def __init__(self):
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.lock = threading.Lock()
+        self.loaded = {table: 0 for table in SQL_TABLES}
+        for table, columns in SQL_TABLES.items():
+            self.connection.execute(f"CREATE TABLE {table} ({', '.join(f'{name} {kind}' for name, kind in columns)})")
+            for name in SQL_INDEXES[table]:
+                self.connection.execute(f"CREATE INDEX {table}_{name} ON {table} ({name})")
+
+    def extends(self, posts: Sequence[Dict], comments: Sequence[Dict]) -> bool:
+        """Check the records can only have grown since they were last loaded"""
+        return len(posts) >= self.loaded["posts"] and len(comments) >= self.loaded["comments"]
+
+    def load(self, posts: Sequence[Dict], comments: Sequence[Dict]):
+        """Insert the posts and comments appended since the last load"""
+        with self.lock:
+            for table, records in (("posts", posts), ("comments", comments)):
+                names = [name for name, _ in SQL_TABLES[table]]
+                rows = (_sql_row(record, names) for record in records[self.loaded[table]:])
+                self.connection.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(names))})", rows)
+                self.loaded[table] = len(records)
+            self.connection.commit()
+
+    def query(self, sql: str, max_rows: int = 100, max_seconds: float = MAX_SECONDS) -> Dict:
+        """Run a read-only query
+
+        Args:
+            sql: A single SELECT statement
+            max_rows: Rows to return at most (capped at MAX_ROWS)
+            max_seconds: Time after which the query is interrupted (capped at MAX_SECONDS)
+
+        Returns:
+            Dictionary with column names, rows and whether rows were cut off
+        """
+        max_rows = max(1, min(int(max_rows), MAX_ROWS))
+        max_seconds = min(float(max_seconds), MAX_SECONDS)
+        deadline = time.monotonic() + max_seconds
+        with self.lock:
+            connection = self.connection
+            connection.set_authorizer(_read_only)
+            connection.set_progress_handler(lambda: time.monotonic() > deadline, _PROGRESS_STEPS)
+            try:
+                cursor = connection.execute(sql)
+                rows = cursor.fetchmany(max_rows + 1)
+                columns = [column[0] for column in cursor.description or ()]
+                cursor.close()
+            except sqlite3.OperationalError as e:
+                if time.monotonic() > deadline:
+                    raise ValueError(f"Query did not finish within {max_seconds} seconds") from e
+                raise ValueError(f"Invalid query: {e}") from e
+            except (sqlite3.Error, sqlite3.Warning) as e:
+                raise ValueError(f"Invalid query: {e}") from e
+            finally:
+                connection.set_authorizer(None)
+                connection.set_progress_handler(None, 0)
+
+        return {
+            "columns": columns,
+            "rows": [list(row) for row in rows[:max_rows]],
+            "truncated": len(rows) > max_rows,
+        }
@@ -0,0 +1,660 @@
+"""
+Compact struct-of-arrays storage for Reddit posts and comments.
+
+Records are stored column by column instead of one dict per record:
+
+- ``score`` and ``created`` as int64 arrays
+- ``sentiment`` (scored from the record's text when it is added) as a float64 array
+- ``author`` and ``subreddit`` as int32 codes into a shared string table
+- ``id`` as base-36 integers and ``parent_id`` as (kind, base-36 integer) pairs
+- other text fields as plain string lists, or, for the large fields of a
+  projected JSONL load, as nothing at all (read back from the file on access)
+
+Rows are handed out as ``RecordView`` objects: small read-only mappings over
+one row, optionally restricted to a subset of fields, that never copy data.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from RedditReportGenerator.common.utils import (
+    JsonlRecord,
+    JsonlSource,
+    iter_jsonl_file,
+    jsonl_complete_end,
+    jsonl_growth,
+    jsonl_stamp,
+)
+from RedditReportGenerator.tools.reddit_keywords import TermMatrix
+from RedditReportGenerator.tools.reddit_profiles import ActivityStats, AuthorAggregates
+from RedditReportGenerator.tools.reddit_search import SearchIndex
+from RedditReportGenerator.tools.reddit_text import SENTIMENT_FIELD, record_sentiment
+from RedditReportGenerator.tools.reddit_threads import ThreadIndex, record_id
+from RedditReportGenerator.tools.reddit_timeline import TimeIndex
+
+NUMERIC_FIELDS = ("score", "created")
+FLOAT_FIELDS = (SENTIMENT_FIELD,)
+INTERNED_FIELDS = ("author", "subreddit")
+ID_FIELDS = ("id",)
+FULLNAME_FIELDS = ("parent_id", "link_id")
+TEXT_FIELDS = ("title", "selftext", "body", "url")
+
+# Value returned for a field a store has no column for
+FIELD_DEFAULTS = {"score": 0, "created": 0, SENTIMENT_FIELD: 0.0}
+
+# Fields computed from each parsed JSONL record before it is projected
+DERIVED_FIELDS = {SENTIMENT_FIELD: record_sentiment}
+
+# Guards the creation of each store's derived data and build locks
+_derived_guard = threading.Lock()
+
+# Time windows kept per store, least recently used dropped first
+WINDOW_CACHE_SIZE = 16
+
+_BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+_FULLNAME = re.compile(r"t([1-6])_(.+)")
+
+
+def _as_text(value) -> str:
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+def _to_base36(number: int) -> str:
+    digits = []
+    while True:
+        number, digit = divmod(number, 36)
+        digits.append(_BASE36[digit])
+        if not number:
+            return "".join(reversed(digits))
+
+
+class IntColumn(array):
+    """int64 column; missing values are stored as 0"""
+
+    def __new__(cls, values: Iterable[int] = ()):
+        return super().__new__(cls, "q", values)
+
+    def add(self, value):
+        self.append(int(value or 0))
+
+    def add_missing(self):
+        self.append(0)
+
+
+class FloatColumn(array):
+    """float64 column; missing values are stored as 0.0"""
+
+    def __new__(cls, values: Iterable[float] = ()):
+        return super().__new__(cls, "d", values)
+
+    def add(self, value):
+        self.append(float(value or 0))
+
+    def add_missing(self):
+        self.append(0.0)
+
+
+class TextColumn(list):
+    """Resident string column; missing values are stored as empty strings"""
+
+    def add(self, value):
+        self.append(_as_text(value))
+
+    def add_missing(self):
+        self.append("")
+
+
+class ObjectColumn(list):
+    """Column for fields outside the known schema, kept as raw JSON values"""
+
+    def add(self, value):
+        self.append(value)
+
+    def add_missing(self):
+        self.append(None)
+
+
+class InternedColumn:
+    """int32 codes into a string table, so each distinct value is stored once"""
+
+    def __init__(self, codes=None, table: Optional[List[str]] = None):
+        # Code 0 is reserved for records without a value
+        self.codes = array("i") if codes is None else codes
+        self.table = [""] if table is None else table
+        self.lookup = {value: code for code, value in enumerate(self.table)}
+
+    def add(self, value):
+        value = _as_text(value)
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.table)
+            self.table.append(value)
+        self.codes.append(code)
+
+    def add_missing(self):
+        self.codes.append(0)
+
+    def __getitem__(self, row: int) -> str:
+        return self.table[self.codes[row]]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+class IdColumn:
+    """Reddit ids stored as base-36 integers
+
+    Ids that do not round-trip through base 36 (unexpected formats) are kept
+    verbatim in a small overflow map.
+    """
+
+    def __init__(self):
+        self.numbers = array("q")
+        self.overflow: Dict[int, str] = {}
+
+    def add(self, value):
+        value = _as_text(value)
+        try:
+            number = int(value, 36)
+        except ValueError:
+            number = -1
+        if not 0 <= number < 1 << 63 or _to_base36(number) != value:
+            number = -1
+            if value:
+                self.overflow[len(self.numbers)] = value
+        self.numbers.append(number)
+
+    def add_missing(self):
+        self.numbers.append(-1)
+
+    def __getitem__(self, row: int) -> str:
+        number = self.numbers[row]
+        if number < 0:
+            return self.overflow.get(row, "")
+        return _to_base36(number)
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+
+class FullnameColumn:
+    """Reddit fullnames such as ``t1_abc`` stored as a type digit plus an IdColumn"""
+
+    def __init__(self):
+        self.kinds = array("b")
+        self.ids = IdColumn()
+
+    def add(self, value):
+        value = _as_text(value)
+        match = _FULLNAME.fullmatch(value)
+        if match:
+            self.kinds.append(int(match.group(1)))
+            self.ids.add(match.group(2))
+            if self.ids.numbers[-1] >= 0:
+                return
+            # Unusual id: keep the whole fullname verbatim instead
+            self.kinds[-1] = 0
+            self.ids.overflow[len(self.ids) - 1] = value
+            return
+        self.kinds.append(0)
+        self.ids.add(value)
+
+    def add_missing(self):
+        self.kinds.append(0)
+        self.ids.add_missing()
+
+    def __getitem__(self, row: int) -> str:
+        kind = self.kinds[row]
+        if kind:
+            return f"t{kind}_{self.ids[row]}"
+        return self.ids[row]
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+
+class LazyTextColumn:
+    """Text column with no resident data: values are read from the JSONL source
+
+    Rows that were added from already-parsed dicts keep their value in
+    ``resident`` instead.
+    """
+
+    def __init__(self, store: "RedditRecords", name: str, source: JsonlSource):
+        self.store = store
+        self.name = name
+        self.source = source
+        self.resident: Dict[int, str] = {}
+
+    def add(self, value):
+        self.resident[len(self.store.line_offsets) - 1] = _as_text(value)
+
+    def add_missing(self):
+        pass
+
+    def __getitem__(self, row: int) -> str:
+        value = self.resident.get(row)
+        if value is not None:
+            return value
+        offset = self.store.line_offsets[row]
+        if offset < 0:
+            return ""
+        return _as_text(self.source.read_field(offset, self.store.line_lengths[row], self.name))
+
+    def __len__(self) -> int:
+        return len(self.store.line_offsets)
+
+
+def _new_column(name: str):
+    if name in NUMERIC_FIELDS:
+        return IntColumn()
+    if name in FLOAT_FIELDS:
+        return FloatColumn()
+    if name in INTERNED_FIELDS:
+        return InternedColumn()
+    if name in ID_FIELDS:
+        return IdColumn()
+    if name in FULLNAME_FIELDS:
+        return FullnameColumn()
+    if name in TEXT_FIELDS:
+        return TextColumn()
+    return ObjectColumn()
+
+
+class RecordView(Mapping):
+    """Read-only mapping over one row of a columnar store
+
+    Args:
+        records: The store the row belongs to
+        row: Row position
+        fields: Fields exposed by the view (default: every column of the store)
+    """
+
+    __slots__ = ("_records", "_row", "_fields")
+
+    def __init__(self, records: "ColumnarRecords", row: int, fields: Optional[Sequence[str]] = None):
+        self._records = records
+        self._row = row
+        self._fields = fields
+
+    @property
+    def row(self) -> int:
+        return self._row
+
+    def _keys(self) -> Sequence[str]:
+        return self._records.columns.keys() if self._fields is None else self._fields
+
+    def get(self, key: str, default=None):
+        if self._fields is not None and key not in self._fields:
+            return default
+        return self._records.value(self._row, key, default)
+
+    def __getitem__(self, key: str):
+        if key not in self._keys():
+            raise KeyError(key)
+        return self._records.value(self._row, key, FIELD_DEFAULTS.get(key, ""))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def to_dict(self) -> Dict:
+        return {key: self[key] for key in self._keys()}
+
+    def __repr__(self) -> str:
+        return f"RecordView({self.to_dict()!r})"
+
+
+class ColumnarRecords(ABC):
+    """Sequence of record views over named columns, with an author index
+
+    Subclasses provide ``columns`` (name -> column supporting ``column[row]``),
+    ``rows``, ``aggregates`` (per author code), ``author_positions`` and
+    ``author_counts``. ``version`` increases every time new records are
+    ingested, so derived data can tell when it is out of date.
+    """
+
+    columns: Dict[str, object]
+    rows: int
+    aggregates: AuthorAggregates
+    version: int = 0
+
+    def refresh(self) -> int:
+        """Ingest records appended to the source since it was loaded
+
+        Returns:
+            Number of new records
+        """
+        return 0
+
+    def fingerprint(self) -> Optional[str]:
+        """Identify the records across processes, or None if they were not loaded from a file
+
+        Fingerprints change whenever the records do, so results cached under
+        one are never served for other data.
+        """
+        return None
+
+    def derived(self, key, build: Callable[[], object]):
+        """Get data derived from the records, built once per version
+
+        Threads asking for the same data while it is being built wait for
+        that build instead of starting their own; builds of different data
+        run side by side.
+        """
+        cached = getattr(self, "_derived", None)
+        if cached is None or cached[0] != self.version:
+            with _derived_guard:
+                cached = getattr(self, "_derived", None)
+                if cached is None or cached[0] != self.version:
+                    cached = self._derived = (self.version, {}, {})
+        _, values, locks = cached
+        try:
+            return values[key]
+        except KeyError:
+            pass
+        with _derived_guard:
+            lock = locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in values:
+                values[key] = build()
+            return values[key]
+
+    def column_total(self, name: str) -> float:
+        """Sum a numeric column, cached until new records are ingested"""
+        column = self.columns.get(name)
+        return self.derived(("total", name), lambda: sum(column) if column is not None else 0)
+
+    def term_matrix(self) -> TermMatrix:
+        """Get the author x term count matrix of the records"""
+        return self.derived("term_matrix", lambda: TermMatrix.build(self))
+
+    def time_index(self) -> TimeIndex:
+        """Get the records sorted by creation time"""
+        return self.derived("time_index", lambda: TimeIndex.build(self))
+
+    def thread_index(self) -> ThreadIndex:
+        """Get the comment trees of the records (for comments)"""
+        return self.derived("thread_index", lambda: ThreadIndex(self))
+
+    def search_index(self) -> SearchIndex:
+        """Get the full-text index of the records"""
+        return self.derived("search_index", lambda: SearchIndex.build(self))
+
+    def id_rows(self) -> Dict[str, int]:
+        """Get the row of every record id"""
+        return self.derived("id_rows", lambda: {record_id(view.get("id")): view.row for view in self})
+
+    def value(self, row: int, key: str, default=None):
+        """Get one field of one row, or default if the store has no such column"""
+        column = self.columns.get(key)
+        if column is None:
+            return default
+        return column[row]
+
+    def view(self, row: int, fields: Optional[Sequence[str]] = None) -> RecordView:
+        return RecordView(self, row, fields)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [RecordView(self, i) for i in range(*row.indices(self.rows))]
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError("record index out of range")
+        return RecordView(self, row)
+
+    def __iter__(self) -> Iterator[RecordView]:
+        for row in range(self.rows):
+            yield RecordView(self, row)
+
+    @abstractmethod
+    def author_positions(self, author: str) -> Sequence[int]:
+        """Get the rows of all records by an author in load order"""
+
+    @abstractmethod
+    def author_counts(self) -> Dict[str, int]:
+        """Get the number of records per author, in order of first appearance"""
+
+    def by_author(self, author: str, fields: Optional[Sequence[str]] = None) -> List[RecordView]:
+        """Get views of all records by an author in load order"""
+        return [RecordView(self, row, fields) for row in self.author_positions(author)]
+
+    def author_stats(self, author: str) -> ActivityStats:
+        """Get the activity aggregates of an author without touching their records"""
+        column = self.columns.get("author")
+        # Code 0 holds records without an author, which belong to nobody
+        author_code = column.lookup.get(author) if column is not None else None
+        return self.aggregates.stats(author_code or None)
+
+    def window(self, since: Optional[int] = None, until: Optional[int] = None) -> "ColumnarRecords":
+        """Get the records created in [since, until) (all records if both are None)
+
+        Windows are kept per bounds until new records are ingested, so what
+        is derived from a window (its thread index, reply graph, ...) is
+        built once for repeated calls with the same bounds.
+        """
+        if since is None and until is None:
+            return self
+        windows = self.derived("windows", OrderedDict)
+        with _derived_guard:
+            window = windows.get((since, until))
+            if window is not None:
+                windows.move_to_end((since, until))
+                return window
+        window = RecordWindow(self, since, until)
+        with _derived_guard:
+            window = windows.setdefault((since, until), window)
+            windows.move_to_end((since, until))
+            while len(windows) > WINDOW_CACHE_SIZE:
+                windows.popitem(last=False)
+        return window
+
+
+class RecordWindow(ColumnarRecords):
+    """Records of a store created within a time window, in time order
+
+    Row positions are those of the parent store, so the window shares its
+    columns and views without copying. Lookups cost a binary search plus
+    the number of records inside the window.
+    """
+
+    def __init__(self, records: ColumnarRecords, since: Optional[int], until: Optional[int]):
+        # A window never changes; its parent hands out a new one once it grows
+        self.version = records.version
+        self.records = records
+        self.columns = records.columns
+        self.index = records.time_index().window(since, until)
+        self.positions = self.index.series.rows
+        self.rows = len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [RecordView(self, row) for row in self.positions[index]]
+        return RecordView(self, self.positions[index])
+
+    def __iter__(self) -> Iterator[RecordView]:
+        for row in self.positions:
+            yield RecordView(self, row)
+
+    def time_index(self):
+        return self.index
+
+    def window(self, since: Optional[int] = None, until: Optional[int] = None) -> ColumnarRecords:
+        sinces = [bound for bound in (since, self.index.since) if bound is not None]
+        untils = [bound for bound in (until, self.index.until) if bound is not None]
+        return self.records.window(max(sinces, default=None), min(untils, default=None))
+
+    def author_positions(self, author: str) -> Sequence[int]:
+        return self.index.author_series(author).rows
+
+    def author_counts(self) -> Dict[str, int]:
+        column = self.columns.get("author")
+        if column is None:
+            return {}
+        codes, counts = column.codes, {}
+        for row in self.positions:
+            author_code = codes[row]
+            if author_code:
+                counts[author_code] = counts.get(author_code, 0) + 1
+        return {column.table[author_code]: count for author_code, count in counts.items()}
+
+    def author_stats(self, author: str) -> ActivityStats:
+        columns, aggregates = self.columns, AuthorAggregates()
+        score, created, sentiment = (columns.get(name) for name in ("score", "created", SENTIMENT_FIELD))
+        for row in self.author_positions(author):
+            aggregates.add(
+                0,
+                score[row] if score is not None else 0,
+                created[row],
+                sentiment[row] if sentiment is not None else 0.0,
+            )
+        return aggregates.stats(0)
+
+    def column_total(self, name: str) -> float:
+        column = self.columns.get(name)
+        return sum(column[row] for row in self.positions) if column is not None else 0
+
+
+class RedditRecords(ColumnarRecords):
+    """In-memory columnar store of posts or comments
+
+    Built from record dicts (or projected ``JsonlRecord`` objects, whose lazy
+    fields stay on disk), with an author index maintained as records are added.
+    """
+
+    def __init__(self, records: Iterable[Dict] = ()):
+        self.columns: Dict[str, object] = {}
+        self.rows = 0
+        self.line_offsets = array("q")
+        self.line_lengths = array("l")
+        self.author_index: Dict[str, array] = {}
+        self.aggregates = AuthorAggregates()
+        self.source_path: Optional[str] = None
+        self.source_stamp: Optional[Dict] = None
+        self.load_options: Dict = {}
+        self.extend(records)
+
+    @classmethod
+    def from_jsonl(
+        cls,
+        file_path: str,
+        fields: Optional[Sequence[str]] = None,
+        lazy_fields: Sequence[str] = (),
+        workers: Optional[int] = None,
+    ) -> "RedditRecords":
+        """Load a JSONL file and checkpoint how far it was read, so refresh() can tail it"""
+        records = cls()
+        records.source_path = file_path
+        records.load_options = {
+            "workers": workers,
+            "fields": fields,
+            "lazy_fields": lazy_fields,
+            "derived_fields": DERIVED_FIELDS,
+        }
+        records._ingest(0, jsonl_complete_end(file_path))
+        return records
+
+    def fingerprint(self) -> Optional[str]:
+        if self.source_path is None or self.source_stamp is None:
+            return None
+        return json.dumps([
+            "jsonl",
+            os.path.abspath(self.source_path),
+            self.source_stamp,
+            self.rows,
+            list(self.load_options.get("fields") or ()),
+        ])
+
+    def _ingest(self, start: int, end: int):
+        self.extend(iter_jsonl_file(self.source_path, start=start, end=end, **self.load_options))
+        self.source_stamp = jsonl_stamp(self.source_path, end)
+        self.version += 1
+
+    def refresh(self) -> int:
+        if self.source_path is None:
+            return 0
+        growth = jsonl_growth(self.source_path, self.source_stamp)
+        if growth is None:
+            logging.warning(f"{self.source_path} was rewritten since it was loaded, restart to reload it")
+            return 0
+        start = self.source_stamp["size"]
+        end = jsonl_complete_end(self.source_path, start) if growth else start
+        if end <= start:
+            return 0
+
+        rows = self.rows
+        self._ingest(start, end)
+        logging.info(f"Ingested {self.rows - rows} new records from {self.source_path}")
+        return self.rows - rows
+
+    def _column_for(self, name: str):
+        column = self.columns.get(name)
+        if column is None:
+            column = _new_column(name)
+            for _ in range(self.rows):
+                column.add_missing()
+            self.columns[name] = column
+        return column
+
+    def append(self, record: Dict):
+        row = self.rows
+        if isinstance(record, JsonlRecord):
+            self.line_offsets.append(record.offset)
+            self.line_lengths.append(record.length)
+            for name in record.source.lazy_fields:
+                if name not in self.columns:
+                    self.columns[name] = LazyTextColumn(self, name, record.source)
+        else:
+            self.line_offsets.append(-1)
+            self.line_lengths.append(0)
+
+        for name, value in record.items():
+            self._column_for(name).add(value)
+        sentiment = record.get(SENTIMENT_FIELD)
+        if sentiment is None:
+            # Records not parsed with DERIVED_FIELDS are scored here
+            sentiment = record_sentiment(record)
+            self._column_for(SENTIMENT_FIELD).add(sentiment)
+        for column in self.columns.values():
+            if len(column) <= row:
+                column.add_missing()
+        self.rows += 1
+
+        author = record.get("author")
+        if author:
+            rows = self.author_index.get(author)
+            if rows is None:
+                rows = self.author_index[author] = array("l")
+            rows.append(row)
+            self.aggregates.add(
+                self.columns["author"].codes[row],
+                record.get("score"),
+                record.get("created"),
+                sentiment,
+            )
+
+    def extend(self, records: Iterable[Dict]):
+        for record in records:
+            self.append(record)
+
+    def author_positions(self, author: str) -> Sequence[int]:
+        return self.author_index.get(author, ())
+
+    def author_counts(self) -> Dict[str, int]:
+        return {author: len(rows) for author, rows in self.author_index.items()}
@@ -0,0 +1,73 @@
+"""
+Text scoring and tokenizing shared by the record stores and the tools.
+
+Sentiment is scored with one compiled alternation over the whole lexicon,
+matched on word boundaries (so "goodbye" or "poorly" don't count), instead of
+one substring search per lexicon word.
+"""
+
+import re
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, Iterator, Optional
+
+POSITIVE_WORDS = ["good", "great", "excellent", "awesome", "amazing", "perfect", "wonderful", "fantastic"]
+NEGATIVE_WORDS = ["bad", "terrible", "awful", "horrible", "worst", "disappointing", "poor"]
+
+_POSITIVE = frozenset(POSITIVE_WORDS)
+_SENTIMENT_WORDS = re.compile(r"\b(?:%s)\b" % "|".join(map(re.escape, POSITIVE_WORDS + NEGATIVE_WORDS)))
+
+# Fields whose text is scored: title and selftext for posts, body for comments
+SENTIMENT_TEXT_FIELDS = ("title", "selftext", "body")
+
+# Per-record column holding the score of its text fields
+SENTIMENT_FIELD = "sentiment"
+
+
+def text_sentiment(text: str) -> float:
+    """Score text from -1 (negative) to 1 (positive) by the distinct sentiment words it contains"""
+    found = set(_SENTIMENT_WORDS.findall(text.lower()))
+    if not found:
+        return 0.0
+
+    pos_count = len(found & _POSITIVE)
+    return (2 * pos_count - len(found)) / len(found)
+
+
+def batch_sentiment(texts: Iterable[str]) -> array:
+    """Score many texts, returning a float64 array in input order"""
+    return array("d", map(text_sentiment, texts))
+
+
+def record_text(record: Dict) -> str:
+    """Get the scored text of a post or comment"""
+    return " ".join(record.get(name) or "" for name in SENTIMENT_TEXT_FIELDS)
+
+
+def record_sentiment(record: Dict) -> float:
+    """Score the text fields of a post or comment"""
+    return text_sentiment(record_text(record))
+
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+# Words too common to be keywords (simple list)
+STOP_WORDS = frozenset({
+    "the", "and", "for", "with", "you", "that", "this", "but", "not", "are", "were",
+    "was", "will", "would", "could", "should", "can", "if", "in", "on", "at", "by"
+})
+
+
+def keyword_tokens(text: str) -> Iterator[str]:
+    """Split text into lowercase keyword candidates, without punctuation or stop words"""
+    for word in _PUNCTUATION.sub("", text.lower()).split():
+        if len(word) > 3 and word not in STOP_WORDS:
+            yield word
+
+
+def count_keywords(texts: Iterable[str], counts: Optional[Counter] = None) -> Counter:
+    """Count keyword tokens document by document, without joining the texts"""
+    counts = Counter() if counts is None else counts
+    for text in texts:
+        counts.update(keyword_tokens(text))
+    return counts
@@ -0,0 +1,142 @@
+"""
+Conversation threads reassembled from comments' ``parent_id``.
+
+The index is built once per dataset version. Comments are laid out in
+depth-first order, thread by thread, so every comment's replies (its whole
+subtree) and every post's comments are one contiguous slice of that order;
+parent, depth and subtree size are kept per comment row, and child lists in
+compressed sparse row form. Conversation tools then read only the rows of
+the thread they look at.
+"""
+
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from RedditReportGenerator.tools.reddit_graph import UNKNOWN_AUTHORS
+
+
+def record_id(value: str) -> str:
+    """Strip the ``t1_``/``t3_`` kind prefix from a fullname, if present"""
+    kind, separator, rest = (value or "").partition("_")
+    return rest if separator and kind in ("t1", "t3") else value or ""
+
+
+class ThreadIndex:
+    """Comment trees of every post, over the row positions of a comment list
+
+    Top-level comments have depth 0. Comments whose parent comment is not in
+    the dataset start a tree of their own in the thread their ``link_id``
+    names.
+    """
+
+    def __init__(self, comments: Sequence[Dict]):
+        rows = len(comments)
+        self.ids = [record_id(record.get("id")) for record in comments]
+        self.rows = {comment_id: row for row, comment_id in enumerate(self.ids)}
+        self.parents = array("q", [-1]) * rows
+
+        # Trees of each thread, keyed by post id, in order of first comment
+        roots: Dict[str, List[int]] = {}
+        for row, record in enumerate(comments):
+            kind, _, parent = (record.get("parent_id") or "").partition("_")
+            parent_row = self.rows.get(parent) if kind == "t1" else None
+            if parent_row is not None and parent_row != row:
+                self.parents[row] = parent_row
+                continue
+            post_id = parent if kind == "t3" else record_id(record.get("link_id"))
+            roots.setdefault(post_id, []).append(row)
+
+        counts = array("q", [0]) * (rows + 1)
+        for parent_row in self.parents:
+            if parent_row >= 0:
+                counts[parent_row + 1] += 1
+        for row in range(rows):
+            counts[row + 1] += counts[row]
+        self.child_offsets = counts
+        self.child_rows = array("q", [0]) * counts[rows]
+        filled = array("q", counts[:rows])
+        for row, parent_row in enumerate(self.parents):
+            if parent_row >= 0:
+                self.child_rows[filled[parent_row]] = row
+                filled[parent_row] += 1
+
+        self.order = array("q")
+        self.positions = array("q", [-1]) * rows
+        self.depths = array("l", [0]) * rows
+        # Post id -> (start, end) of its comments in the order, and its top-level count
+        self.threads: Dict[str, Tuple[int, int, int]] = {}
+        for post_id, thread_roots in roots.items():
+            start = len(self.order)
+            for root in thread_roots:
+                self._walk(root)
+            self.threads[post_id] = (start, len(self.order), len(thread_roots))
+
+        # Children follow their parent in the order, so one reverse pass sums subtrees
+        self.sizes = array("q", [1]) * rows
+        for row in reversed(self.order):
+            if self.parents[row] >= 0:
+                self.sizes[self.parents[row]] += self.sizes[row]
+
+    def _walk(self, root: int):
+        stack = [root]
+        while stack:
+            row = stack.pop()
+            if self.positions[row] >= 0:
+                continue
+            self.positions[row] = len(self.order)
+            self.order.append(row)
+            if self.parents[row] >= 0:
+                self.depths[row] = self.depths[self.parents[row]] + 1
+            # Pushed in reverse so replies come out in load order
+            stack.extend(reversed(self.children(row)))
+
+    def row_of(self, comment_id: str) -> Optional[int]:
+        return self.rows.get(record_id(comment_id))
+
+    def children(self, row: int) -> Sequence[int]:
+        return self.child_rows[self.child_offsets[row]:self.child_offsets[row + 1]]
+
+    def ancestors(self, row: int) -> List[int]:
+        """Get the comments a comment replies to, from the top-level one down"""
+        if self.positions[row] < 0:
+            return []
+        chain = []
+        parent_row = self.parents[row]
+        while parent_row >= 0:
+            chain.append(parent_row)
+            parent_row = self.parents[parent_row]
+        return chain[::-1]
+
+    def subtree(self, row: int) -> Sequence[int]:
+        """Get a comment and all replies below it, in depth-first order"""
+        start = self.positions[row]
+        if start < 0:
+            # Part of a reply cycle, which no thread reaches
+            return [row]
+        return self.order[start:start + self.sizes[row]]
+
+    def thread_rows(self, post_id: str) -> Sequence[int]:
+        """Get all comments of a post in depth-first order"""
+        start, end, _ = self.threads.get(record_id(post_id), (0, 0, 0))
+        return self.order[start:end]
+
+    def thread_stats(self, post_id: str, comments: Sequence[Dict], post_author: Optional[str] = None) -> Dict:
+        """Get the size, shape and participation of a post's comment tree"""
+        _, _, top_level = self.threads.get(record_id(post_id), (0, 0, 0))
+        rows = self.thread_rows(post_id)
+        depths = [self.depths[row] for row in rows]
+        authors = [comments[row].get("author") or "" for row in rows]
+        created = [comments[row].get("created") or 0 for row in rows]
+        created = [timestamp for timestamp in created if timestamp > 0]
+        scores = [comments[row].get("score") or 0 for row in rows]
+        return {
+            "total_comments": len(rows),
+            "top_level_comments": top_level,
+            "max_depth": max(depths, default=0),
+            "avg_depth": sum(depths) / len(depths) if depths else 0.0,
+            "participants": len(set(authors) - UNKNOWN_AUTHORS),
+            "author_replies": authors.count(post_author) if post_author else 0,
+            "avg_comment_score": sum(scores) / len(scores) if scores else 0.0,
+            "first_comment": min(created, default=None),
+            "last_comment": max(created, default=None),
+        }
@@ -0,0 +1,211 @@
+"""
+Timestamp index over posts and comments.
+
+Records are sorted by ``created`` once per dataset version, globally and (on
+first use) per author, so frequency, span, trend, histogram and time window
+queries are answered with binary searches and one pass over the matching
+timestamps instead of rescanning the records. Records without a timestamp
+are left out.
+"""
+
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from heapq import merge
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Sequence
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+# Bucket label formats; weeks are labelled by their Monday
+BUCKET_FORMATS = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d", "week": "%Y-%m-%d"}
+
+# Relative change between the two halves of a span that counts as a trend
+TREND_THRESHOLD = 0.1
+
+
+def bucket_start(timestamp: int, bucket: str) -> int:
+    """Get the start of the hour, day or week (from Monday) a timestamp falls in"""
+    if bucket == "hour":
+        return timestamp - timestamp % HOUR
+    if bucket == "day":
+        return timestamp - timestamp % DAY
+    if bucket == "week":
+        # 1970-01-01 was a Thursday, three days after a Monday
+        return timestamp - (timestamp + 3 * DAY) % WEEK
+    raise ValueError(f"Unknown bucket {bucket!r}, expected one of {', '.join(BUCKET_FORMATS)}")
+
+
+def parse_time(value, end: bool = False) -> Optional[int]:
+    """Parse a unix timestamp or an ISO date/datetime (UTC unless it has an offset)
+
+    Args:
+        value: Time to parse; None or "" means no bound
+        end: Parse an exclusive upper bound, so a date alone covers that whole day
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    text = str(value).strip()
+    if re.fullmatch(r"-?\d+(\.\d+)?", text):
+        return int(float(text))
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid time {value!r}, expected a date like 2023-04-01 or a unix timestamp")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    timestamp = int(parsed.timestamp())
+    if end and re.fullmatch(r"\d{4}-\d{2}-\d{2}", text):
+        timestamp += DAY
+    return timestamp
+
+
+def format_time(timestamp: Optional[int], bucket: str = "day") -> Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(BUCKET_FORMATS[bucket])
+
+
+class TimeSeries:
+    """Sorted timestamps of a set of records, with the row position of each"""
+
+    __slots__ = ("times", "rows")
+
+    def __init__(self, times: Sequence[int], rows: Optional[Sequence[int]] = None):
+        self.times = times
+        self.rows = rows
+
+    @classmethod
+    def merged(cls, series: Iterable["TimeSeries"]) -> "TimeSeries":
+        """Merge series of different stores (row positions are dropped)"""
+        return cls(array("q", merge(*(item.times for item in series))))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def window(self, since: Optional[int] = None, until: Optional[int] = None) -> "TimeSeries":
+        """Get the part of the series in [since, until)"""
+        start = 0 if since is None else bisect_left(self.times, since)
+        end = len(self.times) if until is None else bisect_left(self.times, until)
+        return TimeSeries(self.times[start:end], None if self.rows is None else self.rows[start:end])
+
+    def counts(self, bucket: str = "day") -> Dict[int, int]:
+        """Count timestamps per bucket start, in time order"""
+        groups = groupby(self.times, lambda timestamp: bucket_start(timestamp, bucket))
+        return {start: sum(1 for _ in group) for start, group in groups}
+
+    def trend(self) -> Dict:
+        """Compare activity in the earlier and later half of the active span"""
+        times = self.times
+        if len(times) < 2 or times[0] == times[-1]:
+            return {"direction": "stable", "earlier_half": len(times), "later_half": 0, "change": 0.0}
+        split = bisect_right(times, (times[0] + times[-1]) // 2)
+        earlier, later = split, len(times) - split
+        change = (later - earlier) / earlier
+        if change > TREND_THRESHOLD:
+            direction = "increasing"
+        elif change < -TREND_THRESHOLD:
+            direction = "decreasing"
+        else:
+            direction = "stable"
+        return {"direction": direction, "earlier_half": earlier, "later_half": later, "change": change}
+
+    def frequency_stats(self) -> Dict:
+        """Get the true per-day rate over the active span, the span itself and its trend"""
+        times = self.times
+        if not times:
+            return {
+                "total": 0,
+                "avg_per_day": 0.0,
+                "first": None,
+                "last": None,
+                "span_days": 0.0,
+                "active_days": 0,
+                "trend": self.trend(),
+            }
+
+        span_days = (times[-1] - times[0]) / DAY
+        return {
+            "total": len(times),
+            # Activity within a single day counts as one day
+            "avg_per_day": len(times) / max(span_days, 1.0),
+            "first": format_time(times[0]),
+            "last": format_time(times[-1]),
+            "span_days": span_days,
+            "active_days": len(self.counts("day")),
+            "trend": self.trend(),
+        }
+
+
+def activity_histogram(series: Dict[str, TimeSeries], bucket: str = "day") -> List[Dict]:
+    """Count several series per bucket, e.g. {"posts": ..., "comments": ...}"""
+    counts = {name: item.counts(bucket) for name, item in series.items()}
+    starts = sorted(set().union(*counts.values()))
+    return [
+        {"start": format_time(start, bucket), **{name: counts[name].get(start, 0) for name in counts}}
+        for start in starts
+    ]
+
+
+class TimeIndex:
+    """Records of one store sorted by ``created``, globally and per author"""
+
+    def __init__(self, created: Sequence[int], author_positions):
+        self.created = created
+        self.author_positions = author_positions
+        self.series = self._sort(range(len(created)))
+        self._authors: Dict[str, TimeSeries] = {}
+
+    @classmethod
+    def build(cls, records: Sequence[Dict]) -> "TimeIndex":
+        """Index a store (using its created column and author index) or a plain list"""
+        if hasattr(records, "columns"):
+            created = records.columns.get("created") or array("q", bytes(8 * len(records)))
+            return cls(created, records.author_positions)
+
+        created = array("q", (int(record.get("created") or 0) for record in records))
+        positions: Dict[str, List[int]] = {}
+        for row, record in enumerate(records):
+            if record.get("author"):
+                positions.setdefault(record["author"], []).append(row)
+        return cls(created, lambda author: positions.get(author, ()))
+
+    def _sort(self, rows: Iterable[int]) -> TimeSeries:
+        created = self.created
+        rows = array("q", (row for row in rows if created[row] > 0))
+        times = array("q", (created[row] for row in rows))
+        # Datasets are usually written in time order, which needs no sort
+        if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+            rows = array("q", sorted(rows, key=created.__getitem__))
+            times = array("q", (created[row] for row in rows))
+        return TimeSeries(times, rows)
+
+    def author_series(self, author: str) -> TimeSeries:
+        """Get an author's records sorted by time (sorted once, on first use)"""
+        series = self._authors.get(author)
+        if series is None:
+            series = self._authors[author] = self._sort(self.author_positions(author))
+        return series
+
+    def window(self, since: Optional[int] = None, until: Optional[int] = None) -> "TimeWindow":
+        return TimeWindow(self, since, until)
+
+
+class TimeWindow:
+    """The part of a TimeIndex in [since, until), with the same lookups"""
+
+    def __init__(self, index: TimeIndex, since: Optional[int], until: Optional[int]):
+        self.index = index
+        self.since = since
+        self.until = until
+        self.series = index.series.window(since, until)
+
+    def author_series(self, author: str) -> TimeSeries:
+        return self.index.author_series(author).window(self.since, self.until)
@@ -1,27 +1,94 @@
 import json
 import os
-from typing import Dict, List, Optional
-import re
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 from collections import Counter
-
-from RedditReportGenerator.common.utils import load_jsonl_file
-
-
-def load_posts(file_path: str = "r_OpenAI_posts.jsonl") -> List[Dict]:
-    """Load Reddit posts from JSONL file"""
-    return load_jsonl_file(file_path)
-
-
-def load_comments(file_path: str = "r_OpenAI_comments.jsonl") -> List[Dict]:
-    """Load Reddit comments from JSONL file"""
-    return load_jsonl_file(file_path)
-
-
-def get_user_posts(user_id: str, posts: List[Dict]) -> List[Dict]:
-    """Get all posts by a specific user (simplified version)"""
-    user_posts = [post for post in posts if post.get("author") == user_id]
-    # Return simplified post objects with only essential fields
-    return [{
+from itertools import chain
+
+from RedditReportGenerator.tools.reddit_graph import InfluenceScores, ReplyGraph, ReplyGraphBuilder
+from RedditReportGenerator.tools.reddit_keywords import TermMatrix, community_idf, merge_author_terms, top_terms
+from RedditReportGenerator.tools.reddit_profiles import ActivityStats, CommunityAggregates, UserProfile
+from RedditReportGenerator.tools.reddit_search import SearchIndex, snippet
+from RedditReportGenerator.tools.reddit_snapshot import open_snapshot
+from RedditReportGenerator.tools.reddit_sql import SqlDatabase
+from RedditReportGenerator.tools.reddit_store import RecordWindow, RedditRecords
+from RedditReportGenerator.tools.reddit_threads import ThreadIndex, record_id
+from RedditReportGenerator.tools.reddit_timeline import TimeIndex, TimeSeries, activity_histogram, parse_time
+from RedditReportGenerator.tools.reddit_text import (
+    SENTIMENT_FIELD,
+    batch_sentiment,
+    count_keywords,
+    record_text,
+    text_sentiment,
+)
+
+
+# Fields the tools read; everything else is dropped at load time
+POST_FIELDS = ("id", "author", "subreddit", "score", "created", "title", "url")
+COMMENT_FIELDS = ("id", "author", "subreddit", "score", "created", "parent_id", "link_id")
+
+# Large text fields are kept on disk and read back with pread when a tool needs them
+LAZY_TEXT_FIELDS = ("selftext", "body")
+
+# Answer count-ranked keyword queries from the per-author term matrix too
+# (TF-IDF queries always use it); building it tokenizes the whole dataset once
+USE_KEYWORD_MATRIX = os.getenv("KEYWORD_MATRIX", "0") == "1"
+
+# Essential fields returned by the user tools
+POST_VIEW_FIELDS = ("title", "selftext", "subreddit", "score", "id", "created", "url")
+COMMENT_VIEW_FIELDS = ("body", "subreddit", "score", "id", "created", "parent_id")
+
+
+def index_records(records: List[Dict]) -> RedditRecords:
+    """Wrap records in an author-indexed list unless they are already indexed"""
+    if hasattr(records, "by_author"):
+        return records
+    return RedditRecords(records)
+
+
+def _records_by_author(user_id: str, records: List[Dict]) -> List[Dict]:
+    """Get raw records (or record views) by a user, using the author index when available"""
+    if hasattr(records, "by_author"):
+        return records.by_author(user_id)
+    return [record for record in records if record.get("author") == user_id]
+
+
+def _author_stats(user_id: str, records: List[Dict]) -> ActivityStats:
+    """Get a user's aggregates from the store, or by scanning plain record lists"""
+    if hasattr(records, "author_stats"):
+        return records.author_stats(user_id)
+    return ActivityStats.from_records(_records_by_author(user_id, records))
+
+
+def get_user_profile(user_id: str, posts: List[Dict], comments: List[Dict]) -> UserProfile:
+    """Get the aggregated post and comment activity of a user"""
+    return UserProfile(user_id, _author_stats(user_id, posts), _author_stats(user_id, comments))
+
+
+def window_records(records: List[Dict], since=None, until=None) -> List[Dict]:
+    """Restrict records to those created in a time window
+
+    Args:
+        records: Posts or comments
+        since: Earliest time, as a unix timestamp or ISO date/datetime (inclusive)
+        until: Latest time, as a unix timestamp or ISO datetime (exclusive) or date (inclusive)
+    """
+    since, until = parse_time(since), parse_time(until, end=True)
+    if since is None and until is None:
+        return records
+    if hasattr(records, "window"):
+        return records.window(since, until)
+    return [
+        record for record in records
+        if (record.get("created") or 0) > 0
+        and (since is None or record["created"] >= since)
+        and (until is None or record["created"] < until)
+    ]
+
+
+def _simplify_post(post: Dict) -> Dict:
+    """Keep only the essential fields of a post"""
+    return {
         "title": post.get("title", ""),
         "selftext": post.get("selftext", ""),
         "subreddit": post.get("subreddit", ""),
@@ -29,229 +96,512 @@ def get_user_posts(user_id: str, posts: List[Dict]) -> List[Dict]:
         "id": post.get("id", ""),
         "created": post.get("created", 0),
         "url": post.get("url", "")
-    } for post in user_posts]
+    }
 
 
-def get_user_comments(user_id: str, comments: List[Dict]) -> List[Dict]:
-    """Get all comments by a specific user (simplified version)"""
-    user_comments = [comment for comment in comments if comment.get("author") == user_id]
-    # Return simplified comment objects with only essential fields
-    return [{
+def _simplify_comment(comment: Dict) -> Dict:
+    """Keep only the essential fields of a comment"""
+    return {
         "body": comment.get("body", ""),
         "subreddit": comment.get("subreddit", ""),
         "score": comment.get("score", 0),
         "id": comment.get("id", ""),
         "created": comment.get("created", 0),
         "parent_id": comment.get("parent_id", "")
-    } for comment in user_comments]
+    }
+
+
+def load_records(
+    file_path: str,
+    fields: Optional[Sequence[str]] = None,
+    lazy_fields: Sequence[str] = LAZY_TEXT_FIELDS,
+) -> RedditRecords:
+    """Load records from the file's snapshot if it is current, else parse the JSONL
+
+    Args:
+        file_path: Path to the JSONL file
+        fields: Fields to keep resident when parsing the JSONL (default: all)
+        lazy_fields: Fields read back from the file on access instead of kept resident
+    """
+    snapshot = open_snapshot(file_path)
+    if snapshot is not None:
+        return snapshot
+    if fields is None:
+        lazy_fields = ()
+    return RedditRecords.from_jsonl(file_path, fields=fields, lazy_fields=lazy_fields)
+
+
+def load_posts(
+    file_path: str = "r_OpenAI_posts.jsonl", fields: Optional[Sequence[str]] = POST_FIELDS
+) -> RedditRecords:
+    """Load Reddit posts from JSONL file (or its ingested snapshot)"""
+    return load_records(file_path, fields)
+
+
+def load_comments(
+    file_path: str = "r_OpenAI_comments.jsonl", fields: Optional[Sequence[str]] = COMMENT_FIELDS
+) -> RedditRecords:
+    """Load Reddit comments from JSONL file (or its ingested snapshot)"""
+    return load_records(file_path, fields)
+
+
+def get_user_posts(user_id: str, posts: List[Dict]) -> List[Dict]:
+    """Get all posts by a specific user (simplified version)"""
+    if hasattr(posts, "by_author"):
+        # Views over the store expose only the essential fields without copying
+        return posts.by_author(user_id, POST_VIEW_FIELDS)
+    # Return simplified post objects with only essential fields
+    return [_simplify_post(post) for post in _records_by_author(user_id, posts)]
+
+
+def get_user_comments(user_id: str, comments: List[Dict]) -> List[Dict]:
+    """Get all comments by a specific user (simplified version)"""
+    if hasattr(comments, "by_author"):
+        # Views over the store expose only the essential fields without copying
+        return comments.by_author(user_id, COMMENT_VIEW_FIELDS)
+    # Return simplified comment objects with only essential fields
+    return [_simplify_comment(comment) for comment in _records_by_author(user_id, comments)]
 
 
 def get_user_activity_count(user_id: str, posts: List[Dict], comments: List[Dict]) -> Dict:
     """Get user activity count (posts and comments)"""
-    user_posts = get_user_posts(user_id, posts)
-    user_comments = get_user_comments(user_id, comments)
-
-    return {
-        "total_posts": len(user_posts),
-        "total_comments": len(user_comments),
-        "total_activity": len(user_posts) + len(user_comments)
-    }
+    return get_user_profile(user_id, posts, comments).activity_count()
 
 
 def get_user_karma(user_id: str, posts: List[Dict], comments: List[Dict]) -> Dict:
     """Get user karma from posts and comments"""
-    user_posts = get_user_posts(user_id, posts)
-    user_comments = get_user_comments(user_id, comments)
-
-    post_karma = sum(post.get("score", 0) for post in user_posts)
-    comment_karma = sum(comment.get("score", 0) for comment in user_comments)
-
-    return {
-        "post_karma": post_karma,
-        "comment_karma": comment_karma,
-        "total_karma": post_karma + comment_karma
-    }
+    return get_user_profile(user_id, posts, comments).karma()
 
 
 def get_top_posts(user_id: str, posts: List[Dict], limit: int = 5) -> List[Dict]:
     """Get top N posts by a user based on score (simplified version)"""
     user_posts = get_user_posts(user_id, posts)
     sorted_posts = sorted(user_posts, key=lambda x: x.get("score", 0), reverse=True)
-    return [{
-        "title": post.get("title", ""),
-        "selftext": post.get("selftext", ""),
-        "subreddit": post.get("subreddit", ""),
-        "score": post.get("score", 0),
-        "id": post.get("id", ""),
-        "created": post.get("created", 0),
-        "url": post.get("url", "")
-    } for post in sorted_posts[:limit]]
+    return sorted_posts[:limit]
 
 
 def get_top_comments(user_id: str, comments: List[Dict], limit: int = 5) -> List[Dict]:
     """Get top N comments by a user based on score (simplified version)"""
     user_comments = get_user_comments(user_id, comments)
     sorted_comments = sorted(user_comments, key=lambda x: x.get("score", 0), reverse=True)
-    return [{
-        "body": comment.get("body", ""),
-        "subreddit": comment.get("subreddit", ""),
-        "score": comment.get("score", 0),
-        "id": comment.get("id", ""),
-        "created": comment.get("created", 0),
-        "parent_id": comment.get("parent_id", "")
-    } for comment in sorted_comments[:limit]]
-
+    return sorted_comments[:limit]
 
-def extract_keywords(text: str, top_n: int = 10) -> List[str]:
-    """Extract keywords from text using simple frequency analysis"""
-    # Remove punctuation and convert to lowercase
-    text = re.sub(r"[^\w\s]", "", text.lower())
-    words = text.split()
 
-    # Remove stop words (simple list)
-    stop_words = {
-        "the", "and", "for", "with", "you", "that", "this", "but", "not", "are", "were",
-        "was", "will", "would", "could", "should", "can", "if", "in", "on", "at", "by"
-    }
+def extract_keywords(text: str, top_n: int = 10, idf: Optional[Callable[[str], float]] = None) -> List[str]:
+    """Extract keywords from text using simple frequency analysis
 
-    filtered_words = [word for word in words if word not in stop_words and len(word) > 3]
+    Args:
+        text: Text to analyze
+        top_n: Number of keywords to return
+        idf: Term weighting (see get_keyword_idf) to rank by TF-IDF instead of frequency
+    """
+    return top_terms(count_keywords([text]), top_n, idf)
 
-    # Count word frequencies
-    word_counts = Counter(filtered_words)
 
-    return [word for word, count in word_counts.most_common(top_n)]
+def _term_matrix(records: List[Dict]) -> TermMatrix:
+    """Get the author x term matrix of the records, cached on stores"""
+    if hasattr(records, "term_matrix"):
+        return records.term_matrix()
+    return TermMatrix.build(records)
 
 
-def get_user_keywords(user_id: str, posts: List[Dict], comments: List[Dict], top_n: int = 10) -> List[str]:
-    """Get top keywords from a user's posts and comments"""
-    user_posts = get_user_posts(user_id, posts)
-    user_comments = get_user_comments(user_id, comments)
+def get_keyword_idf(posts: List[Dict], comments: List[Dict]) -> Callable[[str], float]:
+    """Get inverse document frequencies of keywords across the community"""
+    return community_idf([_term_matrix(posts), _term_matrix(comments)])
 
-    all_text = ""
-    for post in user_posts:
-        all_text += " " + (post.get("title", "") + " " + post.get("selftext", ""))
 
-    for comment in user_comments:
-        all_text += " " + comment.get("body", "")
+def get_user_keywords(
+    user_id: str, posts: List[Dict], comments: List[Dict], top_n: int = 10, tfidf: bool = False
+) -> List[str]:
+    """Get top keywords from a user's posts and comments, optionally TF-IDF weighted"""
+    if tfidf or USE_KEYWORD_MATRIX:
+        matrices = [_term_matrix(posts), _term_matrix(comments)]
+        counts = merge_author_terms(user_id, matrices)
+        return top_terms(counts, top_n, community_idf(matrices) if tfidf else None)
 
-    return extract_keywords(all_text, top_n)
+    texts = chain(
+        map(record_text, _records_by_author(user_id, posts)),
+        map(record_text, _records_by_author(user_id, comments)),
+    )
+    return top_terms(count_keywords(texts), top_n)
 
 
 def analyze_post_sentiment(text: str) -> float:
     """Analyze sentiment of text (simple implementation - placeholder for real NLP model)"""
-    positive_words = ["good", "great", "excellent", "awesome", "amazing", "perfect", "wonderful", "fantastic"]
-    negative_words = ["bad", "terrible", "awful", "horrible", "worst", "disappointing", "poor"]
-
-    text = text.lower()
-    pos_count = sum(1 for word in positive_words if word in text)
-    neg_count = sum(1 for word in negative_words if word in text)
-
-    total_count = pos_count + neg_count
-    if total_count == 0:
-        return 0.0
-
-    return (pos_count - neg_count) / total_count
+    return text_sentiment(text)
 
 
 def get_user_sentiment(user_id: str, posts: List[Dict], comments: List[Dict]) -> Dict:
     """Get sentiment analysis of a user's posts and comments"""
-    user_posts = get_user_posts(user_id, posts)
-    user_comments = get_user_comments(user_id, comments)
+    return get_user_profile(user_id, posts, comments).sentiment()
 
-    post_sentiments = []
-    for post in user_posts:
-        text = post.get("title", "") + " " + post.get("selftext", "")
-        post_sentiments.append(analyze_post_sentiment(text))
 
-    comment_sentiments = []
-    for comment in user_comments:
-        text = comment.get("body", "")
-        comment_sentiments.append(analyze_post_sentiment(text))
+def _sentiment_total(records: List[Dict]) -> float:
+    """Sum the sentiment of all records, from the precomputed column when available"""
+    if hasattr(records, "column_total"):
+        return records.column_total(SENTIMENT_FIELD)
+    return sum(batch_sentiment(map(record_text, records)))
 
-    avg_post_sentiment = sum(post_sentiments) / len(post_sentiments) if post_sentiments else 0.0
-    avg_comment_sentiment = sum(comment_sentiments) / len(comment_sentiments) if comment_sentiments else 0.0
-    overall_sentiment = (
-        (sum(post_sentiments) + sum(comment_sentiments)) /
-        (len(post_sentiments) + len(comment_sentiments))
-    ) if (post_sentiments or comment_sentiments) else 0.0
+
+def get_community_sentiment(posts: List[Dict], comments: List[Dict]) -> Dict:
+    """Get average sentiment of all posts and comments in the community"""
+    post_total, comment_total = _sentiment_total(posts), _sentiment_total(comments)
+    total_count = len(posts) + len(comments)
 
     return {
-        "avg_post_sentiment": avg_post_sentiment,
-        "avg_comment_sentiment": avg_comment_sentiment,
-        "overall_sentiment": overall_sentiment,
-        "post_sentiment_count": len(post_sentiments),
-        "comment_sentiment_count": len(comment_sentiments)
+        "avg_post_sentiment": post_total / len(posts) if posts else 0.0,
+        "avg_comment_sentiment": comment_total / len(comments) if comments else 0.0,
+        "overall_sentiment": (post_total + comment_total) / total_count if total_count else 0.0,
+        "post_count": len(posts),
+        "comment_count": len(comments)
     }
 
 
 def get_post_comment_ratio(user_id: str, posts: List[Dict], comments: List[Dict]) -> float:
     """Get ratio of posts to comments"""
-    user_posts = get_user_posts(user_id, posts)
-    user_comments = get_user_comments(user_id, comments)
+    activity = get_user_activity_count(user_id, posts, comments)
+
+    if activity["total_comments"] == 0:
+        return float(activity["total_posts"])
+
+    return activity["total_posts"] / activity["total_comments"]
+
+
+def _author_counts(records: List[Dict]) -> Dict[str, int]:
+    """Count records per author, in order of first appearance"""
+    if hasattr(records, "author_counts"):
+        return records.author_counts()
+    counts = Counter()
+    for record in records:
+        if record.get("author"):
+            counts[record["author"]] += 1
+    return counts
+
+
+def _window_derived(posts: List[Dict], comments: List[Dict], key: str, build: Callable[[], object]):
+    """Get data built from time windows of the posts and comments, cached with the posts window
 
-    if len(user_comments) == 0:
-        return float(len(user_posts))
+    Returns None unless both are windows, which the single-entry caches of
+    the whole dataset below are kept for.
+    """
+    if not (isinstance(posts, RecordWindow) and isinstance(comments, RecordWindow)):
+        return None
+    return posts.derived((key, comments), build)
 
-    return len(user_posts) / len(user_comments)
+
+# Aggregates of the most recently queried dataset, with the store versions they were built from
+_community_cache = None
+
+
+def get_community_aggregates(posts: List[Dict], comments: List[Dict]) -> CommunityAggregates:
+    """Get community totals and author ranking, built once per dataset version"""
+    global _community_cache
+
+    def build() -> CommunityAggregates:
+        return CommunityAggregates.build(len(posts), len(comments), _author_counts(posts), _author_counts(comments))
+
+    windowed = _window_derived(posts, comments, "community_aggregates", build)
+    if windowed is not None:
+        return windowed
+
+    versions = (getattr(posts, "version", None), getattr(comments, "version", None))
+    cached = _community_cache
+    if cached is not None and cached[0] is posts and cached[1] is comments and cached[2] == versions:
+        return cached[3]
+
+    aggregates = build()
+    # Plain lists can change without notice, so only versioned stores are cached
+    if None not in versions:
+        _community_cache = (posts, comments, versions, aggregates)
+    return aggregates
 
 
 def get_community_activity_stats(posts: List[Dict], comments: List[Dict]) -> Dict:
     """Get community activity statistics"""
-    total_posts = len(posts)
-    total_comments = len(comments)
-    total_authors = set()
+    return get_community_aggregates(posts, comments).activity_stats()
+
+
+def get_top_authors(posts: List[Dict], comments: List[Dict], limit: int = 10) -> List[Dict]:
+    """Get top authors by total activity"""
+    return get_community_aggregates(posts, comments).top_authors(limit)
 
-    for post in posts:
-        if post.get("author"):
-            total_authors.add(post["author"])
 
-    for comment in comments:
-        if comment.get("author"):
-            total_authors.add(comment["author"])
+def _time_index(records: List[Dict]) -> TimeIndex:
+    """Get the records sorted by time, cached on stores"""
+    if hasattr(records, "time_index"):
+        return records.time_index()
+    return TimeIndex.build(records)
 
-    avg_comments_per_post = total_comments / total_posts if total_posts > 0 else 0.0
+
+def get_post_frequency_stats(posts: List[Dict]) -> Dict:
+    """Get post frequency statistics over the period the posts actually span"""
+    stats = _time_index(posts).series.frequency_stats()
 
     return {
-        "total_posts": total_posts,
-        "total_comments": total_comments,
-        "total_authors": len(total_authors),
-        "avg_comments_per_post": avg_comments_per_post
+        "total_posts": len(posts),
+        "avg_posts_per_day": stats["avg_per_day"],
+        "first_post": stats["first"],
+        "last_post": stats["last"],
+        "span_days": stats["span_days"],
+        "active_days": stats["active_days"],
+        "trend": stats["trend"]
     }
 
 
-def get_top_authors(posts: List[Dict], comments: List[Dict], limit: int = 10) -> List[Dict]:
-    """Get top authors by total activity"""
-    author_counts = Counter()
+def get_user_timeline(user_id: str, posts: List[Dict], comments: List[Dict], bucket: str = "day") -> Dict:
+    """Get a user's activity rate, span and trend, and posts/comments per time bucket"""
+    user_posts = _time_index(posts).author_series(user_id)
+    user_comments = _time_index(comments).author_series(user_id)
 
-    for post in posts:
-        if post.get("author"):
-            author_counts[post["author"]] += 1
+    return {
+        "activity": TimeSeries.merged([user_posts, user_comments]).frequency_stats(),
+        "histogram": activity_histogram({"posts": user_posts, "comments": user_comments}, bucket)
+    }
 
-    for comment in comments:
-        if comment.get("author"):
-            author_counts[comment["author"]] += 1
 
-    top_authors = []
-    for author, count in author_counts.most_common(limit):
-        top_authors.append({
-            "author": author,
-            "activity_count": count
-        })
+def get_community_timeline(posts: List[Dict], comments: List[Dict], bucket: str = "day") -> Dict:
+    """Get community activity rate, span and trend, and posts/comments per time bucket"""
+    all_posts, all_comments = _time_index(posts).series, _time_index(comments).series
 
-    return top_authors
+    return {
+        "activity": TimeSeries.merged([all_posts, all_comments]).frequency_stats(),
+        "histogram": activity_histogram({"posts": all_posts, "comments": all_comments}, bucket)
+    }
 
 
-def get_post_frequency_stats(posts: List[Dict]) -> Dict:
-    """Get post frequency statistics"""
-    if not posts:
-        return {
-            "total_posts": 0,
-            "avg_posts_per_day": 0.0
-        }
+_reply_graph_cache = None
+_influence_cache = None
+_graph_lock = threading.Lock()
+
+
+def get_reply_graph(posts: List[Dict], comments: List[Dict]) -> ReplyGraph:
+    """Get the author reply graph, built once per dataset version
+
+    Stores only ever grow, so a new version of the same stores only adds the
+    appended records to the reply counts.
+    """
+    global _reply_graph_cache
+
+    def build() -> ReplyGraph:
+        builder = ReplyGraphBuilder()
+        builder.add(posts, comments)
+        return builder.graph()
 
-    total_posts = len(posts)
+    windowed = _window_derived(posts, comments, "reply_graph", build)
+    if windowed is not None:
+        return windowed
 
+    versions = (getattr(posts, "version", None), getattr(comments, "version", None))
+    with _graph_lock:
+        cached = _reply_graph_cache
+        builder = None
+        if cached is not None and cached[0] is posts and cached[1] is comments:
+            if cached[2] == versions:
+                return cached[4]
+            builder = cached[3]
+        if builder is None or not builder.extends(posts, comments):
+            builder = ReplyGraphBuilder()
+
+        builder.add(posts, comments)
+        graph = builder.graph()
+        if None not in versions:
+            _reply_graph_cache = (posts, comments, versions, builder, graph)
+        return graph
+
+
+def get_influence_scores(posts: List[Dict], comments: List[Dict]) -> InfluenceScores:
+    """Get every author's PageRank in the reply graph, computed once per dataset version"""
+    global _influence_cache
+    windowed = _window_derived(
+        posts, comments, "influence", lambda: InfluenceScores.compute(get_reply_graph(posts, comments), None)
+    )
+    if windowed is not None:
+        return windowed
+
+    graph = get_reply_graph(posts, comments)
+    with _graph_lock:
+        cached = _influence_cache
+        if cached is not None and cached.graph is graph:
+            return cached
+        # PageRank does not depend on the starting point, and the scores of
+        # an earlier version are close to those of the next one
+        scores = InfluenceScores.compute(graph, cached)
+        if _reply_graph_cache is not None and _reply_graph_cache[4] is graph:
+            _influence_cache = scores
+        return scores
+
+
+def get_user_interlocutors(user_id: str, posts: List[Dict], comments: List[Dict], limit: int = 10) -> List[Dict]:
+    """Get the users a user exchanged most replies with"""
+    return get_reply_graph(posts, comments).interlocutors(user_id, limit)
+
+
+def get_user_reply_stats(user_id: str, posts: List[Dict], comments: List[Dict]) -> Dict:
+    """Get how many users a user replied to and was replied to by, and how often it was mutual"""
+    return get_reply_graph(posts, comments).degree_stats(user_id)
+
+
+def get_user_influence(user_id: str, posts: List[Dict], comments: List[Dict]) -> Dict:
+    """Get a user's PageRank in the reply graph, with rank and percentile"""
+    return get_influence_scores(posts, comments).author_influence(user_id)
+
+
+def get_influential_authors(posts: List[Dict], comments: List[Dict], limit: int = 10) -> List[Dict]:
+    """Get the authors with the highest PageRank in the reply graph"""
+    return get_influence_scores(posts, comments).top_authors(limit)
+
+
+def _thread_index(comments: List[Dict]) -> ThreadIndex:
+    """Get the comment trees, cached on stores"""
+    if hasattr(comments, "thread_index"):
+        return comments.thread_index()
+    return ThreadIndex(comments)
+
+
+def _find_post(post_id: str, posts: List[Dict]) -> Optional[Dict]:
+    """Get a post by id, using the store's id index when available"""
+    post_id = record_id(post_id)
+    if not post_id:
+        return None
+    if hasattr(posts, "id_rows"):
+        row = posts.id_rows().get(post_id)
+        return None if row is None else posts.view(row)
+    return next((post for post in posts if record_id(post.get("id")) == post_id), None)
+
+
+def _thread_comment(comment: Dict, index: ThreadIndex, row: int) -> Dict:
+    """Keep the essential fields of a comment plus its author and place in the thread"""
+    return {
+        "author": comment.get("author", ""),
+        **_simplify_comment(comment),
+        "depth": index.depths[row],
+        "replies": index.sizes[row] - 1,
+    }
+
+
+def get_comment_context(comment_id: str, posts: List[Dict], comments: List[Dict], reply_limit: int = 5) -> Dict:
+    """Get the post and parent comments a comment answers, and its top direct replies"""
+    index = _thread_index(comments)
+    row = index.row_of(comment_id)
+    if row is None:
+        raise ValueError(f"Unknown comment {comment_id!r}")
+
+    comment = comments[row]
+    ancestors = index.ancestors(row)
+    top = comments[ancestors[0]] if ancestors else comment
+    parent_id = top.get("parent_id") or ""
+    post = _find_post(parent_id if parent_id.startswith("t3_") else top.get("link_id") or "", posts)
+    replies = sorted(index.children(row), key=lambda child: comments[child].get("score") or 0, reverse=True)
+
+    return {
+        "post": None if post is None else {"author": post.get("author", ""), **_simplify_post(post)},
+        "ancestors": [_thread_comment(comments[parent], index, parent) for parent in ancestors],
+        "comment": _thread_comment(comment, index, row),
+        "top_replies": [_thread_comment(comments[child], index, child) for child in replies[:reply_limit]],
+    }
+
+
+def get_user_comment_contexts(user_id: str, posts: List[Dict], comments: List[Dict], limit: int = 3) -> List[Dict]:
+    """Get the thread context of a user's top comments by score"""
+    index = _thread_index(comments)
+    top_comments = get_top_comments(user_id, comments, limit)
+    return [
+        get_comment_context(comment["id"], posts, comments)
+        for comment in top_comments
+        if index.row_of(comment["id"]) is not None
+    ]
+
+
+def get_thread_engagement(post_id: str, posts: List[Dict], comments: List[Dict]) -> Dict:
+    """Get the size, depth and participation of a post's comment thread"""
+    post = _find_post(post_id, posts)
+    post_author = post.get("author") if post is not None else None
     return {
-        "total_posts": total_posts,
-        "avg_posts_per_day": total_posts / 30  # Assuming 30-day period for simplicity
+        "post_id": record_id(post_id),
+        "title": post.get("title", "") if post is not None else "",
+        "author": post_author or "",
+        "score": post.get("score", 0) if post is not None else 0,
+        **_thread_index(comments).thread_stats(post_id, comments, post_author),
     }
+
+
+def _search_records(
+    query: str, records: List[Dict], author: Optional[str], since: Optional[int], until: Optional[int], limit: int
+) -> List[Tuple[Dict, float]]:
+    """Rank records by relevance to a query, optionally by one author within a time window"""
+    if hasattr(records, "search_index"):
+        index, rows = records.search_index(), records.author_positions(author) if author else None
+    else:
+        index = SearchIndex.build(records)
+        rows = [row for row, record in enumerate(records) if record.get("author") == author] if author else None
+
+    accept = None
+    if since is not None or until is not None:
+        low, high = since if since is not None else 1, until if until is not None else float("inf")
+
+        def accept(row: int) -> bool:
+            return low <= (records[row].get("created") or 0) < high
+
+    return [(records[row], relevance) for row, relevance in index.search(query, rows, accept, limit)]
+
+
+def search_content(
+    query: str,
+    posts: List[Dict],
+    comments: List[Dict],
+    author: Optional[str] = None,
+    since=None,
+    until=None,
+    limit: int = 10,
+) -> List[Dict]:
+    """Search post and comment text, most relevant first, with a snippet around the match"""
+    since, until = parse_time(since), parse_time(until, end=True)
+    results = [
+        (kind, record, relevance)
+        for kind, records in (("post", posts), ("comment", comments))
+        for record, relevance in _search_records(query, records, author, since, until, limit)
+    ]
+    results.sort(key=lambda result: result[2], reverse=True)
+    return [
+        {
+            "type": kind,
+            "id": record.get("id", ""),
+            "author": record.get("author", ""),
+            "title": record.get("title", "") if kind == "post" else "",
+            "score": record.get("score", 0),
+            "created": record.get("created", 0),
+            "relevance": relevance,
+            "snippet": snippet(record_text(record).strip(), query),
+        }
+        for kind, record, relevance in results[:limit]
+    ]
+
+
+_sql_cache = None
+_sql_lock = threading.Lock()
+
+
+def get_sql_database(posts: List[Dict], comments: List[Dict]) -> SqlDatabase:
+    """Get the SQLite copy of the dataset, loading only records appended since the last version"""
+    global _sql_cache
+    versions = (getattr(posts, "version", None), getattr(comments, "version", None))
+    with _sql_lock:
+        cached = _sql_cache
+        if cached is not None and cached[0] is posts and cached[1] is comments:
+            if cached[2] == versions:
+                return cached[3]
+            database = cached[3]
+            if not database.extends(posts, comments):
+                database = SqlDatabase()
+        else:
+            database = SqlDatabase()
+
+        database.load(posts, comments)
+        if None not in versions:
+            _sql_cache = (posts, comments, versions, database)
+        return database
+
+
+def run_sql_query(sql: str, posts: List[Dict], comments: List[Dict], max_rows: int = 100) -> Dict:
+    """Run a read-only, row- and time-limited SQL query over the posts and comments tables"""
+    return get_sql_database(posts, comments).query(sql, max_rows)
@@ -0,0 +1,327 @@
+"""
+Memoization of tool results, in process and on disk.
+
+Analysts call the same tools with the same arguments across questions,
+TODO items and perspectives. Results are cached under the tool name, its
+arguments bound to the signature (so positional, keyword and default
+spellings of a call share an entry) and the version of the dataset the
+call reads, so they are dropped once new records are ingested. The cache
+is bounded by the JSON size of the results and evicts least recently used
+entries first.
+
+Results of data loaded from files are also kept in a SQLite database keyed
+by the dataset's fingerprint (its source file, how much of it was read and
+how it was loaded) instead of its in-process version, so later runs and
+other worker processes reuse them. The database is bounded by size as well
+and evicts the entries used least recently, across all processes.
+
+Cached results are shared between callers and must not be modified.
+"""
+
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+from RedditReportGenerator.common.utils import json_default
+
+# Total JSON size of the cached results; 0 disables caching
+TOOL_CACHE_BYTES = int(os.getenv("TOOL_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Database of results kept across runs ("" disables it) and its size limit
+TOOL_CACHE_PATH = os.getenv("TOOL_CACHE_PATH", "tool_cache.sqlite")
+TOOL_CACHE_DISK_BYTES = int(os.getenv("TOOL_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+
+# Part of every persistent key; bump it when tools return different results
+# for the same data, so entries written by older code are never served
+TOOL_CACHE_VERSION = 1
+
+# Arguments holding the dataset, keyed by its version instead of its content
+DATASET_ARGUMENTS = ("posts", "comments")
+
+
+_store_ids_lock = threading.Lock()
+_store_ids: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_next_store_id = itertools.count(1)
+
+
+def dataset_key(records) -> Optional[Hashable]:
+    """Identify a versioned store and its version (None for anything else)
+
+    Stores get ids that are never reused, unlike id(), so results cached for
+    a store that was replaced can't be served for its successor.
+    """
+    version = getattr(records, "version", None)
+    if version is None:
+        return None
+    with _store_ids_lock:
+        store_id = _store_ids.get(records)
+        if store_id is None:
+            store_id = _store_ids[records] = next(_next_store_id)
+    return store_id, version
+
+
+def dataset_fingerprint(records) -> Optional[str]:
+    """Identify a store's data across processes (None unless it was loaded from a file)"""
+    fingerprint = getattr(records, "fingerprint", None)
+    return fingerprint() if fingerprint is not None else None
+
+
+class ToolCache:
+    """LRU cache of tool results bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes: int = TOOL_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        """Get a cached result, or raise KeyError"""
+        with self.lock:
+            try:
+                result = self.entries[key][0]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: Hashable, result, size: Optional[int] = None):
+        """Cache a result, given its JSON size if already known"""
+        if size is None:
+            size = len(json.dumps(result, default=json_default))
+        with self.lock:
+            if size > self.max_bytes or key in self.entries:
+                return
+            self.entries[key] = (result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict:
+        with self.lock:
+            calls = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / calls if calls else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+
+class DiskToolCache:
+    """SQLite table of JSON-encoded tool results shared by runs and processes
+
+    The database is opened on first use. Errors (a locked, full or unwritable
+    database) are logged and treated as misses, so they never fail a tool.
+    """
+
+    def __init__(self, path: str = TOOL_CACHE_PATH, max_bytes: int = TOOL_CACHE_DISK_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            connection.commit()
+            self.connection = connection
+        return self.connection
+
+    def get(self, key: str) -> Optional[str]:
+        """Get a cached JSON result, or None"""
+        with self.lock:
+            try:
+                connection = self._connect()
+                row = connection.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+                    connection.commit()
+            except (sqlite3.Error, OSError) as e:
+                logging.warning(f"Tool cache {self.path} is unavailable: {e}")
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, encoded: str):
+        """Store a JSON result, evicting the least recently used ones beyond the size limit"""
+        size = len(encoded)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            try:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, encoded, size, time.time())
+                )
+                excess = connection.execute("SELECT total(size) FROM results").fetchone()[0] - self.max_bytes
+                if excess > 0:
+                    evicted = []
+                    for old_key, old_size in connection.execute("SELECT key, size FROM results ORDER BY used"):
+                        if excess <= 0:
+                            break
+                        evicted.append((old_key,))
+                        excess -= old_size
+                    connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+                    self.evictions += len(evicted)
+                connection.commit()
+            except (sqlite3.Error, OSError) as e:
+                logging.warning(f"Tool cache {self.path} is unavailable: {e}")
+
+    def clear(self):
+        with self.lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM results")
+            connection.commit()
+
+    def stats(self) -> Dict:
+        with self.lock:
+            calls = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / calls if calls else 0.0,
+                "evictions": self.evictions,
+            }
+            if self.connection is not None:
+                entries, size = self.connection.execute("SELECT count(*), total(size) FROM results").fetchone()
+                stats.update(entries=entries, bytes=int(size))
+            return stats
+
+
+tool_cache = ToolCache()
+disk_tool_cache = DiskToolCache() if TOOL_CACHE_PATH else None
+
+
+def memoize_tool(
+    dataset: Callable[[], Optional[Sequence]],
+    cache: ToolCache = tool_cache,
+    persistent: Optional[DiskToolCache] = disk_tool_cache,
+):
+    """Cache a tool's results per normalized arguments and dataset version
+
+    Args:
+        dataset: Returns the stores a tool reads when it is not given its
+            posts and comments (e.g. the global data), or None when that data
+            can't be keyed
+        cache: In-process cache to use
+        persistent: Cache kept across runs, or None
+
+    Calls passing posts or comments that are not versioned stores, or
+    arguments that are not JSON values, are not cached. Results are only
+    kept across runs when the data they read was loaded from files, and
+    when they come back unchanged from JSON.
+    """
+
+    def decorator(tool: Callable) -> Callable:
+        signature = inspect.signature(tool)
+
+        @functools.wraps(tool)
+        def wrapper(*args, **kwargs):
+            keys = _call_keys(tool.__name__, signature, args, kwargs, dataset)
+            if keys is None or not (cache.max_bytes or persistent):
+                return tool(*args, **kwargs)
+            key, persistent_key = keys
+            if persistent is None:
+                persistent_key = None
+
+            try:
+                return cache.get(key)
+            except KeyError:
+                pass
+            if persistent_key is not None:
+                encoded = persistent.get(persistent_key)
+                if encoded is not None:
+                    result = json.loads(encoded)
+                    cache.put(key, result, len(encoded))
+                    return result
+
+            result = tool(*args, **kwargs)
+            encoded = json.dumps(result, default=json_default)
+            cache.put(key, result, len(encoded))
+            if persistent_key is not None and json.loads(encoded) == result:
+                persistent.put(persistent_key, encoded)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _call_keys(name: str, signature: inspect.Signature, args, kwargs, dataset) -> Optional[Tuple]:
+    """Get the in-process key of a call and its persistent key (None if the data isn't from files)"""
+    try:
+        bound = signature.bind(*args, **kwargs)
+    except TypeError:
+        # Let the tool itself report the bad call
+        return None
+    bound.apply_defaults()
+
+    # Tools may read the global data unless given all the data they take
+    arguments, stores = {}, []
+    uses_global_data = not any(parameter in DATASET_ARGUMENTS for parameter in bound.arguments)
+    for parameter, value in bound.arguments.items():
+        if parameter in DATASET_ARGUMENTS:
+            if value is None:
+                uses_global_data = True
+            else:
+                stores.append(value)
+                value = True
+        arguments[parameter] = value
+    try:
+        normalized = json.dumps(arguments, sort_keys=True)
+    except TypeError:
+        return None
+    if uses_global_data:
+        global_stores = dataset()
+        if global_stores is None:
+            return None
+        stores.extend(global_stores)
+
+    versions = tuple(dataset_key(records) for records in stores)
+    if None in versions:
+        return None
+    key = (name, normalized, versions)
+    fingerprints = [dataset_fingerprint(records) for records in stores]
+    if None in fingerprints:
+        return key, None
+    persistent_key = json.dumps([TOOL_CACHE_VERSION, name, normalized, fingerprints])
+    return key, hashlib.sha256(persistent_key.encode()).hexdigest()